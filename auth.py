@@ -9,6 +9,13 @@ class TwitterCookieHandler:
         self.input_path = input_path
         self.output_path = output_path
 
+    def needs_conversion(self):
+        """変換元が変換済みファイルより新しい（または未変換の）場合にTrueを返す"""
+        if not os.path.exists(self.output_path):
+            return True
+        return os.path.exists(self.input_path) and \
+            os.path.getmtime(self.input_path) > os.path.getmtime(self.output_path)
+
     def convert_json(self):
         """Cookie-Editorから出力されたJSONを変換する"""
         try:
@@ -30,11 +37,13 @@ class TwitterCookieHandler:
             if name and value:
                 result[name] = value
 
-        # 変換後のJSONを保存
+        # 変換後のJSONを保存（書き込み途中で壊れないよう一時ファイル経由）
         try:
             os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
-            with open(self.output_path, 'w', encoding='utf-8') as file:
+            tmp_path = self.output_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as file:
                 json.dump(result, file, sort_keys=True, indent=4)
+            os.replace(tmp_path, self.output_path)
             return True
         except Exception as e:
             print(f"エラー: 変換後のJSONの保存に失敗しました: {e}")
@@ -63,9 +72,9 @@ class TwitterClient:
             return False
 
 async def main():
-    # Cookie変換処理
+    # Cookie変換処理（cookie.jsonが更新された場合のみ）
     cookie_handler = TwitterCookieHandler()
-    if not cookie_handler.convert_json():
+    if cookie_handler.needs_conversion() and not cookie_handler.convert_json():
         return
 
     # クライアント初期化
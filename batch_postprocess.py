@@ -0,0 +1,261 @@
+"""
+保存済みツイートの一括後処理
+目的: search_results/ や keyword_search_results/ に蓄積した大量のツイートを
+      プロセスプールで並列に再分析する
+機能:
+- ファイルをバイト範囲ごとのシャードに分割（ワーカーにはパスとシャード番号のみを渡し、
+  各ワーカーは担当範囲から始まるレコードだけを解析する）
+- シャードごとのメンション・投稿者・日別件数・キーワード出現場所の集計
+- Excel出力用の行データ作成と、シャード結果（Counter・行データ）の結合
+
+使い方:
+    python batch_postprocess.py --keyword Python --workers 8 --excel
+"""
+
+import argparse
+import glob
+import json
+import mmap
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from record_utils import (
+    build_keyword_row,
+    extract_mentions,
+    find_keyword_locations,
+    normalize_record,
+    parse_created_at,
+)
+from time_utils import parse_created_at_series, snowflake_to_datetime, to_excel_datetime
+
+DEFAULT_SOURCE_DIRS = ("search_results", "keyword_search_results")
+
+
+def _load_records(path):
+    """JSONファイル全体を読み込む"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data if isinstance(data, list) else []
+
+
+def _record_marker(path):
+    """字下げ付きで保存された配列（json.dump(..., indent=2) など）の、最上位の要素の開始位置を表すバイト列を返す
+
+    最上位の要素は「改行 + 1段分の字下げ + {」から始まり、文字列中の改行はエスケープされるため、
+    このバイト列は要素の開始位置にしか現れない。字下げの無い形式ならNone
+    """
+    with open(path, 'rb') as f:
+        head = f.read(64)
+    if not head.startswith(b'[\n'):
+        return None
+    indent = len(head[2:]) - len(head[2:].lstrip(b' '))
+    if indent == 0 or head[2 + indent:3 + indent] != b'{':
+        return None
+    return b'\n' + b' ' * indent + b'{'
+
+
+def _read_shard(path, index, count):
+    """シャードのバイト範囲から始まるレコードのみを解析して返す（ファイル全体は解析しない）"""
+    marker = _record_marker(path) if count > 1 else None
+    if marker is None:
+        return _load_records(path) if index == 0 else []
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        start = size * index // count
+        stop = size * (index + 1) // count
+        # 開始位置が範囲内のレコードを担当する（範囲の終わりをまたぐレコードも最後まで読む）
+        first = mm.find(marker, start)
+        if first == -1 or first >= stop:
+            return []
+        end = mm.find(marker, stop)
+        segment = mm[first:end if end != -1 else size].strip()
+    if end == -1:
+        # ファイルの末尾を含む場合は配列の閉じ括弧を除く
+        segment = segment[:-1].rstrip() if segment.endswith(b']') else segment
+    return json.loads(b'[' + segment.rstrip(b',') + b']')
+
+
+def discover_files(source_dirs=DEFAULT_SOURCE_DIRS):
+    """対象ディレクトリ内のJSONファイルを列挙する"""
+    files = []
+    for source_dir in source_dirs:
+        files.extend(sorted(glob.glob(os.path.join(source_dir, '*.json'))))
+    return files
+
+
+def plan_shards(files, shard_bytes=8 * 1024 * 1024):
+    """ファイルを (パス, シャード番号, シャード数) に分割する
+
+    親プロセスではJSONを解析せず、ファイルサイズからシャード数を決める
+    （字下げの無い形式のファイルはレコードの境界が分からないため分割しない）
+    """
+    shards = []
+    for path in files:
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"読み込みエラー: {path}: {e}")
+            continue
+        count = max(1, -(-size // shard_bytes))
+        if count > 1 and _record_marker(path) is None:
+            count = 1
+        shards.extend((path, index, count) for index in range(count))
+    return shards
+
+
+def process_shard(shard, keyword=None, with_rows=False):
+    """1シャード分のレコードを集計する（ワーカープロセスで実行）"""
+    path, index, count = shard
+    records = _read_shard(path, index, count)
+    mentions = Counter()
+    authors = Counter()
+    daily = Counter()
+    locations = Counter()
+    rows = []
+    searched_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    for record in records:
+        result = normalize_record(record)
+        user = result['user']
+        tweet = result['tweet']
+
+        mentions.update(extract_mentions(tweet['text'], exclude=user['screen_name']))
+        authors[user['screen_name']] += 1
+
+        # 日別集計はツイートIDから日時を求める（IDが無い古い形式のみ文字列を解析）
+        if str(tweet['tweet_id']).isdigit():
+            created_at = snowflake_to_datetime(tweet['tweet_id'])
+        else:
+            created_at = parse_created_at(tweet['created_at'])
+        if created_at is not None:
+            daily[created_at.date().isoformat()] += 1
+
+        if keyword:
+            result['keyword_locations'] = find_keyword_locations(
+                keyword,
+                tweet['text'],
+                user['profile_description'],
+                user['name'],
+                user['screen_name']
+            )
+            locations.update(result['keyword_locations'])
+
+        if with_rows:
+            rows.append(build_keyword_row(result, keyword or '', '', searched_at))
+
+    return {
+        'records': len(records),
+        'mentions': mentions,
+        'authors': authors,
+        'daily': daily,
+        'keyword_locations': locations,
+        'rows': rows,
+    }
+
+
+def _process_shard_args(args):
+    """ProcessPoolExecutor.map 用のラッパー"""
+    return process_shard(*args)
+
+
+def merge_results(shard_results):
+    """シャードごとの集計結果を結合する"""
+    merged = {
+        'records': 0,
+        'mentions': Counter(),
+        'authors': Counter(),
+        'daily': Counter(),
+        'keyword_locations': Counter(),
+        'rows': [],
+    }
+    for result in shard_results:
+        merged['records'] += result['records']
+        for key in ('mentions', 'authors', 'daily', 'keyword_locations'):
+            merged[key].update(result[key])
+        merged['rows'].extend(result['rows'])
+    return merged
+
+
+def run_postprocess(files, keyword=None, workers=None, shard_mb=8, with_rows=False):
+    """シャードをプロセスプールで処理して結合結果を返す"""
+    shards = plan_shards(files, int(shard_mb * 1024 * 1024))
+    print(f"{len(files)}ファイル / {len(shards)}シャードを処理します")
+    tasks = [(shard, keyword, with_rows) for shard in shards]
+
+    if workers == 1 or len(shards) <= 1:
+        results = map(_process_shard_args, tasks)
+        return merge_results(results)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # 小さなシャードが多い場合もプロセス間通信の回数を抑える
+        batch = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 4))
+        results = executor.map(_process_shard_args, tasks, chunksize=batch)
+        return merge_results(results)
+
+
+def save_summary(merged, results_dir="postprocess_results", top_n=50):
+    """集計結果をJSONファイルとして保存する"""
+    try:
+        os.makedirs(results_dir, exist_ok=True)
+        current_time = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = os.path.join(results_dir, f"postprocess_{current_time}.json")
+        summary = {
+            'records': merged['records'],
+            'top_mentions': merged['mentions'].most_common(top_n),
+            'top_authors': merged['authors'].most_common(top_n),
+            'daily_counts': dict(sorted(merged['daily'].items())),
+            'keyword_locations': dict(merged['keyword_locations']),
+        }
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"集計結果を保存しました: {filename}")
+        return filename
+    except Exception as e:
+        print(f"保存エラー: {e}")
+        return None
+
+
+def save_to_excel(merged, results_dir="postprocess_results"):
+    """行データをExcelファイルとして保存する"""
+    try:
+        import pandas as pd
+
+        os.makedirs(results_dir, exist_ok=True)
+        df = pd.DataFrame(merged['rows'])
+        if '投稿日時' in df:
+            df['投稿日時'] = to_excel_datetime(parse_created_at_series(df['投稿日時']))
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        excel_file = f"{results_dir}/一括後処理_{timestamp}.xlsx"
+        df.to_excel(excel_file, sheet_name='後処理結果', index=False, engine='openpyxl')
+        print(f"\nExcelファイルを保存しました: {excel_file}")
+        return excel_file
+    except Exception as e:
+        print(f"Excelファイルの保存中にエラーが発生しました: {e}")
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="保存済みツイートの一括後処理")
+    parser.add_argument('dirs', nargs='*', default=list(DEFAULT_SOURCE_DIRS))
+    parser.add_argument('--keyword', default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--shard-mb', type=float, default=8, help="1シャードあたりのファイルサイズ（MB）")
+    parser.add_argument('--excel', action='store_true')
+    args = parser.parse_args(argv)
+
+    files = discover_files(args.dirs)
+    merged = run_postprocess(files, args.keyword, args.workers, args.shard_mb, args.excel)
+    print(f"{merged['records']}件のレコードを処理しました")
+    for screen_name, count in merged['mentions'].most_common(10):
+        print(f"@{screen_name}: {count}")
+
+    save_summary(merged)
+    if args.excel:
+        save_to_excel(merged)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Twitter分析ツール コマンドラインエントリポイント
+目的: cronやクラウド関数から各ツールを1つの入口で起動する
+機能:
+- search / keyword / reply / follower / pipeline の各コマンドへの振り分け
+- 選択されたコマンドのモジュールのみを実行時に読み込む（pandas等は出力時のみ）
+- startup-check によるコールドスタート時間の計測と予算チェック
+
+使い方:
+    python cli.py keyword Javascript --count 10 --sort latest --no-excel
+    python cli.py reply sora19ai --min-replies 3 --tweets 200
+    python cli.py startup-check
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import time
+
+# コマンド名 → 実装モジュール（main()を持つ）
+COMMAND_MODULES = {
+    'search': 'search',
+    'keyword': 'keyword_search_excel',
+    'reply': 'reply_search_excel',
+    'follower': 'follower_search',
+    'pipeline': 'twitter_semi_auto',
+}
+
+# cli.py自体の読み込みで読み込まれてはならない重いモジュール
+HEAVY_MODULES = ('asyncio', 'twikit', 'httpx', 'pandas', 'openpyxl', 'openai', 'googleapiclient')
+
+# コールドスタート予算（インタプリタ起動を除いた cli.py の読み込み時間、ミリ秒）
+STARTUP_BUDGET_MS = 50
+
+
+async def run_command(name, **params):
+    """コマンド名に対応するモジュールを読み込んで main() を実行する"""
+    if name not in COMMAND_MODULES:
+        raise ValueError(f"不明なコマンドです: {name}")
+    module = importlib.import_module(COMMAND_MODULES[name])
+    return await module.main(**params)
+
+
+def _measure_import_ms(code, runs):
+    """別プロセスでコードを実行し、所要時間の中央値（ミリ秒）を返す"""
+    import statistics
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=here, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def startup_check(runs=5, budget_ms=STARTUP_BUDGET_MS):
+    """cli.py のコールドスタート時間を計測し、予算内かどうかを返す"""
+    baseline = _measure_import_ms('pass', runs)
+    with_cli = _measure_import_ms('import cli', runs)
+    overhead = max(with_cli - baseline, 0.0)
+
+    # 重いモジュールが読み込まれていないことを確認
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    probe = subprocess.run(
+        [sys.executable, '-c',
+         f"import sys, cli; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"],
+        cwd=here, check=True, capture_output=True, text=True
+    )
+    loaded = [m for m in probe.stdout.strip().split(',') if m]
+
+    print(f"インタプリタ起動: {baseline:.1f}ms")
+    print(f"cli.py読み込み込み: {with_cli:.1f}ms（差分 {overhead:.1f}ms / 予算 {budget_ms}ms）")
+    if loaded:
+        print(f"警告: 重いモジュールが起動時に読み込まれています: {', '.join(loaded)}")
+
+    ok = overhead <= budget_ms and not loaded
+    print("予算内です" if ok else "予算を超過しています")
+    return ok
+
+
+def build_parser():
+    """コマンドライン引数のパーサーを作成する"""
+    parser = argparse.ArgumentParser(description="Twitter分析ツール")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('search', help="キーワードでツイートを検索（JSON出力）")
+    p.add_argument('keyword')
+    p.add_argument('--count', type=int, default=10)
+
+    p = subparsers.add_parser('keyword', help="キーワード検索と投稿者情報の取得")
+    p.add_argument('keyword')
+    p.add_argument('--count', type=int, default=10)
+    p.add_argument('--sort', choices=['latest', 'top', 'likes'], default='latest')
+    p.add_argument('--dedupe', action='store_true', help="近似重複のツイートはクラスタごとに1件だけ出力する")
+    p.add_argument('--no-excel', action='store_true', help="Excel出力を行わない（pandasを読み込まない）")
+
+    p = subparsers.add_parser('reply', help="ユーザーのリプライ先を分析")
+    p.add_argument('target_user')
+    p.add_argument('--min-replies', type=int, default=3)
+    p.add_argument('--tweets', type=int, default=200)
+    p.add_argument('--sketch-capacity', type=int, default=None,
+                   help="リプライ先を近似集計で数える（保持するユーザー数を指定、大量のリプライ向け）")
+    p.add_argument('--incremental', action='store_true', help="前回の分析以降の新しいツイートのみ走査して集計に加算する")
+    p.add_argument('--window-days', type=int, default=None, help="差分分析で集計する日数（省略時は全期間）")
+    p.add_argument('--stable-pages', type=int, default=None,
+                   help="上位の順位がこのページ数続けて変わらなければ走査を終了する")
+    p.add_argument('--stable-top-k', type=int, default=10, help="順位の安定を判定する上位の人数")
+    p.add_argument('--deadline', type=float, default=None, help="制限時間（秒）、超える前に途中結果を保存して終了する")
+    p.add_argument('--max-requests', type=int, default=None, help="リクエスト数の上限")
+    p.add_argument('--no-excel', action='store_true', help="Excel出力を行わない（pandasを読み込まない）")
+
+    p = subparsers.add_parser('follower', help="フォロワーの今日のツイートを取得")
+    p.add_argument('--count', type=int, default=10)
+    p.add_argument('--all', action='store_true', help="全フォロワーを並列に確認する")
+    p.add_argument('--concurrency', type=int, default=None,
+                   help="同時に取得するフォロワー数の上限（省略時は同時実行数の自動調整に任せる）")
+    p.add_argument('--via-list', action='store_true', help="監視リストのタイムラインから取得する")
+
+    p = subparsers.add_parser('pipeline', help="半自動投稿パイプラインを実行")
+    p.add_argument('search_query')
+    p.add_argument('--cookies', default="cookies.json")
+    p.add_argument('--sheets-creds', default="sheets_credentials.json")
+    p.add_argument('--spreadsheet-id', default=None, help="未指定時はSheetsへ保存しない")
+    p.add_argument('--top', type=int, default=3)
+
+    p = subparsers.add_parser('startup-check', help="コールドスタート時間を計測")
+    p.add_argument('--runs', type=int, default=5)
+    p.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS)
+
+    return parser
+
+
+def command_params(args):
+    """解析済みの引数を各モジュールの main() の引数に変換する"""
+    if args.command == 'search':
+        return {'keyword': args.keyword, 'count': args.count}
+    if args.command == 'keyword':
+        return {'keyword': args.keyword, 'count': args.count,
+                'sort_by': args.sort, 'excel': not args.no_excel, 'dedupe': args.dedupe}
+    if args.command == 'reply':
+        return {'target_user': args.target_user, 'min_replies': args.min_replies,
+                'tweets_to_analyze': args.tweets, 'excel': not args.no_excel,
+                'sketch_capacity': args.sketch_capacity,
+                'incremental': args.incremental, 'window_days': args.window_days,
+                'stable_pages': args.stable_pages, 'stable_top_k': args.stable_top_k,
+                'deadline_seconds': args.deadline, 'max_requests': args.max_requests}
+    if args.command == 'follower':
+        return {'count': args.count, 'all_followers': args.all,
+                'concurrency': args.concurrency, 'via_list': args.via_list}
+    if args.command == 'pipeline':
+        return {'search_query': args.search_query,
+                'twitter_cookies_path': args.cookies,
+                'openai_key': os.environ.get('OPENAI_API_KEY', ''),
+                'sheets_creds_path': args.sheets_creds,
+                'spreadsheet_id': args.spreadsheet_id,
+                'top_n': args.top}
+    raise ValueError(f"不明なコマンドです: {args.command}")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == 'startup-check':
+        return 0 if startup_check(args.runs, args.budget_ms) else 1
+
+    # asyncioの読み込みも起動時間の大半を占めるため実行直前に読み込む
+    import asyncio
+    asyncio.run(run_command(args.command, **command_params(args)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Twitterクライアントファクトリ
+目的: 同一プロセス内の各アナライザーで接続プールと認証状態を共有する
+機能:
+- Cookieセットごとに1つのHTTP接続プール（HTTP/2・Keep-Alive・圧縮・タイムアウト設定済み）
+- 言語設定ごとのtwikitクライアントをキャッシュして払い出し
+- Cookieの読み込みはプールごとに1回のみ（更新されたCookieは書き戻す）
+- 一時的なエラーの再試行とエンドポイントごとのサーキットブレーカー
+- 同一リクエストのレスポンスキャッシュ（オペレーションごとのTTL）
+- 実行ごとのリクエスト予算（制限時間・リクエスト数の上限）の適用
+- エンドポイントごとの同時実行数の自動調整（AIMD）
+"""
+
+import contextvars
+import importlib.util
+
+import httpx
+from twikit import Client
+
+from concurrency_controller import AdaptiveConcurrencyTransport, ConcurrencyController
+from rate_limiter import RateLimitedTransport
+from request_budget import BudgetTransport
+from response_cache import CachingTransport, ResponseCache
+from retry_policy import RetryPolicy, RetryTransport
+from session_manager import DEFAULT_CONVERTED_PATH, SessionManager, SessionTransport
+
+DEFAULT_COOKIE_PATH = DEFAULT_CONVERTED_PATH
+
+
+def _http2_available():
+    """HTTP/2に必要なh2パッケージが利用可能か確認する"""
+    return importlib.util.find_spec('h2') is not None
+
+
+def _accept_encoding():
+    """httpxがデコード可能な圧縮形式のAccept-Encodingヘッダー値を返す"""
+    encodings = ['gzip', 'deflate']
+    if importlib.util.find_spec('brotli') or importlib.util.find_spec('brotlicffi'):
+        encodings.append('br')
+    if importlib.util.find_spec('zstandard'):
+        encodings.append('zstd')
+    return ', '.join(encodings)
+
+
+class TwitterClientFactory:
+    """1つのCookieセットに対して、接続プールを共有するクライアントを払い出すクラス"""
+
+    def __init__(self, cookie_path=DEFAULT_COOKIE_PATH, http2=True,
+                 max_connections=20, max_keepalive_connections=10,
+                 keepalive_expiry=30.0, connect_timeout=5.0, read_timeout=30.0,
+                 rate_limiter=None, retry_policy=None, response_cache=None, concurrency_controller=None):
+        # 認証クッキーのパス
+        self.cookie_path = cookie_path
+        # Cookieの変換・書き戻しと認証ユーザーのキャッシュ
+        self.session = SessionManager(cookie_path)
+        # h2が無い環境ではHTTP/1.1にフォールバック
+        self.http2 = http2 and _http2_available()
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(
+            read_timeout,
+            connect=connect_timeout
+        )
+        # 全クライアントで共有するレートリミッター（任意）
+        self.rate_limiter = rate_limiter
+        # 再試行ポリシー（max_attempts=1で再試行なし）
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_transport = None
+        # レスポンスキャッシュ（未指定時はメモリ上のみ）
+        self.response_cache = response_cache or ResponseCache()
+        # エンドポイントごとの同時実行数の上限（応答に合わせて自動調整）
+        self.concurrency_controller = concurrency_controller or ConcurrencyController()
+        self._http = None
+        self._clients = {}
+        self._authenticated = False
+
+    def _build_transport(self):
+        """接続プールを持つトランスポートを作成する"""
+        transport = httpx.AsyncHTTPTransport(
+            http2=self.http2,
+            limits=self.limits,
+            retries=1  # 接続確立時の一時的な失敗のみ再試行
+        )
+        # 実際に送受信した応答のみを監視するよう最も内側に置く
+        transport = SessionTransport(transport, self.session, self.save_cookies)
+        # 応答時間にレート制限の待ち時間が含まれないようレートリミッターより内側に置く
+        transport = AdaptiveConcurrencyTransport(transport, self.concurrency_controller)
+        if self.rate_limiter is not None:
+            transport = RateLimitedTransport(transport, self.rate_limiter)
+        # 再試行も1件として数え、予算切れは再試行せずに返すよう再試行より内側に置く
+        transport = BudgetTransport(transport)
+        # 再試行のたびにレート制限のトークンを消費するよう外側に重ねる
+        self.retry_transport = RetryTransport(transport, self.retry_policy)
+        # キャッシュヒット時はレート制限・再試行を通らないよう最も外側に置く
+        return CachingTransport(self.retry_transport, self.response_cache)
+
+    @property
+    def http(self):
+        """全クライアントで共有するHTTPクライアント（初回アクセス時に作成）"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                transport=self._build_transport(),
+                timeout=self.timeout,
+                headers={'Accept-Encoding': _accept_encoding()}
+            )
+        return self._http
+
+    def get_client(self, language='en-US'):
+        """指定した言語設定のクライアントを返す（同じ言語なら同一インスタンス）"""
+        if language not in self._clients:
+            client = Client(language=language)
+            # 接続プールとCookieを共有するためHTTPクライアントを差し替える
+            client.http = self.http
+            self._clients[language] = client
+        return self._clients[language]
+
+    async def authenticate(self):
+        """Cookieを読み込んで共有HTTPクライアントに設定する（プールごとに1回のみ）
+
+        ネットワーク通信は行わず、セッション切れは最初に失敗した応答で検出する
+        """
+        if self._authenticated:
+            return True
+        cookies = self.session.load_cookies()
+        self.get_client().set_cookies(cookies)
+        self._authenticated = True
+        return True
+
+    def save_cookies(self):
+        """共有HTTPクライアントのCookie（更新されたct0など）をファイルに書き戻す"""
+        if self._http is not None and self._authenticated:
+            return self.session.save_cookies(self._http.cookies)
+        return False
+
+    async def aclose(self):
+        """Cookieを書き戻してから接続プールを閉じる"""
+        if self._http is not None:
+            try:
+                self.save_cookies()
+            except OSError as e:
+                print(f"Cookieの保存エラー: {e}")
+            await self._http.aclose()
+        self._http = None
+        self._clients = {}
+        self._authenticated = False
+
+
+_factories = {}
+_current_factory = contextvars.ContextVar('client_factory', default=None)
+
+
+def use_client_factory(factory):
+    """現在のタスク（とそこから作られるタスク）で既定として使うファクトリを設定する"""
+    return _current_factory.set(factory)
+
+
+def get_client_factory(cookie_path=None, **options):
+    """プロセス内で共有するファクトリを返す（Cookieセットごとに1つ）
+
+    cookie_path を省略した場合は use_client_factory で設定したファクトリ（未設定なら既定のCookieセット）を返す。
+    optionsは初回作成時のみ TwitterClientFactory に渡される
+    """
+    if cookie_path is None:
+        current = _current_factory.get()
+        if current is not None:
+            return current
+        cookie_path = DEFAULT_COOKIE_PATH
+    if cookie_path not in _factories:
+        _factories[cookie_path] = TwitterClientFactory(cookie_path, **options)
+    return _factories[cookie_path]
@@ -0,0 +1,219 @@
+"""
+APIリクエストの同時実行数の自動調整
+目的: 固定の同時実行数では控えめすぎるか429が連発するため、エンドポイントと時間帯ごとに
+      アカウントが処理できる同時実行数へ自動で追従させる
+機能:
+- エンドポイント（GraphQLのオペレーション）ごとの同時実行数の上限（AIMD）
+  - 成功した応答ごとに上限を少しずつ増やす（加算的増加、上限1つ分の応答で+1）
+  - 429・接続エラー・遅延の増大・残りリクエスト数の減少で上限を半分にする（乗算的減少）
+- x-rate-limit-remaining ヘッダーによる、残りリクエスト数を超える同時実行の抑止
+- 共有HTTPクライアントに差し込むトランスポートラッパー
+"""
+
+import asyncio
+import time
+from collections import deque
+
+import httpx
+
+from retry_policy import endpoint_name
+
+# 同時実行数の上限の最大値（既定）
+DEFAULT_MAX_LIMIT = 32
+
+
+class AIMDLimiter:
+    """1つのエンドポイントの同時実行数の上限をAIMDで調整するクラス"""
+
+    def __init__(self, endpoint, initial=4, min_limit=1, max_limit=DEFAULT_MAX_LIMIT, backoff=0.5,
+                 latency_tolerance=2.0, quota_floor=0.1, probe_interval=200):
+        """
+        Args:
+            initial: 同時実行数の上限の初期値
+            min_limit / max_limit: 上限の範囲
+            backoff: 減少時に上限に掛ける係数
+            latency_tolerance: 最小応答時間の何倍を超えたら混雑とみなすか
+            quota_floor: 残りリクエスト数が上限値のこの割合を下回ったら減少させる
+            probe_interval: 最小応答時間を測り直す間隔（応答数、時間帯による変化に追従するため）
+        """
+        self.endpoint = endpoint
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.quota_floor = quota_floor
+        self.probe_interval = probe_interval
+        self.in_flight = 0
+        self.min_latency = None
+        self.smoothed_latency = None
+        # 残りリクエスト数（x-rate-limit-remaining）とリセット時刻（不明ならNone）
+        self.remaining = None
+        self.reset_at = None
+        self._waiters = deque()
+        self._last_decrease = 0.0
+        self._samples = 0
+        # 統計情報
+        self.requests = 0
+        self.throttled = 0
+        self.decreases = 0
+        self.max_in_flight = 0
+
+    def _allowed(self):
+        """現在送信してよい同時実行数"""
+        allowed = max(self.min_limit, int(self.limit))
+        if self.remaining is not None and (self.reset_at is None or self.reset_at > time.time()):
+            # 残りリクエスト数を超えては送らない（0でも1件は送り、リセット後の状態を確認する）
+            allowed = min(allowed, max(self.remaining, 1))
+        return allowed
+
+    def _wake(self):
+        """空いた枠の数だけ待機中のリクエストを起こす"""
+        free = self._allowed() - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    async def acquire(self):
+        """同時実行数の上限に空きができるまで待ち、枠を1つ確保する"""
+        while self.in_flight >= self._allowed():
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # 起こされた直後にキャンセルされた場合は、空いた枠を次の待機者に回す
+                self._wake()
+                raise
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def abandon(self):
+        """キャンセルなど応答と無関係に中断したリクエストの枠を返す（上限は調整しない）"""
+        self.in_flight -= 1
+        self._wake()
+
+    def release(self, latency=None, status_code=None, headers=None, failed=False):
+        """応答（または失敗）を記録して上限を調整し、待機中のリクエストを起こす"""
+        self.in_flight -= 1
+        self.requests += 1
+        self._update_quota(headers)
+
+        if failed or status_code == 429:
+            if status_code == 429:
+                self.throttled += 1
+            self._decrease()
+        elif status_code is not None and status_code < 500:
+            if self._congested(latency) or self._quota_low(headers):
+                self._decrease()
+            else:
+                # 上限1つ分の応答ごとに+1（1往復あたり+1の加算的増加）
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def _update_quota(self, headers):
+        if headers is None:
+            return
+        try:
+            self.remaining = int(headers['x-rate-limit-remaining'])
+        except (KeyError, TypeError, ValueError):
+            return
+        # リセット時刻を過ぎたら残りリクエスト数は使わない
+        try:
+            self.reset_at = float(headers['x-rate-limit-reset'])
+        except (KeyError, TypeError, ValueError):
+            self.reset_at = None
+
+    def _quota_low(self, headers):
+        """残りリクエスト数が上限値に対して少なくなっているか"""
+        try:
+            remaining = int(headers['x-rate-limit-remaining'])
+            total = int(headers['x-rate-limit-limit'])
+        except (KeyError, TypeError, ValueError):
+            return False
+        return total > 0 and remaining < total * self.quota_floor
+
+    def _congested(self, latency):
+        """応答時間が最小応答時間に対して大きく増えているか"""
+        if latency is None:
+            return False
+        self._samples += 1
+        self.smoothed_latency = latency if self.smoothed_latency is None \
+            else 0.8 * self.smoothed_latency + 0.2 * latency
+        if self._samples % self.probe_interval == 0:
+            # 時間帯による応答時間の変化に追従するため、最小値を測り直す
+            self.min_latency = self.smoothed_latency
+        if self.min_latency is None or latency < self.min_latency:
+            self.min_latency = latency
+            return False
+        return latency > self.min_latency * self.latency_tolerance
+
+    def _decrease(self):
+        """上限を減らす（同じ混雑に対して何度も減らさないよう、1往復に1回まで）"""
+        now = time.monotonic()
+        if now - self._last_decrease < (self.smoothed_latency or 0.0):
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        self.decreases += 1
+
+    def stats(self):
+        return {
+            'limit': round(self.limit, 2),
+            'requests': self.requests,
+            'throttled': self.throttled,
+            'decreases': self.decreases,
+            'max_in_flight': self.max_in_flight,
+            'avg_latency_ms': round(self.smoothed_latency * 1000, 1) if self.smoothed_latency else None,
+        }
+
+
+class ConcurrencyController:
+    """エンドポイントごとのAIMDLimiterを管理するクラス"""
+
+    def __init__(self, **limiter_options):
+        self.limiter_options = limiter_options
+        self.limiters = {}
+
+    @property
+    def max_limit(self):
+        """エンドポイントごとの同時実行数の上限の最大値"""
+        return self.limiter_options.get('max_limit', DEFAULT_MAX_LIMIT)
+
+    def limiter(self, endpoint):
+        if endpoint not in self.limiters:
+            self.limiters[endpoint] = AIMDLimiter(endpoint, **self.limiter_options)
+        return self.limiters[endpoint]
+
+    def stats(self):
+        """実行サマリー用の統計情報を返す"""
+        return {endpoint: limiter.stats() for endpoint, limiter in self.limiters.items()}
+
+
+class AdaptiveConcurrencyTransport(httpx.AsyncBaseTransport):
+    """エンドポイントごとの同時実行数の上限まで待ってから送信し、応答で上限を調整するトランスポート"""
+
+    def __init__(self, transport, controller):
+        self.transport = transport
+        self.controller = controller
+
+    async def handle_async_request(self, request):
+        limiter = self.controller.limiter(endpoint_name(request))
+        await limiter.acquire()
+        started = time.monotonic()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TransportError:
+            limiter.release(failed=True)
+            raise
+        except BaseException:
+            # キャンセルなど応答と無関係な中断は上限の調整に使わない
+            limiter.abandon()
+            raise
+        limiter.release(time.monotonic() - started, response.status_code, response.headers)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,182 @@
+"""
+取得に失敗したレコードのデッドレター
+目的: 再試行しても取得できなかったユーザーやページを記録し、ジョブ全体を再実行せずに後から補完する
+機能:
+- 失敗したレコード（種別・パラメータ・エラー）のJSONL形式での記録
+- 種別ごとのハンドラーによる再実行（成功したレコードは削除、失敗したものは残す）
+- 再実行結果のJSON保存
+
+使い方:
+    python dead_letter.py list
+    python dead_letter.py replay
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import threading
+from datetime import datetime
+
+DEFAULT_DEAD_LETTER_PATH = "dead_letter/dead_letter.jsonl"
+
+
+class DeadLetterQueue:
+    """失敗したレコードをJSONLファイルに保存するキュー"""
+
+    def __init__(self, path=DEFAULT_DEAD_LETTER_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+
+    def record(self, kind, params, error=None, source=None):
+        """失敗したレコードを追記する"""
+        entry = {
+            'kind': kind,
+            'params': params,
+            'error': str(error) if error is not None else None,
+            'source': source,
+            'failed_at': datetime.now().isoformat(timespec='seconds'),
+            'attempts': 1,
+        }
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        print(f"デッドレターに記録しました: {kind} {params}")
+
+    def entries(self):
+        """記録済みのレコードを返す"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _rewrite(self, entries):
+        """残ったレコードで一時ファイル経由で書き直す"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        os.replace(tmp_path, self.path)
+
+    async def replay(self, handlers):
+        """ハンドラーのある種別のレコードを再実行する
+
+        Args:
+            handlers: {種別: async関数(**params)}
+        Returns:
+            成功したレコードと結果のリスト [{'entry': ..., 'result': ...}]
+        """
+        replayed = []
+        remaining = []
+        for entry in self.entries():
+            handler = handlers.get(entry['kind'])
+            if handler is None:
+                remaining.append(entry)
+                continue
+            try:
+                result = await handler(**entry['params'])
+                replayed.append({'entry': entry, 'result': result})
+            except Exception as e:
+                entry['attempts'] += 1
+                entry['error'] = str(e)
+                remaining.append(entry)
+        with self._lock:
+            # 再実行中に追記されたレコードも残す
+            added = self.entries()[len(replayed) + len(remaining):]
+            self._rewrite(remaining + added)
+        print(f"デッドレターを再実行しました（成功 {len(replayed)}件 / 残り {len(remaining) + len(added)}件）")
+        return replayed
+
+
+def _build_handlers(client):
+    """各アナライザーが記録する種別の再実行ハンドラーを作成する"""
+    from profile_cache import user_to_profile
+    from record_utils import extract_mentions
+
+    async def recent_tweets(user, count=3):
+        results = await client.get_user_tweets(user.id, tweet_type='Tweets', count=count)
+        return [{
+            'tweet_id': tweet.id,
+            'text': tweet.text,
+            'created_at': tweet.created_at,
+        } for tweet in results]
+
+    async def resolve_user(screen_name, **context):
+        user = await client.get_user_by_screen_name(screen_name)
+        return {'profile': user_to_profile(user), **context}
+
+    async def enrich_user(reply_count, screen_name=None, user_id=None, **context):
+        if user_id is not None:
+            user = await client.get_user_by_id(user_id)
+        else:
+            user = await client.get_user_by_screen_name(screen_name)
+        return {
+            'profile': user_to_profile(user),
+            'reply_count': reply_count,
+            'recent_tweets': await recent_tweets(user),
+            **context,
+        }
+
+    async def timeline_page(user_id, cursor, tweet_type='Replies', screen_name=None, **context):
+        results = await client.get_user_tweets(user_id, tweet_type=tweet_type, count=100, cursor=cursor)
+        reply_counts = {}
+        for tweet in results:
+            for reply_to in extract_mentions(tweet.text, exclude=screen_name):
+                reply_counts[reply_to] = reply_counts.get(reply_to, 0) + 1
+        return {'reply_counts': reply_counts, 'tweets': len(results), 'next_cursor': results.next_cursor, **context}
+
+    async def follower_tweets(user_id, **context):
+        results = await client.get_user_tweets(user_id, tweet_type='Tweets', count=20)
+        return {'tweets': [{'tweet_id': tweet.id, 'text': tweet.text, 'created_at': tweet.created_at}
+                           for tweet in results], **context}
+
+    return {
+        'resolve_user': resolve_user,
+        'enrich_user': enrich_user,
+        'timeline_page': timeline_page,
+        'follower_tweets': follower_tweets,
+    }
+
+
+async def run_replay(path=DEFAULT_DEAD_LETTER_PATH, results_dir="dead_letter"):
+    """デッドレターを再実行し、結果をJSONファイルとして保存する"""
+    from client_factory import get_client_factory
+
+    client_factory = get_client_factory()
+    try:
+        await client_factory.authenticate()
+    except Exception as e:
+        print(f"認証エラー: {e}")
+        return None
+
+    queue = DeadLetterQueue(path)
+    replayed = await queue.replay(_build_handlers(client_factory.get_client(language='en-US')))
+    if not replayed:
+        return None
+
+    current_time = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = os.path.join(results_dir, f"replayed_{current_time}.json")
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(replayed, f, ensure_ascii=False, indent=2, default=str)
+    print(f"再実行結果を保存しました: {filename}")
+    return filename
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="取得に失敗したレコードのデッドレター")
+    parser.add_argument('command', choices=('list', 'replay'))
+    parser.add_argument('--path', default=DEFAULT_DEAD_LETTER_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        entries = DeadLetterQueue(args.path).entries()
+        for entry in entries:
+            print(f"[{entry['failed_at']}] {entry['kind']} {entry['params']} - {entry['error']}")
+        print(f"合計 {len(entries)}件")
+    else:
+        asyncio.run(run_replay(args.path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+投稿文ドラフトの並列生成とキャッシュ
+目的: 複数の候補ツイートの投稿文を同時に生成し、同じプロンプトと元ツイートの組み合わせは再生成しない
+機能:
+- 同時実行数を制限した並列生成（生成できたものから承認キューへ渡す）
+- プロンプト・元ツイート・モデルのハッシュをキーにしたディスクキャッシュ（SQLite）
+- テスト用のOpenAI互換スタブLLMサーバー
+
+使い方:
+    python draft_generator.py stub-server --port 8001
+    （パイプライン側で llm_base_url="http://127.0.0.1:8001/v1" を指定）
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_CACHE_PATH = "draft_cache/drafts.db"
+
+
+def draft_key(model, prompt, source_url):
+    """モデル・プロンプト・元ツイートからキャッシュキーを作る"""
+    payload = json.dumps([model, prompt, source_url], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class DraftCache:
+    """生成済みの投稿文を保存するキャッシュ"""
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS drafts (
+                draft_key TEXT PRIMARY KEY,
+                source_url TEXT,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+
+    def get(self, key):
+        row = self.conn.execute("SELECT content FROM drafts WHERE draft_key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, source_url, content):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO drafts (draft_key, source_url, content, created_at) VALUES (?, ?, ?, ?)",
+                (key, source_url, content, time.time())
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+class DraftGenerator:
+    """候補ツイートごとの投稿文を並列に生成し、承認キューへ渡すクラス"""
+
+    def __init__(self, build_prompt, complete, model, cache=None, concurrency=3):
+        """
+        Args:
+            build_prompt: 元ツイートのデータからプロンプトを作る関数
+            complete: プロンプトから投稿文を生成するasync関数
+            model: 使用するモデル名（キャッシュキーに含める）
+            concurrency: 同時に生成する最大数
+        """
+        self.build_prompt = build_prompt
+        self.complete = complete
+        self.model = model
+        self.cache = cache or DraftCache()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # 統計情報
+        self.generated = 0
+        self.cache_hits = 0
+
+    async def generate(self, tweet_data):
+        """1件の投稿文を生成する（キャッシュ済みならそれを返す）"""
+        prompt = self.build_prompt(tweet_data)
+        key = draft_key(self.model, prompt, tweet_data['url'])
+        content = self.cache.get(key)
+        if content is not None:
+            self.cache_hits += 1
+            return {'source': tweet_data, 'content': content, 'cached': True}
+
+        async with self.semaphore:
+            content = await self.complete(prompt)
+        self.cache.set(key, tweet_data['url'], content)
+        self.generated += 1
+        return {'source': tweet_data, 'content': content, 'cached': False}
+
+    async def produce(self, tweets, queue):
+        """全候補の投稿文を生成し、できたものから順にキューへ入れる（最後にNoneを入れる）"""
+        generated, cache_hits = self.generated, self.cache_hits
+        try:
+            for future in asyncio.as_completed([self.generate(tweet) for tweet in tweets]):
+                try:
+                    await queue.put(await future)
+                except Exception as e:
+                    print(f"投稿文の生成エラー: {e}")
+        finally:
+            await queue.put(None)
+        print(f"投稿文を生成しました（新規 {self.generated - generated}件 / "
+              f"キャッシュ {self.cache_hits - cache_hits}件）")
+
+
+def run_stub_server(host='127.0.0.1', port=8001):
+    """OpenAI互換の /chat/completions に固定形式の投稿文を返すスタブサーバー"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if not self.path.endswith('/chat/completions'):
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            prompt = body.get('messages', [{}])[-1].get('content', '')
+            source = next((line.split(':', 1)[1].strip() for line in prompt.splitlines()
+                           if line.startswith('オリジナルツイート:')), '')
+            content = f"[stub] {source[:100]} #stub"
+            payload = json.dumps({
+                'id': 'stub', 'object': 'chat.completion', 'created': int(time.time()),
+                'model': body.get('model', 'stub'),
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': content}}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            }, ensure_ascii=False).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    print(f"スタブLLMサーバーを起動しました: http://{host}:{port}/v1")
+    server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="投稿文ドラフトの生成")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('stub-server', help="テスト用のスタブLLMサーバーを起動")
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8001)
+    args = parser.parse_args(argv)
+
+    if args.command == 'stub-server':
+        run_stub_server(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
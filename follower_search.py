@@ -1,34 +1,49 @@
-from twikit import Client
+from client_factory import get_client_factory
 import json
 import os
 from datetime import datetime, timezone
 import asyncio
+from dead_letter import DeadLetterQueue
+from list_monitor import TwitterListMonitor
+from rate_limiter import RateLimiter
+from request_budget import BudgetExhaustedError, current_budget
+from time_utils import day_id_bounds, in_id_bounds
 
 class TwitterFollowerSearch:
     """Twitterフォロワーのツイートを検索・保存するクラス"""
     
-    def __init__(self):
-        # Twitterクライアントの初期化（英語設定）
-        self.client = Client(language='en-US')
+    def __init__(self, client_factory=None):
+        # 共有ファクトリから英語（米国）設定のクライアントを取得（接続プールを共有）
+        self.client_factory = client_factory or get_client_factory()
+        self.client = self.client_factory.get_client(language='en-US')
         # クッキー情報を保存しているJSONファイルのパス
-        self.cookie_path = "twitter_json/cookie_edit.json"
+        self.cookie_path = self.client_factory.cookie_path
         # 検索結果を保存するディレクトリ
         self.results_dir = "search_results"
         # 保存ディレクトリがない場合は作成
         os.makedirs(self.results_dir, exist_ok=True)
+        # フォロワーごとの最終活動（ツイート数・最新ツイートID）のキャッシュ
+        self.activity_cache_path = os.path.join(self.results_dir, "follower_activity.json")
+        # 再試行しても取得できなかったレコードの記録先
+        self.dead_letters = DeadLetterQueue()
+        # 予算を使い切って取得を打ち切ったか（打ち切りは予算に記録し、失敗扱いにしない）
+        self.budget_truncated = False
+
+    def _note_budget_truncation(self, phase, error, **details):
+        """予算を使い切って打ち切ったことを予算に記録する"""
+        self.budget_truncated = True
+        current_budget().note_truncation(phase, str(error), **details)
 
     async def setup(self):
         """認証設定を行い、クライアントを初期化"""
         try:
-            # クッキーファイルから認証情報を読み込み
-            with open(self.cookie_path, 'r', encoding='utf-8') as file:
-                cookies = json.load(file)
-            self.client.set_cookies(cookies)
+            # 共有ファクトリ経由でクッキーを設定（読み込みはプールごとに1回）
+            await self.client_factory.authenticate()
             
-            # ユーザーIDを取得し認証を確認
-            self.user_id = await self.client.user_id()
-            user = await self.client.get_user_by_id(self.user_id)
-            print(f"認証成功: @{user.screen_name}")
+            # 認証ユーザーはセッションのキャッシュから取得（2回目以降は通信なし）
+            identity = await self.client_factory.session.identity(self.client)
+            self.user_id = identity['user_id']
+            print(f"認証成功: @{identity['screen_name']}")
             return True
         except Exception as e:
             print(f"認証エラー: {e}")
@@ -42,7 +57,8 @@ class TwitterFollowerSearch:
             
             # フォロワーを最大3人に制限（レート制限対策）
             followers = await self.client.get_latest_followers(count=3)
-            today = datetime.now(timezone.utc)
+            # 今日（UTC）のツイートIDの範囲（日付の比較を整数比較で行う）
+            today_bounds = day_id_bounds(datetime.now(timezone.utc).date())
             
             for i, follower in enumerate(followers):
                 # 15リクエストごとに15秒待機
@@ -59,38 +75,204 @@ class TwitterFollowerSearch:
                     )
                     
                     for tweet in timeline:
-                        tweet_date = datetime.strptime(
-                            tweet.created_at, 
-                            '%a %b %d %H:%M:%S %z %Y'
-                        )
-                        
-                        if tweet_date.date() == today.date():
-                            tweet_data = {
-                                'user_name': tweet.user.name,
-                                'screen_name': tweet.user.screen_name,
-                                'text': tweet.text,
-                                'created_at': tweet.created_at,
-                                'retweet_count': tweet.retweet_count,
-                                'like_count': tweet.favorite_count,
-                                'view_count': tweet.view_count,
-                                'tweet_id': tweet.id,
-                                'lang': tweet.lang,
-                                'possibly_sensitive': tweet.possibly_sensitive
-                            }
-                            tweets.append(tweet_data)
+                        if in_id_bounds(tweet.id, today_bounds):
+                            tweets.append(self._tweet_data(tweet))
                             
                             if len(tweets) >= count:
                                 return tweets
                                 
+                except BudgetExhaustedError as e:
+                    print(f"予算を使い切ったため残りのフォロワーのツイート取得を中止します: {e}")
+                    self._note_budget_truncation('follower_tweets', e, skipped_users=len(followers) - i)
+                    break
                 except Exception as e:
                     print(f"ユーザー @{follower.screen_name} のツイート取得でエラー: {e}")
+                    self.dead_letters.record(
+                        'follower_tweets', {'user_id': follower.id, 'screen_name': follower.screen_name},
+                        e, source='get_followers_tweets'
+                    )
                     continue
 
             return tweets
+        except BudgetExhaustedError as e:
+            print(f"予算を使い切ったためフォロワーを取得できませんでした: {e}")
+            self._note_budget_truncation('followers', e)
+            return []
         except Exception as e:
             print(f"ツイート取得エラー: {e}")
             return []
 
+    def _tweet_data(self, tweet):
+        """ツイートを保存用の辞書形式に整理する"""
+        return {
+            'user_name': tweet.user.name,
+            'screen_name': tweet.user.screen_name,
+            'text': tweet.text,
+            'created_at': tweet.created_at,
+            'retweet_count': tweet.retweet_count,
+            'like_count': tweet.favorite_count,
+            'view_count': tweet.view_count,
+            'tweet_id': tweet.id,
+            'lang': tweet.lang,
+            'possibly_sensitive': tweet.possibly_sensitive
+        }
+
+    def _load_activity_cache(self):
+        """フォロワーの最終活動キャッシュを読み込む"""
+        try:
+            with open(self.activity_cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_activity_cache(self, cache):
+        """フォロワーの最終活動キャッシュを保存する"""
+        try:
+            with open(self.activity_cache_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"活動キャッシュの保存エラー: {e}")
+
+    async def iter_all_followers(self, page_size=100):
+        """自分のフォロワーを全ページ分順に返す"""
+        followers = await self.client.get_user_followers(self.user_id, count=page_size)
+        while followers:
+            for follower in followers:
+                yield follower
+            if not followers.next_cursor:
+                break
+            followers = await followers.next()
+
+    async def _fetch_follower_today(self, follower, bounds, max_pages):
+        """1人のフォロワーの今日のツイートを取得する（今日より古いページに達したら終了）
+
+        Returns:
+            (今日のツイートのリスト, 最新ツイートID)
+        """
+        tweets = []
+        newest_id = None
+        min_id, _ = bounds
+        timeline = await self.client.get_user_tweets(follower.id, tweet_type='Tweets', count=20)
+
+        for _ in range(max_pages):
+            if not timeline:
+                break
+            for tweet in timeline:
+                newest_id = max(newest_id or 0, int(tweet.id))
+                if in_id_bounds(tweet.id, bounds):
+                    tweets.append(self._tweet_data(tweet))
+            # タイムラインは新しい順のため、ページ末尾が今日より古ければ以降は不要
+            # （先頭の固定ツイートは古くても判定に使わない）
+            if int(timeline[-1].id) < min_id or not timeline.next_cursor:
+                break
+            timeline = await timeline.next()
+
+        return tweets, newest_id
+
+    async def get_all_followers_tweets(self, concurrency=None, max_pages_per_user=3, page_size=100):
+        """全フォロワーの今日のツイートを並列に取得する
+
+        Args:
+            concurrency: 同時に取得するフォロワー数の上限（省略時は同時実行数の自動調整の最大値。
+                実際の同時リクエスト数はエンドポイントごとの自動調整で決まる）
+            max_pages_per_user: 1人あたりのタイムライン取得ページ数の上限
+            page_size: フォロワー一覧の1ページあたりの件数
+        """
+        print("全フォロワーの今日のツイートを取得中...")
+        bounds = day_id_bounds(datetime.now(timezone.utc).date())
+        cache = self._load_activity_cache()
+        semaphore = asyncio.Semaphore(concurrency or self.client_factory.concurrency_controller.max_limit)
+        tweets = []
+        skipped = 0
+        # 予算を使い切って取得しなかったフォロワー（再試行しても取得できないため失敗として記録しない）
+        truncated = []
+
+        async def fetch(follower):
+            async with semaphore:
+                try:
+                    found, newest_id = await self._fetch_follower_today(
+                        follower, bounds, max_pages_per_user
+                    )
+                except BudgetExhaustedError:
+                    truncated.append(follower.screen_name)
+                    return
+                except Exception as e:
+                    print(f"ユーザー @{follower.screen_name} のツイート取得でエラー: {e}")
+                    self.dead_letters.record(
+                        'follower_tweets', {'user_id': follower.id, 'screen_name': follower.screen_name},
+                        e, source='get_all_followers_tweets'
+                    )
+                    return
+                tweets.extend(found)
+                if newest_id is not None:
+                    cache[str(follower.id)] = {
+                        'statuses_count': follower.statuses_count,
+                        'last_tweet_id': str(newest_id)
+                    }
+
+        tasks = []
+        try:
+            async for follower in self.iter_all_followers(page_size):
+                known = cache.get(str(follower.id))
+                # 前回確認時からツイート数が変わらず、最新ツイートが今日より前なら取得不要
+                if follower.statuses_count == 0 or (
+                    known
+                    and known['statuses_count'] == follower.statuses_count
+                    and int(known['last_tweet_id']) < bounds[0]
+                ):
+                    skipped += 1
+                    continue
+                tasks.append(asyncio.create_task(fetch(follower)))
+        except BudgetExhaustedError as e:
+            print(f"予算を使い切ったためフォロワー一覧の取得を中止します: {e}")
+            self._note_budget_truncation('followers', e, listed_followers=len(tasks) + skipped)
+        except Exception as e:
+            print(f"フォロワー一覧の取得エラー: {e}")
+
+        await asyncio.gather(*tasks)
+        self._save_activity_cache(cache)
+        if truncated:
+            print(f"予算を使い切ったため{len(truncated)}人のタイムラインは取得していません")
+            self._note_budget_truncation(
+                'follower_tweets', '予算を使い切ったためタイムラインを取得せず', users=truncated
+            )
+        print(f"{len(tasks) - len(truncated)}人のタイムラインを確認（{skipped}人は活動なしのためスキップ）")
+        return sorted(tweets, key=lambda tweet: int(tweet['tweet_id']), reverse=True)
+
+    async def get_followers_tweets_via_list(self, refresh_members=True, max_pages=20):
+        """フォロワーを登録した非公開リストのタイムラインから今日のツイートを取得する
+
+        Args:
+            refresh_members: フォロワー一覧を取得し直してリストを同期するか
+            max_pages: リストタイムラインの最大取得ページ数
+        """
+        print("フォロワー監視リストから今日のツイートを取得中...")
+        monitor = TwitterListMonitor(self.client, "followers-monitor")
+        try:
+            if refresh_members:
+                follower_ids = [follower.id async for follower in self.iter_all_followers()]
+                await monitor.sync_members(follower_ids)
+
+            # 今日より前のIDで打ち切る
+            bounds = day_id_bounds(datetime.now(timezone.utc).date())
+            timeline = await monitor.read_timeline(since_id=bounds[0] - 1, max_pages=max_pages)
+            by_author = monitor.demultiplex(timeline)
+        except BudgetExhaustedError as e:
+            print(f"予算を使い切ったためリストタイムラインを取得できませんでした: {e}")
+            self._note_budget_truncation('list_timeline', e)
+            return []
+        except Exception as e:
+            print(f"リストタイムライン取得エラー: {e}")
+            return []
+
+        print(f"{len(by_author)}人のフォロワーが今日ツイートしています")
+        return [
+            self._tweet_data(tweet)
+            for author_tweets in by_author.values()
+            for tweet in author_tweets
+            if in_id_bounds(tweet.id, bounds)
+        ]
+
     def save_tweets(self, tweets):
         """取得したツイートをJSONファイルとして保存"""
         try:
@@ -110,16 +292,28 @@ class TwitterFollowerSearch:
             print(f"保存エラー: {e}")
             return None
 
-async def main():
+async def main(count=10, all_followers=False, concurrency=None, via_list=False):
+    # 全フォロワーモードでは並列取得するため、共有のレート制限を設定したファクトリを使う
+    client_factory = None
+    if all_followers:
+        client_factory = get_client_factory(rate_limiter=RateLimiter(requests=50, per_seconds=60))
+
     # TwitterFollowerSearchインスタンスを作成
-    searcher = TwitterFollowerSearch()
+    searcher = TwitterFollowerSearch(client_factory)
     
     # 認証設定を実行
     if not await searcher.setup():
         return
 
-    # ツイートを取得（最大10件）
-    tweets = await searcher.get_followers_tweets(count=10)
+    if via_list:
+        # フォロワー監視リストのタイムラインから取得
+        tweets = await searcher.get_followers_tweets_via_list()
+    elif all_followers:
+        # 全フォロワーの今日のツイートを取得
+        tweets = await searcher.get_all_followers_tweets(concurrency=concurrency)
+    else:
+        # ツイートを取得（最大count件）
+        tweets = await searcher.get_followers_tweets(count=count)
 
     # 取得結果を表示
     print(f"\n取得結果 ({len(tweets)}件のツイート):")
@@ -133,7 +327,12 @@ async def main():
 
     # ツイートが存在する場合はファイルに保存
     if tweets:
-        searcher.save_tweets(tweets)
+        outputs = [searcher.save_tweets(tweets)]
+        # 保存したファイルのパスを返す（ジョブ実行サマリー用、保存に失敗した場合は返さない）
+        return [path for path in outputs if path] or None
+    # 予算で打ち切った場合は結果が無くても失敗扱いにしない（打ち切りは予算のサマリーに記録済み）
+    if searcher.budget_truncated:
+        return []
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
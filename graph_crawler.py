@@ -0,0 +1,259 @@
+"""
+フォロー・フォロワーグラフのクローラー
+目的: 自分や競合アカウントのフォロワー・フォロー一覧を全件取得し、コンパクトに保存する
+機能:
+- フォロワー・フォローのページ取得（カーソルを保存して中断後に再開）
+- 取得したユーザーをプロフィールキャッシュへ重複なく保存
+- エッジをint64のユーザーID配列として追記保存（メモリマップで即座に読み込み可能）
+- 配列演算によるオーディエンスの重複・新規フォロワーの算出
+
+使い方:
+    python graph_crawler.py crawl railman_misaka --kind followers
+    python graph_crawler.py new railman_misaka
+    python graph_crawler.py overlap railman_misaka sora19ai
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from array import array
+from datetime import datetime
+
+from profile_cache import ProfileCache
+
+DEFAULT_GRAPH_DIR = "graph_data"
+EDGE_KINDS = ('followers', 'following')
+
+
+class EdgeStore:
+    """1アカウント分のエッジ（ユーザーID配列）とクロール状態を管理するクラス
+
+    ファイル構成（graph_data/<screen_name>/）:
+        <kind>.partial.i64  クロール途中のID（追記）
+        <kind>.i64          最新の完了スナップショット（昇順・重複なし）
+        <kind>.prev.i64     1つ前の完了スナップショット
+        state.json          カーソルなどのクロール状態
+    """
+
+    def __init__(self, screen_name, graph_dir=DEFAULT_GRAPH_DIR):
+        self.screen_name = screen_name
+        self.dir = os.path.join(graph_dir, screen_name)
+        os.makedirs(self.dir, exist_ok=True)
+        self.state_path = os.path.join(self.dir, "state.json")
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save_state(self):
+        """状態を一時ファイル経由で保存する（書き込み途中で壊れないように）"""
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def path(self, kind, suffix=''):
+        return os.path.join(self.dir, f"{kind}{suffix}.i64")
+
+    def append(self, kind, user_ids):
+        """クロール途中のファイルにユーザーIDを追記する"""
+        ids = array('q', (int(user_id) for user_id in user_ids))
+        if sys.byteorder == 'big':
+            ids.byteswap()  # ファイルは常にリトルエンディアン
+        with open(self.path(kind, '.partial'), 'ab') as f:
+            f.write(ids.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def finalize(self, kind):
+        """クロール途中のIDを重複除去・昇順に並べて最新スナップショットにする"""
+        import numpy as np
+
+        partial = self.path(kind, '.partial')
+        ids = np.unique(np.fromfile(partial, dtype='<i8')) if os.path.exists(partial) else np.array([], dtype='<i8')
+        tmp_path = self.path(kind, '.tmp')
+        ids.astype('<i8').tofile(tmp_path)
+        if os.path.exists(self.path(kind)):
+            os.replace(self.path(kind), self.path(kind, '.prev'))
+        os.replace(tmp_path, self.path(kind))
+        if os.path.exists(partial):
+            os.remove(partial)
+        return len(ids)
+
+    def load(self, kind, snapshot=''):
+        """スナップショットをメモリマップで読み込む（昇順・重複なしのint64配列）"""
+        import numpy as np
+
+        path = self.path(kind, snapshot)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.array([], dtype='<i8')
+        return np.memmap(path, dtype='<i8', mode='r')
+
+
+class TwitterGraphCrawler:
+    """フォロワー・フォロー一覧をページ単位で取得し、再開可能に保存するクラス"""
+
+    def __init__(self, client_factory=None, graph_dir=DEFAULT_GRAPH_DIR, profile_cache=None):
+        # twikitはクロール時にのみ必要
+        from client_factory import get_client_factory
+
+        self.client_factory = client_factory or get_client_factory()
+        self.client = self.client_factory.get_client(language='en-US')
+        self.graph_dir = graph_dir
+        self.profile_cache = profile_cache or ProfileCache()
+
+    async def setup(self):
+        """クッキーを使用して認証を設定する"""
+        try:
+            await self.client_factory.authenticate()
+            print("認証に成功しました！")
+            return True
+        except Exception as e:
+            print(f"認証エラー: {e}")
+            return False
+
+    async def _fetch_page(self, kind, user_id, cursor, page_size):
+        """フォロワーまたはフォローを1ページ取得する"""
+        if kind == 'followers':
+            return await self.client.get_user_followers(user_id, count=page_size, cursor=cursor)
+        return await self.client.get_user_following(user_id, count=page_size, cursor=cursor)
+
+    async def crawl(self, screen_name, kind='followers', page_size=100, max_pages=None):
+        """エッジを全ページ取得する（前回中断した場合はカーソルから再開）
+
+        Returns:
+            完了した場合はスナップショットの件数、途中で止まった場合はNone
+        """
+        store = EdgeStore(screen_name, self.graph_dir)
+        state = store.state.setdefault(kind, {})
+
+        if not state.get('user_id'):
+            user = await self.client.get_user_by_screen_name(screen_name)
+            state['user_id'] = user.id
+            self.profile_cache.upsert(user)
+        if not state.get('in_progress'):
+            state.update({'in_progress': True, 'cursor': None, 'pages': 0, 'fetched': 0,
+                          'started_at': datetime.now().isoformat(timespec='seconds')})
+            store.save_state()
+        else:
+            print(f"@{screen_name} の{kind}を {state['pages']}ページ目から再開します")
+
+        pages = 0
+        while max_pages is None or pages < max_pages:
+            try:
+                results = await self._fetch_page(kind, state['user_id'], state['cursor'], page_size)
+            except Exception as e:
+                print(f"{kind}取得エラー: {e}（次回はこのページから再開します）")
+                return None
+
+            users = list(results)
+            if users:
+                # 先にIDを永続化してからカーソルを進める（再開時の重複はfinalizeで除去）
+                store.append(kind, [user.id for user in users])
+                self.profile_cache.upsert_many(users)
+            state['pages'] += 1
+            state['fetched'] += len(users)
+            pages += 1
+
+            if not users or not results.next_cursor:
+                break
+            state['cursor'] = results.next_cursor
+            store.save_state()
+            if state['pages'] % 10 == 0:
+                print(f"@{screen_name} の{kind}: {state['fetched']}件取得済み")
+        else:
+            # ページ数の上限に達した場合は続きを次回に持ち越す
+            store.save_state()
+            return None
+
+        count = store.finalize(kind)
+        state.update({'in_progress': False, 'cursor': None,
+                      'completed_at': datetime.now().isoformat(timespec='seconds'),
+                      'count': count})
+        store.save_state()
+        print(f"@{screen_name} の{kind}を保存しました（{count}人）")
+        return count
+
+
+def new_edges(screen_name, kind='followers', graph_dir=DEFAULT_GRAPH_DIR):
+    """前回のクロール以降に増えたユーザーIDを返す"""
+    import numpy as np
+
+    store = EdgeStore(screen_name, graph_dir)
+    return np.setdiff1d(store.load(kind), store.load(kind, '.prev'), assume_unique=True)
+
+
+def lost_edges(screen_name, kind='followers', graph_dir=DEFAULT_GRAPH_DIR):
+    """前回のクロール以降に減ったユーザーIDを返す"""
+    import numpy as np
+
+    store = EdgeStore(screen_name, graph_dir)
+    return np.setdiff1d(store.load(kind, '.prev'), store.load(kind), assume_unique=True)
+
+
+def audience_overlap(screen_name_a, screen_name_b, kind='followers', graph_dir=DEFAULT_GRAPH_DIR):
+    """2アカウントの共通ユーザーIDとJaccard係数を返す"""
+    import numpy as np
+
+    a = EdgeStore(screen_name_a, graph_dir).load(kind)
+    b = EdgeStore(screen_name_b, graph_dir).load(kind)
+    common = np.intersect1d(a, b, assume_unique=True)
+    union = len(a) + len(b) - len(common)
+    return common, (len(common) / union if union else 0.0)
+
+
+async def run_crawl(screen_names, kinds, page_size, max_pages):
+    """指定アカウントのクロールを順に実行する"""
+    crawler = TwitterGraphCrawler()
+    if not await crawler.setup():
+        return
+    for screen_name in screen_names:
+        for kind in kinds:
+            await crawler.crawl(screen_name, kind, page_size, max_pages)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="フォロー・フォロワーグラフのクローラー")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('crawl', help="フォロワー・フォロー一覧を取得")
+    p.add_argument('screen_names', nargs='+')
+    p.add_argument('--kind', choices=EDGE_KINDS + ('both',), default='followers')
+    p.add_argument('--page-size', type=int, default=100)
+    p.add_argument('--max-pages', type=int, default=None, help="今回の実行で取得する最大ページ数")
+
+    p = subparsers.add_parser('new', help="前回以降の新規フォロワー")
+    p.add_argument('screen_name')
+    p.add_argument('--kind', choices=EDGE_KINDS, default='followers')
+
+    p = subparsers.add_parser('overlap', help="2アカウントのオーディエンスの重複")
+    p.add_argument('screen_name_a')
+    p.add_argument('screen_name_b')
+    p.add_argument('--kind', choices=EDGE_KINDS, default='followers')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'crawl':
+        kinds = EDGE_KINDS if args.kind == 'both' else (args.kind,)
+        asyncio.run(run_crawl(args.screen_names, kinds, args.page_size, args.max_pages))
+    elif args.command == 'new':
+        added = new_edges(args.screen_name, args.kind)
+        removed = lost_edges(args.screen_name, args.kind)
+        cache = ProfileCache()
+        print(f"新規: {len(added)}人 / 解除: {len(removed)}人")
+        for user_id in added[:50]:
+            profile = cache.get(int(user_id))
+            print(f"+ @{profile['screen_name']}" if profile else f"+ {user_id}")
+    elif args.command == 'overlap':
+        common, jaccard = audience_overlap(args.screen_name_a, args.screen_name_b, args.kind)
+        print(f"共通ユーザー: {len(common)}人（Jaccard係数: {jaccard:.4f}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+ヘビーヒッター（出現回数の多い要素）のストリーム集計
+目的: 数十万件のリプライを走査しても、メモリ使用量を一定に抑えたままリプライの多いユーザーを求める
+機能:
+- Space-Savingアルゴリズムによる上位要素の近似集計（保持する要素数は容量で固定）
+- 誤差の上限（総件数 / 容量）の計算と、候補の取りこぼしが起きうる条件の判定
+- 走査した要素をディスクへ書き出し、最終候補のみを正確に数え直す
+"""
+
+import heapq
+import itertools
+import tempfile
+from collections import Counter
+
+
+class SpaceSaving:
+    """Space-Savingアルゴリズムによる上位要素の近似カウンター
+
+    保持する要素ごとの推定値は「真の回数 ≤ 推定値 ≤ 真の回数 + 誤差」を満たし、
+    誤差は総件数 / 容量 を超えない。真の回数が 総件数 / 容量 を超える要素は必ず保持される
+    """
+
+    def __init__(self, capacity=1000):
+        if capacity < 1:
+            raise ValueError("容量は1以上である必要があります")
+        self.capacity = capacity
+        self.total = 0
+        # 要素 → [推定値, 誤差]
+        self._counts = {}
+        # 最小の推定値の要素を探すためのヒープ（古いエントリは取り出し時に読み飛ばす）
+        self._heap = []
+        self._seq = itertools.count()
+
+    def _push(self, item):
+        heapq.heappush(self._heap, (self._counts[item][0], next(self._seq), item))
+        # 読み飛ばすエントリが溜まりすぎたら作り直す
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, next(self._seq), key) for key, (count, _) in self._counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        """推定値が最小の要素を取り除き、その推定値を返す"""
+        while True:
+            count, _, item = heapq.heappop(self._heap)
+            entry = self._counts.get(item)
+            if entry is not None and entry[0] == count:
+                del self._counts[item]
+                return count
+
+    def add(self, item, count=1):
+        self.total += count
+        entry = self._counts.get(item)
+        if entry is not None:
+            entry[0] += count
+        elif len(self._counts) < self.capacity:
+            self._counts[item] = [count, 0]
+        else:
+            # 最小の要素を置き換え、その推定値を新しい要素の誤差として引き継ぐ
+            floor = self._pop_min()
+            self._counts[item] = [floor + count, floor]
+        self._push(item)
+
+    @property
+    def error_bound(self):
+        """推定値の誤差の上限"""
+        return self.total / self.capacity
+
+    def estimate(self, item):
+        """(推定値, 誤差) を返す（保持していない要素は (0, 0)）"""
+        count, error = self._counts.get(item, (0, 0))
+        return count, error
+
+    def candidates(self, min_count):
+        """真の回数が min_count 以上でありうる要素（推定値が min_count 以上）を返す"""
+        return [item for item, (count, _) in self._counts.items() if count >= min_count]
+
+    def most_common(self, n=None):
+        ranked = sorted(((item, count) for item, (count, _) in self._counts.items()),
+                        key=lambda x: x[1], reverse=True)
+        return ranked if n is None else ranked[:n]
+
+    def __len__(self):
+        return len(self._counts)
+
+
+class BoundedReplyCounter:
+    """近似集計で候補を絞り、候補のみをディスクに書き出した記録から正確に数え直すカウンター"""
+
+    def __init__(self, capacity=1000, spill_dir=None):
+        """
+        Args:
+            capacity: Space-Savingで保持する要素数
+            spill_dir: 走査した要素を書き出す一時ファイルの場所（省略時はOSの一時ディレクトリ）
+        """
+        self.sketch = SpaceSaving(capacity)
+        self._spill = tempfile.TemporaryFile(mode='w+', encoding='utf-8', dir=spill_dir)
+
+    def add(self, key):
+        key = str(key)
+        self.sketch.add(key)
+        self._spill.write(key + "\n")
+
+    @property
+    def total(self):
+        return self.sketch.total
+
+    def may_miss(self, min_count):
+        """誤差の上限が min_count 以上で、該当する要素を取りこぼしうるかどうか"""
+        return self.sketch.error_bound >= min_count
+
+    def exact_counts(self, min_count=1):
+        """推定値が min_count 以上の候補を正確に数え直し、min_count 以上のものを Counter で返す"""
+        candidates = set(self.sketch.candidates(min_count))
+        counts = Counter()
+        self._spill.flush()
+        self._spill.seek(0)
+        for line in self._spill:
+            key = line.rstrip("\n")
+            if key in candidates:
+                counts[key] += 1
+        return Counter({key: count for key, count in counts.items() if count >= min_count})
+
+    def stats(self, min_count=1):
+        return {
+            'total': self.sketch.total,
+            'tracked': len(self.sketch),
+            'capacity': self.sketch.capacity,
+            'error_bound': round(self.sketch.error_bound, 2),
+            'candidates': len(self.sketch.candidates(min_count)),
+        }
+
+    def close(self):
+        self._spill.close()
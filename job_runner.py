@@ -0,0 +1,208 @@
+"""
+ジョブマニフェスト実行ツール
+目的: YAML/JSONのマニフェストに書かれた複数の分析ジョブを無人で一括実行する
+機能:
+- ジョブ種別（search / keyword / reply / follower / pipeline）ごとのパラメータ指定
+- 並列度の指定と、全ジョブで共有するレート制限・レスポンスキャッシュ・リクエスト予算
+- エンドポイントごとの同時実行数の自動調整（AIMD）の設定と統計
+- 実行結果サマリー（成否・所要時間・出力ファイル）のJSON保存
+
+マニフェスト例（YAML）:
+    concurrency: 3
+    cookie_path: twitter_json/cookie_edit.json
+    rate_limit:
+      requests: 50
+      per_seconds: 60
+    response_cache:
+      max_entries: 2000
+      disk_path: response_cache/responses.db
+    adaptive_concurrency:
+      initial: 4
+      max_limit: 16
+    budget:
+      deadline_seconds: 600
+      max_requests: 300
+      endpoint_caps:
+        UserTweetsAndReplies: 100
+    jobs:
+      - type: reply
+        target_user: sora19ai
+        min_replies: 3
+        tweets_to_analyze: 200
+        excel: false
+      - type: keyword
+        keyword: Javascript
+        count: 10
+        sort_by: latest
+
+使い方:
+    python job_runner.py jobs.yaml
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from cli import COMMAND_MODULES, run_command
+from client_factory import DEFAULT_COOKIE_PATH, get_client_factory, use_client_factory
+from concurrency_controller import ConcurrencyController
+from rate_limiter import RateLimiter
+from request_budget import RequestBudget, use_budget
+from response_cache import ResponseCache
+
+
+def load_manifest(path):
+    """YAMLまたはJSONのマニフェストを読み込む"""
+    with open(path, 'r', encoding='utf-8') as file:
+        if path.endswith(('.yaml', '.yml')):
+            # PyYAMLはYAMLマニフェストを使う場合のみ必要
+            import yaml
+            manifest = yaml.safe_load(file)
+        else:
+            manifest = json.load(file)
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('jobs'), list):
+        raise ValueError("マニフェストには jobs のリストが必要です")
+    return manifest
+
+
+class JobRunner:
+    """マニフェストのジョブを並列実行し、サマリーを保存するクラス"""
+
+    def __init__(self, manifest, results_dir="run_results"):
+        self.manifest = manifest
+        self.concurrency = max(1, int(manifest.get('concurrency', 1)))
+        self.cookie_path = manifest.get('cookie_path', DEFAULT_COOKIE_PATH)
+        # 全ジョブで共有するレート制限
+        self.rate_limiter = RateLimiter(**manifest.get('rate_limit', {}))
+        # 全ジョブで共有するレスポンスキャッシュ（ジョブ間で重複するリクエストを省く）
+        self.response_cache = ResponseCache(**manifest.get('response_cache', {}))
+        # 全ジョブで共有するリクエスト予算（ジョブ側で deadline_seconds などを指定すればそのジョブのみ別予算）
+        self.budget = RequestBudget(**manifest['budget']) if manifest.get('budget') else None
+        # エンドポイントごとの同時実行数の自動調整
+        self.concurrency_controller = ConcurrencyController(**manifest.get('adaptive_concurrency', {}))
+        # サマリーを保存するディレクトリ
+        self.results_dir = manifest.get('results_dir', results_dir)
+        os.makedirs(self.results_dir, exist_ok=True)
+
+    def _job_params(self, job):
+        """ジョブ定義から main() に渡す引数を作成する"""
+        params = {key: value for key, value in job.items() if key not in ('type', 'name')}
+        if job['type'] == 'keyword':
+            # 対話入力を避けるため並び順を必ず指定する
+            params.setdefault('sort_by', 'latest')
+        return params
+
+    async def _run_job(self, index, job, semaphore, factory):
+        """1件のジョブを実行し、結果レコードを返す"""
+        job_type = job.get('type')
+        record = {
+            'name': job.get('name', f"{job_type}_{index}"),
+            'type': job_type,
+            'params': {key: value for key, value in job.items() if key not in ('type', 'name')},
+            'status': 'pending',
+            'outputs': [],
+        }
+        if job_type not in COMMAND_MODULES:
+            record['status'] = 'error'
+            record['error'] = f"不明なジョブ種別です: {job_type}"
+            return record
+
+        async with semaphore:
+            started = time.monotonic()
+            record['started_at'] = datetime.now().isoformat(timespec='seconds')
+            print(f"[{record['name']}] 開始")
+            try:
+                outputs = await run_command(job_type, **self._job_params(job))
+                record['outputs'] = outputs or []
+                if outputs is None:
+                    # main() は認証エラーや結果なしで途中終了した場合に何も返さない
+                    record['status'] = 'error'
+                    record['error'] = "出力がありません（認証エラーまたは結果なし）"
+                else:
+                    record['status'] = 'ok'
+            except Exception as e:
+                record['status'] = 'error'
+                record['error'] = str(e)
+                print(f"[{record['name']}] エラー: {e}")
+            if factory.session.expired:
+                record['status'] = 'error'
+                record.setdefault('error', "認証エラー（セッション切れ）")
+            record['duration_seconds'] = round(time.monotonic() - started, 2)
+            print(f"[{record['name']}] 終了 ({record['status']})")
+        return record
+
+    async def run(self):
+        """全ジョブを実行してサマリーを返す"""
+        factory = get_client_factory(self.cookie_path, rate_limiter=self.rate_limiter,
+                                     response_cache=self.response_cache,
+                                     concurrency_controller=self.concurrency_controller)
+        if factory.rate_limiter is None:
+            factory.rate_limiter = self.rate_limiter
+        await factory.authenticate()
+
+        started_at = datetime.now()
+        # 各ジョブのタスクは作成時のファクトリと予算の設定を引き継ぐ
+        # （各モジュールの main() が作るアナライザーもこのファクトリのレート制限・キャッシュを使う）
+        use_client_factory(factory)
+        use_budget(self.budget)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        records = await asyncio.gather(*[
+            self._run_job(index, job, semaphore, factory)
+            for index, job in enumerate(self.manifest['jobs'])
+        ])
+
+        summary = {
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'concurrency': self.concurrency,
+            'jobs_total': len(records),
+            'jobs_ok': sum(1 for record in records if record['status'] == 'ok'),
+            'jobs_failed': sum(1 for record in records if record['status'] == 'error'),
+            'rate_limit': self.rate_limiter.stats(),
+            'retry': factory.retry_transport.stats() if factory.retry_transport else None,
+            'response_cache': factory.response_cache.stats(),
+            'budget': self.budget.summary() if self.budget else None,
+            'adaptive_concurrency': factory.concurrency_controller.stats(),
+            'jobs': records,
+        }
+        self.save_summary(summary)
+        factory.response_cache.purge_expired()
+        await factory.aclose()
+        return summary
+
+    def save_summary(self, summary):
+        """実行サマリーをJSONファイルとして保存する"""
+        try:
+            current_time = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = os.path.join(self.results_dir, f"run_summary_{current_time}.json")
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+            print(f"実行サマリーを保存しました: {filename}")
+            return filename
+        except Exception as e:
+            print(f"保存エラー: {e}")
+            return None
+
+
+async def main(manifest_path):
+    try:
+        manifest = load_manifest(manifest_path)
+    except Exception as e:
+        print(f"マニフェスト読み込みエラー: {e}")
+        return None
+
+    runner = JobRunner(manifest)
+    summary = await runner.run()
+    print(f"\n完了: {summary['jobs_ok']}/{summary['jobs_total']}件成功")
+    return summary
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("使い方: python job_runner.py <manifest.yaml|manifest.json>")
+        sys.exit(1)
+    asyncio.run(main(sys.argv[1]))
@@ -1,26 +1,30 @@
-from twikit import Client
+from client_factory import get_client_factory
 import json
 import os
 from datetime import datetime
 import asyncio
+from near_duplicate import NearDuplicateIndex, representatives
+from record_utils import find_keyword_locations
 
 class TwitterKeywordAnalyzer:
-    def __init__(self):
-        # Twitterクライアントを英語（米国）設定で初期化
-        self.client = Client(language='en-US')
+    def __init__(self, client_factory=None):
+        # 共有ファクトリから英語（米国）設定のクライアントを取得（接続プールを共有）
+        self.client_factory = client_factory or get_client_factory()
+        self.client = self.client_factory.get_client(language='en-US')
         # 認証クッキーのパス
-        self.cookie_path = "twitter_json/cookie_edit.json"
+        self.cookie_path = self.client_factory.cookie_path
         # 結果を保存するディレクトリ
         self.results_dir = "keyword_search_results"
         # 結果保存用ディレクトリが存在しない場合は作成
         os.makedirs(self.results_dir, exist_ok=True)
+        # 近似重複のインデックス（コピペ・テンプレートのツイートに同じクラスタIDを割り当てる）
+        self.dedupe_index = NearDuplicateIndex()
 
     async def setup(self):
         """クッキーを使用して認証を設定する"""
         try:
-            with open(self.cookie_path, 'r', encoding='utf-8') as file:
-                cookies = json.load(file)
-            self.client.set_cookies(cookies)
+            # 共有ファクトリ経由でクッキーを設定（読み込みはプールごとに1回）
+            await self.client_factory.authenticate()
             print("認証に成功しました！")
             return True
         except Exception as e:
@@ -68,19 +72,19 @@ class TwitterKeywordAnalyzer:
                     'reply_count': tweet.reply_count if hasattr(tweet, 'reply_count') else 0,
                     'is_retweet': bool(tweet.retweeted_tweet),
                     'is_quote': tweet.is_quote_status,
-                    'language': tweet.lang
+                    'language': tweet.lang,
+                    # 取り込み時にクラスタIDを割り当てる（前回までの検索結果とも照合）
+                    'cluster_id': self.dedupe_index.add(tweet.id, tweet.text)
                 }
 
                 # キーワードの出現場所を確認
-                keyword_locations = []
-                if keyword.lower() in tweet.text.lower():
-                    keyword_locations.append('tweet_text')
-                if keyword.lower() in tweet.user.description.lower():
-                    keyword_locations.append('profile_description')
-                if keyword.lower() in tweet.user.name.lower():
-                    keyword_locations.append('user_name')
-                if keyword.lower() in tweet.user.screen_name.lower():
-                    keyword_locations.append('screen_name')
+                keyword_locations = find_keyword_locations(
+                    keyword,
+                    tweet.text,
+                    tweet.user.description,
+                    tweet.user.name,
+                    tweet.user.screen_name
+                )
 
                 search_results.append({
                     'user': user_data,
@@ -119,6 +123,7 @@ async def main():
     # 検索設定
     keyword = "プログラミング"  # 検索したいキーワード
     count = 10  # 取得する結果の数
+    dedupe = True  # 近似重複のツイートはクラスタごとに1件だけ表示・保存する
     
     # 検索オプション選択
     print("\n検索オプション:")
@@ -144,6 +149,12 @@ async def main():
         print("検索結果が見つかりませんでした。")
         return
 
+    # 並び順が最上位のツイートを各クラスタの代表として残す
+    if dedupe:
+        unique = representatives(results, lambda result: result['tweet']['cluster_id'])
+        print(f"近似重複のツイート {len(results) - len(unique)}件を除外しました")
+        results = unique
+
     # 検索結果を表示
     sort_type = {
         'latest': '新しい順',
@@ -1,27 +1,34 @@
-from twikit import Client
+from client_factory import get_client_factory
 import json
 import os
 from datetime import datetime
 import asyncio
-import pandas as pd
+from near_duplicate import NearDuplicateIndex, representatives
+from record_utils import build_keyword_row, find_keyword_locations
+from request_budget import BudgetExhaustedError, current_budget
+from time_utils import parse_created_at_series, to_excel_datetime
 
 class TwitterKeywordAnalyzer:
-    def __init__(self):
-        # Twitterクライアントを英語（米国）設定で初期化
-        self.client = Client(language='en-US')
+    def __init__(self, client_factory=None):
+        # 共有ファクトリから英語（米国）設定のクライアントを取得（接続プールを共有）
+        self.client_factory = client_factory or get_client_factory()
+        self.client = self.client_factory.get_client(language='en-US')
         # 認証クッキーのパス
-        self.cookie_path = "twitter_json/cookie_edit.json"
+        self.cookie_path = self.client_factory.cookie_path
         # 結果を保存するディレクトリ
         self.results_dir = "keyword_search_results"
         # 結果保存用ディレクトリが存在しない場合は作成
         os.makedirs(self.results_dir, exist_ok=True)
+        # 近似重複のインデックス（コピペ・テンプレートのツイートに同じクラスタIDを割り当てる）
+        self.dedupe_index = NearDuplicateIndex()
+        # 予算を使い切って検索を打ち切ったか（打ち切りは予算に記録し、失敗扱いにしない）
+        self.budget_truncated = False
 
     async def setup(self):
         """クッキーを使用して認証を設定する"""
         try:
-            with open(self.cookie_path, 'r', encoding='utf-8') as file:
-                cookies = json.load(file)
-            self.client.set_cookies(cookies)
+            # 共有ファクトリ経由でクッキーを設定（読み込みはプールごとに1回）
+            await self.client_factory.authenticate()
             print("認証に成功しました！")
             return True
         except Exception as e:
@@ -69,19 +76,19 @@ class TwitterKeywordAnalyzer:
                     'reply_count': tweet.reply_count if hasattr(tweet, 'reply_count') else 0,
                     'is_retweet': bool(tweet.retweeted_tweet),
                     'is_quote': tweet.is_quote_status,
-                    'language': tweet.lang
+                    'language': tweet.lang,
+                    # 取り込み時にクラスタIDを割り当てる（前回までの検索結果とも照合）
+                    'cluster_id': self.dedupe_index.add(tweet.id, tweet.text)
                 }
 
                 # キーワードの出現場所を確認
-                keyword_locations = []
-                if keyword.lower() in tweet.text.lower():
-                    keyword_locations.append('tweet_text')
-                if keyword.lower() in tweet.user.description.lower():
-                    keyword_locations.append('profile_description')
-                if keyword.lower() in tweet.user.name.lower():
-                    keyword_locations.append('user_name')
-                if keyword.lower() in tweet.user.screen_name.lower():
-                    keyword_locations.append('screen_name')
+                keyword_locations = find_keyword_locations(
+                    keyword,
+                    tweet.text,
+                    tweet.user.description,
+                    tweet.user.name,
+                    tweet.user.screen_name
+                )
 
                 search_results.append({
                     'user': user_data,
@@ -95,6 +102,11 @@ class TwitterKeywordAnalyzer:
 
             return search_results
 
+        except BudgetExhaustedError as e:
+            print(f"予算を使い切ったため検索を終了します: {e}")
+            self.budget_truncated = True
+            current_budget().note_truncation('search', str(e), keyword=keyword)
+            return []
         except Exception as e:
             print(f"検索エラー: {e}")
             return []
@@ -108,43 +120,27 @@ class TwitterKeywordAnalyzer:
             with open(filename, 'w', encoding='utf-8') as file:
                 json.dump(results, file, ensure_ascii=False, indent=2, default=str)
             print(f"\n結果を保存しました: {filename}")
+            return filename
         except Exception as e:
             print(f"結果の保存中にエラーが発生しました: {e}")
+            return None
 
     def save_to_excel(self, results, keyword, sort_by):
         """検索結果をExcelファイルとして保存"""
         try:
             # 結果をDataFrame用に整形
-            rows = []
-            for result in results:
-                user = result['user']
-                tweet = result['tweet']
-                locations = result['keyword_locations']
-                
-                row = {
-                    '検索日時': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    '検索キーワード': keyword,
-                    '並び順': sort_by,
-                    '投稿日時': tweet['created_at'],
-                    'アカウント名': user['name'],
-                    'ユーザーID': f"@{user['screen_name']}",
-                    'プロフィール文': user['profile_description'],
-                    'フォロワー数': user['followers_count'],
-                    'フォロー数': user['following_count'],
-                    'ツイート本文': tweet['text'],
-                    'いいね数': tweet['like_count'],
-                    'リツイート数': tweet['retweet_count'],
-                    'リプライ数': tweet['reply_count'],
-                    'ツイートURL': tweet['tweet_url'],
-                    'アカウントURL': user['profile_url'],
-                    'キーワード出現場所': ', '.join(locations),
-                    '場所': user['location'] if user['location'] else '',
-                    '言語': tweet['language']
-                }
-                rows.append(row)
+            searched_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            rows = [
+                build_keyword_row(result, keyword, sort_by, searched_at)
+                for result in results
+            ]
+
+            # pandasはExcel出力時のみ読み込む（JSONのみの実行では不要）
+            import pandas as pd
 
-            # DataFrameを作成
+            # DataFrameを作成（投稿日時は文字列ではなく日時型で出力）
             df = pd.DataFrame(rows)
+            df['投稿日時'] = to_excel_datetime(parse_created_at_series(df['投稿日時']))
 
             # Excelファイル名を生成
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -172,40 +168,46 @@ class TwitterKeywordAnalyzer:
             print(f"Excelファイルの保存中にエラーが発生しました: {e}")
             return None
 
-async def main():
+async def main(keyword="Javascript", count=10, sort_by=None, excel=True, dedupe=False):
     analyzer = TwitterKeywordAnalyzer()
     
     if not await analyzer.setup():
         return
 
-    # 検索設定
-    keyword = "Javascript"  # 検索したいキーワード
-    count = 10  # 取得する結果の数
-    
-    # 検索オプション選択
-    print("\n検索オプション:")
-    print("1: 新しい順")
-    print("2: 人気順")
-    print("3: いいね数順")
-    
-    try:
-        option = int(input("検索オプションを選択してください (1-3): "))
-        sort_by = {
-            1: 'latest',
-            2: 'top',
-            3: 'likes'
-        }.get(option, 'latest')
-    except ValueError:
-        print("無効な入力です。デフォルトの'新しい順'で検索します。")
-        sort_by = 'latest'
+    # 並び順が指定されていない場合のみ対話的に選択
+    if sort_by is None:
+        print("\n検索オプション:")
+        print("1: 新しい順")
+        print("2: 人気順")
+        print("3: いいね数順")
+        
+        try:
+            option = int(input("検索オプションを選択してください (1-3): "))
+            sort_by = {
+                1: 'latest',
+                2: 'top',
+                3: 'likes'
+            }.get(option, 'latest')
+        except ValueError:
+            print("無効な入力です。デフォルトの'新しい順'で検索します。")
+            sort_by = 'latest'
 
     # キーワード検索を実行
     results = await analyzer.search_with_keyword(keyword, count, sort_by)
 
     if not results:
         print("検索結果が見つかりませんでした。")
+        # 予算で打ち切った場合は失敗扱いにしない（打ち切りは予算のサマリーに記録済み）
+        if analyzer.budget_truncated:
+            return []
         return
 
+    # 近似重複のツイートはクラスタごとに並び順が最上位の1件だけを残す
+    if dedupe:
+        unique = representatives(results, lambda result: result['tweet']['cluster_id'])
+        print(f"近似重複のツイート {len(results) - len(unique)}件を除外しました")
+        results = unique
+
     # 検索結果を表示
     sort_type = {
         'latest': '新しい順',
@@ -240,10 +242,13 @@ async def main():
 # 結果を保存（JSONとExcel形式の両方で保存）
     if results:
         # JSON形式で保存
-        analyzer.save_results(results, f"{keyword}_{sort_by}")
+        outputs = [analyzer.save_results(results, f"{keyword}_{sort_by}")]
         
         # Excel形式で保存
-        analyzer.save_to_excel(results, keyword, sort_type)
+        if excel:
+            outputs.append(analyzer.save_to_excel(results, keyword, sort_type))
+        # 保存したファイルのパスを返す（ジョブ実行サマリー用、すべて保存に失敗した場合は失敗として記録させる）
+        return [path for path in outputs if path] or None
         
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
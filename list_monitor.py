@@ -0,0 +1,132 @@
+"""
+リストタイムラインによる複数ユーザーの一括監視
+目的: N人の最近のツイートをN回の get_user_tweets ではなく、1本のリストタイムラインで取得する
+機能:
+- 監視対象ユーザー（フォロワー・ウォッチリスト）を含む非公開リストの作成と同期
+- リストタイムラインのカーソルによるページ取得（前回の最新IDまでで打ち切り、読み残しは次回に続きから取得）
+- 取得したツイートの投稿者ごとの振り分け
+"""
+
+import json
+import os
+from collections import defaultdict
+
+from timeline_scan import TimelineWatermark
+
+# リストに登録できるメンバー数の上限
+MAX_LIST_MEMBERS = 5000
+
+
+class TwitterListMonitor:
+    """非公開リストを使って監視対象ユーザーのツイートをまとめて取得するクラス"""
+
+    def __init__(self, client, list_name, state_dir="list_monitor"):
+        self.client = client
+        self.list_name = list_name
+        # リストIDやメンバー、最新ツイートIDを保存するディレクトリ
+        self.state_dir = state_dir
+        os.makedirs(self.state_dir, exist_ok=True)
+        safe_name = "".join(c for c in list_name if c.isalnum() or c in ('-', '_'))
+        self.state_path = os.path.join(self.state_dir, f"list_{safe_name}.json")
+        self.state = self._load_state()
+
+    def _load_state(self):
+        """保存済みの状態を読み込む"""
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'list_id': None, 'members': [], 'newest_tweet_id': None}
+
+    def _save_state(self):
+        """状態を保存する"""
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+
+    async def ensure_list(self):
+        """監視用の非公開リストが無ければ作成し、リストIDを返す"""
+        if not self.state['list_id']:
+            twitter_list = await self.client.create_list(
+                self.list_name,
+                description="自動監視用リスト",
+                is_private=True
+            )
+            self.state['list_id'] = twitter_list.id
+            self._save_state()
+            print(f"監視用リストを作成しました: {self.list_name}")
+        return self.state['list_id']
+
+    async def sync_members(self, user_ids):
+        """リストのメンバーを指定ユーザーに合わせる（差分のみ追加・削除）"""
+        list_id = await self.ensure_list()
+        wanted = [str(user_id) for user_id in user_ids][:MAX_LIST_MEMBERS]
+        if len(user_ids) > MAX_LIST_MEMBERS:
+            print(f"警告: リストの上限（{MAX_LIST_MEMBERS}人）を超えた分は監視しません")
+
+        current = set(self.state['members'])
+        added = removed = 0
+        for user_id in wanted:
+            if user_id in current:
+                continue
+            try:
+                await self.client.add_list_member(list_id, user_id)
+                current.add(user_id)
+                added += 1
+            except Exception as e:
+                print(f"ユーザー {user_id} のリスト追加エラー: {e}")
+
+        for user_id in current - set(wanted):
+            try:
+                await self.client.remove_list_member(list_id, user_id)
+                current.discard(user_id)
+                removed += 1
+            except Exception as e:
+                print(f"ユーザー {user_id} のリスト削除エラー: {e}")
+
+        self.state['members'] = sorted(current)
+        self._save_state()
+        print(f"リストを同期しました（追加 {added}人 / 削除 {removed}人 / 合計 {len(current)}人）")
+
+    async def read_timeline(self, since_id=None, max_pages=20, page_size=100):
+        """リストタイムラインから since_id より新しいツイートを取得する"""
+        list_id = await self.ensure_list()
+        since_id = int(since_id or 0)
+        tweets = []
+        results = await self.client.get_list_tweets(list_id, count=page_size)
+
+        for _ in range(max_pages):
+            if not results:
+                break
+            for tweet in results:
+                if int(tweet.id) > since_id:
+                    tweets.append(tweet)
+            # タイムラインは新しい順のため、既読のIDに達したら終了
+            if int(results[-1].id) <= since_id or not results.next_cursor:
+                break
+            results = await results.next()
+
+        return tweets
+
+    def demultiplex(self, tweets):
+        """ツイートを投稿者のユーザーIDごとに振り分ける（新しい順）"""
+        by_author = defaultdict(list)
+        for tweet in sorted(tweets, key=lambda t: int(t.id), reverse=True):
+            by_author[str(tweet.user.id)].append(tweet)
+        return dict(by_author)
+
+    async def poll(self, max_pages=20, page_size=100):
+        """前回以降の新しいツイートを取得し、投稿者ごとに返す
+
+        max_pages で打ち切った場合は最新IDを進めず、読み残した範囲を次回に続きから取得する
+        """
+        list_id = await self.ensure_list()
+
+        async def fetch_page(cursor):
+            return await self.client.get_list_tweets(list_id, count=page_size, cursor=cursor)
+
+        watermark = TimelineWatermark(self.state, newest_key='newest_tweet_id')
+        tweets = await watermark.read(fetch_page, lambda tweet: int(tweet.id), max_pages)
+        if self.state.get('resume_cursor'):
+            print("ページ数の上限に達したため、残りのツイートは次回に取得します")
+        self._save_state()
+        return self.demultiplex(tweets)
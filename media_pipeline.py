@@ -0,0 +1,233 @@
+"""
+メディアアップロードパイプライン
+目的: 画像・GIF・動画を投稿前に検証・変換してアップロードし、投稿時にアップロードを待たなくて済むようにする
+機能:
+- ファイル形式・サイズの検証と、画像の縮小・再圧縮（Pillowがある場合）
+- チャンク分割アップロード（INIT / APPEND / FINALIZE）とセグメントの並列送信
+- 途中で失敗した場合のセグメント単位の再開
+- アカウントと内容のハッシュをキーにしたメディアIDのキャッシュ（有効期限内は再利用）
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_CACHE_PATH = "media_cache/media.db"
+
+# 拡張子ごとのMIMEタイプ・カテゴリ・サイズ上限（バイト）
+MEDIA_TYPES = {
+    '.jpg': ('image/jpeg', 'tweet_image', 5 * 1024 * 1024),
+    '.jpeg': ('image/jpeg', 'tweet_image', 5 * 1024 * 1024),
+    '.png': ('image/png', 'tweet_image', 5 * 1024 * 1024),
+    '.webp': ('image/webp', 'tweet_image', 5 * 1024 * 1024),
+    '.gif': ('image/gif', 'tweet_gif', 15 * 1024 * 1024),
+    '.mp4': ('video/mp4', 'tweet_video', 512 * 1024 * 1024),
+    '.mov': ('video/quicktime', 'tweet_video', 512 * 1024 * 1024),
+}
+# 画像の長辺の上限（ピクセル）
+MAX_IMAGE_SIDE = 4096
+# 1セグメントのサイズ（APPENDの上限は5MB）
+SEGMENT_SIZE = 2 * 1024 * 1024
+# メディアIDの有効期限に対する余裕（秒）
+EXPIRY_MARGIN = 3600
+
+
+class MediaValidationError(Exception):
+    """アップロードできないメディアファイルであることを表す例外"""
+
+
+def _downsize_image(data, mime_type, max_bytes):
+    """画像を上限サイズ・上限解像度に収まるよう縮小・再圧縮する（Pillowが無ければそのまま）"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return data, mime_type
+
+    image = Image.open(io.BytesIO(data))
+    if len(data) <= max_bytes and max(image.size) <= MAX_IMAGE_SIDE:
+        return data, mime_type
+
+    image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+    # 透過のあるPNGはPNGのまま、それ以外はJPEGで品質を下げながら再圧縮
+    if mime_type == 'image/png' and image.mode in ('RGBA', 'LA', 'P'):
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', optimize=True)
+        if buffer.tell() <= max_bytes:
+            return buffer.getvalue(), 'image/png'
+        image = image.convert('RGB')
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    for quality in (90, 85, 75, 65, 50):
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality, optimize=True)
+        if buffer.tell() <= max_bytes:
+            return buffer.getvalue(), 'image/jpeg'
+        # 品質を下げても収まらない場合は解像度も下げる
+        image.thumbnail((int(image.width * 0.8), int(image.height * 0.8)))
+    raise MediaValidationError("画像を上限サイズまで圧縮できませんでした")
+
+
+def prepare_media(path):
+    """メディアファイルを検証し、必要なら変換して (データ, MIMEタイプ, カテゴリ) を返す"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in MEDIA_TYPES:
+        raise MediaValidationError(f"対応していない形式です: {path}")
+    mime_type, category, max_bytes = MEDIA_TYPES[ext]
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data:
+        raise MediaValidationError(f"空のファイルです: {path}")
+
+    if category == 'tweet_image':
+        data, mime_type = _downsize_image(data, mime_type, max_bytes)
+    elif len(data) > max_bytes:
+        # GIF・動画の変換は行わない
+        raise MediaValidationError(f"ファイルサイズが上限（{max_bytes // (1024 * 1024)}MB）を超えています: {path}")
+    return data, mime_type, category
+
+
+class MediaCache:
+    """アカウント・内容のハッシュごとのメディアIDと、途中までのアップロード状態を保存するキャッシュ
+
+    メディアIDはアップロードしたアカウントでしか使えないため、アカウントごとに分けて保存する
+    """
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        # アカウントの区別が無い以前の形式のキャッシュは、どのアカウントのメディアIDか分からないため使わない
+        self.conn.execute("DROP TABLE IF EXISTS media")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS media_uploads (
+                account TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                media_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                segments_done TEXT NOT NULL DEFAULT '[]',
+                expires_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (account, content_hash)
+            )
+        """)
+
+    def get(self, account, content_hash):
+        """有効期限内のエントリを返す（期限切れのメディアIDは使えないため削除）"""
+        row = self.conn.execute(
+            "SELECT * FROM media_uploads WHERE account = ? AND content_hash = ?", (account, content_hash)
+        ).fetchone()
+        if row is None:
+            return None
+        if row['expires_at'] <= time.time():
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM media_uploads WHERE account = ? AND content_hash = ?", (account, content_hash)
+                )
+            return None
+        entry = dict(row)
+        entry['segments_done'] = set(json.loads(entry['segments_done']))
+        return entry
+
+    def save(self, account, content_hash, media_id, status, segments_done, expires_at):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO media_uploads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (account, content_hash, str(media_id), status, json.dumps(sorted(segments_done)),
+                 expires_at, time.time())
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+class MediaUploader:
+    """メディアをチャンク分割・並列でアップロードし、メディアIDをキャッシュするクラス"""
+
+    def __init__(self, client, account, cache=None, segment_size=SEGMENT_SIZE, concurrency=3):
+        """
+        Args:
+            client: アップロードに使うクライアント
+            account: クライアントのアカウント（ユーザーIDなど、キャッシュをアカウントごとに分けるキー）
+        """
+        self.client = client
+        self.account = str(account)
+        self.cache = cache or MediaCache()
+        self.segment_size = segment_size
+        self.concurrency = concurrency
+        self._tasks = {}
+
+    async def _wait_processing(self, media_id, is_long_video, info):
+        """動画などのサーバー側の処理完了を待つ"""
+        while info and info.get('state') in ('pending', 'in_progress'):
+            await asyncio.sleep(info.get('check_after_secs', 1))
+            response, _ = await self.client.v11.upload_media_status(is_long_video, media_id)
+            info = response.get('processing_info')
+        if info and info.get('state') == 'failed':
+            raise RuntimeError(f"メディアの処理に失敗しました: {info.get('error')}")
+
+    async def _upload(self, data, mime_type, category, content_hash):
+        """チャンク分割アップロード（前回の続きがあれば未送信のセグメントのみ送る）"""
+        is_long_video = False
+        entry = self.cache.get(self.account, content_hash)
+        if entry and entry['status'] == 'uploaded':
+            return entry['media_id']
+
+        segments = [data[i:i + self.segment_size] for i in range(0, len(data), self.segment_size)]
+        if entry and entry['status'] == 'appending':
+            media_id, done, expires_at = entry['media_id'], entry['segments_done'], entry['expires_at']
+            print(f"メディア {media_id} のアップロードを再開します（{len(done)}/{len(segments)}セグメント送信済み）")
+        else:
+            response, _ = await self.client.v11.upload_media_init(mime_type, len(data), category, is_long_video)
+            media_id = response['media_id_string']
+            done = set()
+            expires_at = time.time() + response.get('expires_after_secs', 86400) - EXPIRY_MARGIN
+            self.cache.save(self.account, content_hash, media_id, 'appending', done, expires_at)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def append(index):
+            async with semaphore:
+                await self.client.v11.upload_media_append(
+                    is_long_video, media_id, index, io.BytesIO(segments[index])
+                )
+            done.add(index)
+            self.cache.save(self.account, content_hash, media_id, 'appending', done, expires_at)
+
+        # セグメントは順不同で送れるため並列に送信する（失敗しても送信済みの分は記録される）
+        await asyncio.gather(*[append(index) for index in range(len(segments)) if index not in done])
+
+        response, _ = await self.client.v11.upload_media_finelize(is_long_video, media_id)
+        await self._wait_processing(media_id, is_long_video, response.get('processing_info'))
+        self.cache.save(self.account, content_hash, media_id, 'uploaded', done, expires_at)
+        return media_id
+
+    async def upload(self, path):
+        """1つのファイルをアップロードしてメディアIDを返す（同じ内容は再利用）"""
+        data, mime_type, category = await asyncio.to_thread(prepare_media, path)
+        content_hash = hashlib.sha256(data).hexdigest()
+        # 同じ内容のアップロードが進行中ならそれを待つ（完了後はキャッシュの有効期限を確認し直す）
+        task = self._tasks.get(content_hash)
+        if task is None:
+            task = self._tasks[content_hash] = asyncio.ensure_future(
+                self._upload(data, mime_type, category, content_hash)
+            )
+            task.add_done_callback(lambda _: self._tasks.pop(content_hash, None))
+        return await asyncio.shield(task)
+
+    async def upload_all(self, paths):
+        """複数のファイルを並列にアップロードし、順番どおりのメディアIDのリストを返す"""
+        return list(await asyncio.gather(*[self.upload(path) for path in paths or []]))
+
+    def prefetch(self, paths):
+        """投稿時刻より前にアップロードを始めておく（結果はキャッシュに残る）"""
+        async def run():
+            try:
+                await self.upload_all(paths)
+            except Exception as e:
+                print(f"メディアの事前アップロードエラー（投稿時に再試行します）: {e}")
+        return asyncio.create_task(run())
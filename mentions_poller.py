@@ -0,0 +1,201 @@
+"""
+送信ツイートへの返信追跡
+目的: 送信したツイート・リプライへの返信を、リプライごとの検索ではなく自分宛てのメンション通知から一括で取得する
+機能:
+- 送信したツイートのローカルインデックス（SQLite）
+- メンション通知タイムラインのポーリング（前回の最新IDをウォーターマークとして保存、読み残しは次回に続きから取得）
+- 受信した返信と送信ツイートの突き合わせ
+
+使い方:
+    python mentions_poller.py poll
+    python mentions_poller.py replies 1857775411016643010
+"""
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import time
+
+from timeline_scan import TimelineWatermark
+
+DEFAULT_DB_PATH = "reply_tracking/tracking.db"
+
+
+class SentTweetIndex:
+    """送信したツイートと、それに対して受信した返信を保存するインデックス"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sent_tweets (
+                tweet_id TEXT PRIMARY KEY,
+                text TEXT,
+                in_reply_to TEXT,
+                sent_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS replies (
+                reply_id TEXT PRIMARY KEY,
+                sent_tweet_id TEXT NOT NULL,
+                user_id TEXT,
+                screen_name TEXT,
+                text TEXT,
+                created_at TEXT,
+                received_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_replies_sent ON replies (sent_tweet_id);
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+
+    def record_sent(self, tweet_id, text=None, in_reply_to=None):
+        """送信したツイートを登録する"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO sent_tweets (tweet_id, text, in_reply_to, sent_at) VALUES (?, ?, ?, ?)",
+                (str(tweet_id), text, str(in_reply_to) if in_reply_to else None, time.time())
+            )
+
+    def is_sent(self, tweet_id):
+        return self.conn.execute(
+            "SELECT 1 FROM sent_tweets WHERE tweet_id = ?", (str(tweet_id),)
+        ).fetchone() is not None
+
+    def record_reply(self, tweet, sent_tweet_id):
+        """送信ツイートへの返信を保存する（既に保存済みならFalse）"""
+        with self.conn:
+            cursor = self.conn.execute(
+                """INSERT OR IGNORE INTO replies
+                   (reply_id, sent_tweet_id, user_id, screen_name, text, created_at, received_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (str(tweet.id), str(sent_tweet_id), str(tweet.user.id), tweet.user.screen_name,
+                 tweet.text, tweet.created_at, time.time())
+            )
+        return cursor.rowcount > 0
+
+    def replies_for(self, sent_tweet_id):
+        """送信ツイートへの返信一覧を返す（古い順）"""
+        rows = self.conn.execute(
+            "SELECT * FROM replies WHERE sent_tweet_id = ? ORDER BY CAST(reply_id AS INTEGER)",
+            (str(sent_tweet_id),)
+        )
+        return [dict(row) for row in rows]
+
+    def get_state(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else default
+
+    def set_state(self, key, value):
+        """状態を保存する（Noneなら削除）"""
+        with self.conn:
+            if value is None:
+                self.conn.execute("DELETE FROM state WHERE key = ?", (key,))
+            else:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, str(value))
+                )
+
+    def stats(self):
+        sent = self.conn.execute("SELECT COUNT(*) FROM sent_tweets").fetchone()[0]
+        replies = self.conn.execute("SELECT COUNT(*) FROM replies").fetchone()[0]
+        answered = self.conn.execute("SELECT COUNT(DISTINCT sent_tweet_id) FROM replies").fetchone()[0]
+        return {'sent': sent, 'replies': replies, 'answered': answered}
+
+    def close(self):
+        self.conn.close()
+
+
+class MentionsPoller:
+    """メンション通知を前回の続きから取得し、送信ツイートへの返信を振り分けるクラス"""
+
+    WATERMARK_KEY = 'mentions_newest_id'
+    # 上限で打ち切った場合の、それまでに読んだ最新IDと続きのカーソル
+    PENDING_KEY = 'mentions_pending_newest_id'
+    CURSOR_KEY = 'mentions_resume_cursor'
+
+    def __init__(self, client, index=None):
+        self.client = client
+        self.index = index or SentTweetIndex()
+
+    async def poll(self, max_pages=5, page_size=40):
+        """前回以降のメンションを取得し、送信ツイートへの新しい返信を返す
+
+        max_pages で打ち切った場合はウォーターマークを進めず、読み残した範囲を次回に続きから取得する
+
+        Returns:
+            (送信ツイートID, 返信ツイート) のリスト
+        """
+        keys = {self.WATERMARK_KEY: 'newest_id', self.PENDING_KEY: 'pending_newest_id',
+                self.CURSOR_KEY: 'resume_cursor'}
+        state = {name: self.index.get_state(key) for key, name in keys.items()}
+
+        async def fetch_page(cursor):
+            return await self.client.get_notifications('Mentions', count=page_size, cursor=cursor)
+
+        def tweet_id_of(notification):
+            return int(notification.tweet.id) if notification.tweet is not None else None
+
+        notifications = await TimelineWatermark(state).read(fetch_page, tweet_id_of, max_pages)
+
+        matched = []
+        for notification in notifications:
+            tweet = notification.tweet
+            if tweet.in_reply_to and self.index.is_sent(tweet.in_reply_to):
+                if self.index.record_reply(tweet, tweet.in_reply_to):
+                    matched.append((str(tweet.in_reply_to), tweet))
+
+        # 返信を保存した後に状態を更新する（途中で失敗しても次回に同じ範囲を読み直す）
+        for key, name in keys.items():
+            self.index.set_state(key, state.get(name))
+        print(f"メンション {len(notifications)}件を確認し、送信ツイートへの返信 {len(matched)}件を検出しました")
+        if state.get('resume_cursor'):
+            print("ページ数の上限に達したため、残りのメンションは次回に取得します")
+        return matched
+
+
+async def run_poll(max_pages):
+    from client_factory import get_client_factory
+
+    client_factory = get_client_factory()
+    try:
+        await client_factory.authenticate()
+    except Exception as e:
+        print(f"認証エラー: {e}")
+        return []
+
+    poller = MentionsPoller(client_factory.get_client(language='en-US'))
+    matched = await poller.poll(max_pages=max_pages)
+    for sent_tweet_id, tweet in matched:
+        print(f"{sent_tweet_id} ← @{tweet.user.screen_name}: {tweet.text[:50]}")
+    return matched
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="送信ツイートへの返信追跡")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('poll', help="新しいメンションを取得して返信を振り分け")
+    p.add_argument('--max-pages', type=int, default=5)
+
+    p = subparsers.add_parser('replies', help="送信ツイートへの返信を表示")
+    p.add_argument('tweet_id')
+
+    subparsers.add_parser('stats', help="追跡状況を表示")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'poll':
+        asyncio.run(run_poll(args.max_pages))
+    elif args.command == 'replies':
+        for reply in SentTweetIndex().replies_for(args.tweet_id):
+            print(f"@{reply['screen_name']} ({reply['created_at']}): {reply['text']}")
+    elif args.command == 'stats':
+        print(SentTweetIndex().stats())
+
+
+if __name__ == "__main__":
+    main()
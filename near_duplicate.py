@@ -0,0 +1,259 @@
+"""
+ツイートの近似重複検出
+目的: コピペ・テンプレートの宣伝ツイートなど、ほぼ同じ内容のツイートを同じクラスタにまとめ、
+      保存・出力・投稿文生成で各クラスタの代表1件だけを扱えるようにする
+機能:
+- URL・メンション・空白などを除いた本文の正規化と文字n-gramへの分割
+- MinHashによる類似度の推定と、LSH（バンド分割）による類似候補の検索
+- 追加のたびに更新できる永続インデックス（SQLite、前回の実行で見たツイートとも照合）
+- 取り込み時のクラスタIDの割り当てと、クラスタごとの代表の選択
+
+使い方:
+    python near_duplicate.py stats
+    python near_duplicate.py clusters --min-size 3
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import time
+import unicodedata
+from array import array
+
+DEFAULT_DB_PATH = "dedupe_index/near_duplicates.db"
+# 素数 2^61 - 1（MinHashのハッシュ関数の法）
+_MERSENNE_PRIME = (1 << 61) - 1
+
+_URL_PATTERN = re.compile(r'https?://\S+')
+_MENTION_PATTERN = re.compile(r'@\w+')
+_SPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """比較用に本文を正規化する（全角半角の統一・小文字化・URLとメンションの除去）"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    text = _URL_PATTERN.sub(' ', text)
+    text = _MENTION_PATTERN.sub(' ', text)
+    # 記号・絵文字は表記揺れが多いため除き、文字と数字だけを残す
+    text = ''.join(ch if ch.isalnum() or ch.isspace() else ' ' for ch in text)
+    return _SPACE_PATTERN.sub(' ', text).strip()
+
+
+def shingles(text, size=3):
+    """正規化済みの本文を文字n-gramの集合にする（日本語は単語の区切りが無いため文字単位）"""
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class MinHasher:
+    """文字n-gramの集合からMinHashの署名を計算するクラス"""
+
+    def __init__(self, num_perm=64, seed=1, shingle_size=3):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self._coefficients = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+    def signature(self, text):
+        """本文の署名を返す（正規化後に文字が残らない場合はNone）"""
+        hashes = [_hash64(shingle) for shingle in shingles(normalize_text(text), self.shingle_size)]
+        if not hashes:
+            return None
+        return array('Q', (
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+            for a, b in self._coefficients
+        ))
+
+
+def estimate_similarity(sig_a, sig_b):
+    """2つの署名から文字n-gram集合のJaccard係数を推定する"""
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+class NearDuplicateIndex:
+    """MinHash + LSHでツイートの近似重複を検出し、クラスタIDを割り当てる永続インデックス"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, num_perm=64, bands=16, threshold=0.7, seed=1):
+        """
+        Args:
+            num_perm: 署名の長さ（ハッシュ関数の数）
+            bands: LSHのバンド数（num_perm をバンド数で割った数が1バンドの行数）
+            threshold: 同じクラスタとみなす推定類似度の下限
+            seed: ハッシュ関数の乱数シード（インデックスの作成時の値を使い続ける）
+        """
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS docs (
+                doc_id TEXT PRIMARY KEY,
+                cluster_id TEXT NOT NULL,
+                signature BLOB,
+                added_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_cluster ON docs (cluster_id)")
+        # バケットごとにクラスタあたり1件だけ登録する（大きなクラスタでも照合する件数が増えないように）
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS bands (
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                cluster_id TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                PRIMARY KEY (band, bucket, cluster_id)
+            )
+        """)
+
+        # 署名の形式は作成時の設定に固定する（設定が変わると既存の署名と比較できないため）
+        params = {'num_perm': num_perm, 'bands': bands, 'seed': seed}
+        stored = dict(self.conn.execute("SELECT key, value FROM meta").fetchall())
+        if stored:
+            saved = {key: int(stored[key]) for key in params}
+            if saved != params:
+                print(f"警告: 既存のインデックスの設定 {saved} を使用します（{db_path}）")
+            params = saved
+        else:
+            with self.conn:
+                self.conn.executemany("INSERT INTO meta VALUES (?, ?)", [(k, str(v)) for k, v in params.items()])
+        if params['num_perm'] % params['bands']:
+            raise ValueError("num_perm はバンド数で割り切れる必要があります")
+
+        self.hasher = MinHasher(params['num_perm'], params['seed'])
+        self.bands = params['bands']
+        self.rows = params['num_perm'] // params['bands']
+        self.threshold = threshold
+        # 統計情報
+        self.added = 0
+        self.duplicates = 0
+
+    def _buckets(self, signature):
+        """署名をバンドに分割し、バンドごとのバケットキーを返す"""
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows]
+            yield band, hashlib.blake2b(chunk.tobytes(), digest_size=8).hexdigest()
+
+    def _find_cluster(self, signature):
+        """同じバケットに入る既存のツイートのうち、最も似ているもののクラスタIDを返す"""
+        candidates = set()
+        for band, bucket in self._buckets(signature):
+            rows = self.conn.execute(
+                "SELECT cluster_id, doc_id FROM bands WHERE band = ? AND bucket = ?", (band, bucket)
+            )
+            candidates.update(rows)
+
+        best_cluster, best_score = None, self.threshold
+        for cluster_id, doc_id in candidates:
+            blob = self.conn.execute("SELECT signature FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()[0]
+            other = array('Q')
+            other.frombytes(blob)
+            score = estimate_similarity(signature, other)
+            if score >= best_score:
+                best_cluster, best_score = cluster_id, score
+        return best_cluster
+
+    def add(self, doc_id, text):
+        """ツイートをインデックスに追加し、クラスタIDを返す（追加済みなら以前のクラスタID）
+
+        似ているツイートが無い場合は、そのツイート自身のIDが新しいクラスタIDになる
+        """
+        doc_id = str(doc_id)
+        row = self.conn.execute("SELECT cluster_id FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+        if row is not None:
+            return row[0]
+
+        signature = self.hasher.signature(text)
+        cluster_id = self._find_cluster(signature) if signature is not None else None
+        if cluster_id is None:
+            cluster_id = doc_id
+        else:
+            self.duplicates += 1
+
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO docs (doc_id, cluster_id, signature, added_at) VALUES (?, ?, ?, ?)",
+                (doc_id, cluster_id, signature.tobytes() if signature is not None else None, time.time())
+            )
+            # URLだけのツイートなど、本文が残らないものは他と照合しない
+            if signature is not None:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO bands (band, bucket, cluster_id, doc_id) VALUES (?, ?, ?, ?)",
+                    [(band, bucket, cluster_id, doc_id) for band, bucket in self._buckets(signature)]
+                )
+        self.added += 1
+        return cluster_id
+
+    def cluster_sizes(self, min_size=2, limit=50):
+        """ツイート数の多いクラスタから順に (クラスタID, 件数) を返す"""
+        return self.conn.execute(
+            "SELECT cluster_id, COUNT(*) AS size FROM docs GROUP BY cluster_id "
+            "HAVING size >= ? ORDER BY size DESC LIMIT ?",
+            (min_size, limit)
+        ).fetchall()
+
+    def stats(self):
+        docs, clusters = self.conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT cluster_id) FROM docs"
+        ).fetchone()
+        return {
+            'documents': docs,
+            'clusters': clusters,
+            'added_this_run': self.added,
+            'duplicates_this_run': self.duplicates,
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+def representatives(items, cluster_of):
+    """クラスタごとに最初の1件だけを残す（並び替え済みのリストなら各クラスタの上位が残る）
+
+    Args:
+        items: 対象のリスト
+        cluster_of: 要素からクラスタIDを返す関数（Noneの要素は常に残す）
+    """
+    seen = set()
+    kept = []
+    for item in items:
+        cluster_id = cluster_of(item)
+        if cluster_id is not None:
+            if cluster_id in seen:
+                continue
+            seen.add(cluster_id)
+        kept.append(item)
+    return kept
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ツイートの近似重複インデックス")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help="登録済みのツイート数とクラスタ数を表示")
+    p = subparsers.add_parser('clusters', help="ツイート数の多いクラスタを表示")
+    p.add_argument('--min-size', type=int, default=2)
+    p.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    index = NearDuplicateIndex()
+    if args.command == 'stats':
+        stats = index.stats()
+        print(f"ツイート数: {stats['documents']} / クラスタ数: {stats['clusters']}")
+    elif args.command == 'clusters':
+        for cluster_id, size in index.cluster_sizes(args.min_size, args.limit):
+            print(f"{cluster_id}: {size}件")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
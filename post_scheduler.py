@@ -0,0 +1,269 @@
+"""
+投稿スケジューラー
+目的: 承認済みの投稿を時間枠に割り当てて保存し、収集・生成を止めずにバックグラウンドで投稿する
+機能:
+- 承認済み投稿の永続キュー（SQLite、再起動後も未投稿分を引き継ぐ）
+- 最小投稿間隔・1日の上限に合わせた投稿時刻（スロット）の割り当て
+- スロット時刻に投稿するバックグラウンドディスパッチャー（承認後は別プロセスの run コマンドか次回の起動時に投稿）
+- 投稿途中で中断した投稿や、送信後に応答が得られなかった投稿は二重投稿を避けるため自動では再送しない
+
+使い方:
+    python post_scheduler.py list
+    python post_scheduler.py run
+    python post_scheduler.py requeue 12
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+DEFAULT_DB_PATH = "post_schedule/schedule.db"
+
+
+def _may_have_posted(error):
+    """送信後の読み取りタイムアウトや5xx応答など、サーバーが投稿を受け付けた可能性が残るエラーかどうか"""
+    import httpx
+    from twikit.errors import ServerError
+
+    # 5xx はサーバー側で投稿を処理した後に返ることもある
+    if isinstance(error, ServerError):
+        return True
+    if not isinstance(error, httpx.TransportError):
+        return False
+    # 接続の確立・接続プールの待ちで失敗した場合はリクエストを送信していない
+    return not isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+class PostScheduler:
+    """承認済みの投稿を時間枠に割り当て、時刻になったら投稿するクラス"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, min_interval=300, max_per_day=50, max_attempts=3):
+        """
+        Args:
+            min_interval: 投稿の最小間隔（秒）
+            max_per_day: 24時間あたりの最大投稿数
+            max_attempts: 投稿エラー時の最大試行回数
+        """
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                content TEXT NOT NULL,
+                reply_to TEXT,
+                media_paths TEXT,
+                source_url TEXT,
+                slot_at REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                tweet_id TEXT,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                posted_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_due ON posts (status, slot_at)")
+        self.min_interval = min_interval
+        self.max_per_day = max_per_day
+        self.max_attempts = max_attempts
+        self._wakeup = None
+        self._stop_when_empty = False
+        self._stopped = False
+        self._recover_interrupted()
+
+    def _recover_interrupted(self):
+        """前回の実行で投稿途中のまま止まった投稿を確認待ちにする（投稿済みか判別できないため）"""
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE posts SET status = 'interrupted', last_error = ? WHERE status = 'posting'",
+                ("投稿中に中断されました。投稿済みか確認してから requeue してください",)
+            )
+        if cursor.rowcount:
+            print(f"警告: 投稿途中で中断された投稿が{cursor.rowcount}件あります（python post_scheduler.py list で確認）")
+
+    def _next_slot(self, not_before=None):
+        """最後のスロットから最小間隔を空けた次の投稿時刻を返す"""
+        row = self.conn.execute(
+            "SELECT MAX(slot_at) FROM posts WHERE status IN ('pending', 'posting', 'posted')"
+        ).fetchone()
+        slot = max(time.time(), not_before or 0, (row[0] or 0) + self.min_interval)
+        # 24時間の上限を超える場合は、枠が空くまで後ろにずらす
+        while True:
+            count = self.conn.execute(
+                "SELECT COUNT(*) FROM posts WHERE status IN ('pending', 'posting', 'posted') "
+                "AND slot_at > ? AND slot_at <= ?",
+                (slot - 86400, slot)
+            ).fetchone()[0]
+            if count < self.max_per_day:
+                return slot
+            oldest = self.conn.execute(
+                "SELECT MIN(slot_at) FROM posts WHERE status IN ('pending', 'posting', 'posted') AND slot_at > ?",
+                (slot - 86400,)
+            ).fetchone()[0]
+            slot = oldest + 86400 + 1
+
+    def schedule(self, content, reply_to=None, media_paths=None, source_url=None, not_before=None):
+        """承認済みの投稿を次の空きスロットに登録し、投稿予定時刻を返す"""
+        slot = self._next_slot(not_before)
+        with self.conn:
+            self.conn.execute(
+                """INSERT INTO posts (content, reply_to, media_paths, source_url, slot_at, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (content, reply_to, json.dumps(media_paths or []), source_url, slot, time.time())
+            )
+        if self._wakeup is not None:
+            self._wakeup.set()
+        print(f"投稿を予約しました: {datetime.fromtimestamp(slot).strftime('%Y-%m-%d %H:%M:%S')}")
+        return slot
+
+    def pending_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM posts WHERE status = 'pending'").fetchone()[0]
+
+    def list_posts(self, statuses=None):
+        query = "SELECT * FROM posts"
+        params = []
+        if statuses:
+            query += f" WHERE status IN ({','.join('?' * len(statuses))})"
+            params = list(statuses)
+        return [dict(row) for row in self.conn.execute(query + " ORDER BY slot_at", params)]
+
+    def requeue(self, post_id):
+        """中断・失敗した投稿を次の空きスロットに再登録する"""
+        slot = self._next_slot()
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE posts SET status = 'pending', slot_at = ?, attempts = 0 "
+                "WHERE id = ? AND status IN ('interrupted', 'failed')",
+                (slot, post_id)
+            )
+        return cursor.rowcount > 0
+
+    def _claim_due(self):
+        """投稿時刻を過ぎた投稿を1件取り出して投稿中にする"""
+        row = self.conn.execute(
+            "SELECT * FROM posts WHERE status = 'pending' AND slot_at <= ? ORDER BY slot_at LIMIT 1",
+            (time.time(),)
+        ).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute(
+                "UPDATE posts SET status = 'posting', attempts = attempts + 1 WHERE id = ?", (row['id'],)
+            )
+        return dict(row)
+
+    def _seconds_until_next(self):
+        row = self.conn.execute("SELECT MIN(slot_at) FROM posts WHERE status = 'pending'").fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    async def _dispatch(self, post, publish):
+        """1件投稿して結果を記録する"""
+        try:
+            tweet_id = await publish(
+                post['content'],
+                media_paths=json.loads(post['media_paths'] or '[]'),
+                reply_to=post['reply_to']
+            )
+        except Exception as e:
+            if _may_have_posted(e):
+                # 再送すると二重投稿になりうるため、投稿済みか確認してから requeue してもらう
+                with self.conn:
+                    self.conn.execute(
+                        "UPDATE posts SET status = 'interrupted', last_error = ? WHERE id = ?",
+                        (f"応答が得られませんでした（投稿済みか確認してから requeue してください）: {e}", post['id'])
+                    )
+                print(f"投稿の結果が不明です（ID {post['id']}）: {e}")
+                return
+            retry = post['attempts'] + 1 < self.max_attempts
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE posts SET status = ?, last_error = ?, slot_at = ? WHERE id = ?",
+                    ('pending' if retry else 'failed', str(e),
+                     time.time() + self.min_interval if retry else post['slot_at'], post['id'])
+                )
+            print(f"投稿エラー（ID {post['id']}）: {e}")
+            return
+        with self.conn:
+            self.conn.execute(
+                "UPDATE posts SET status = 'posted', tweet_id = ?, posted_at = ? WHERE id = ?",
+                (str(tweet_id) if tweet_id else None, time.time(), post['id'])
+            )
+        print(f"予約投稿が完了しました（ID {post['id']}）")
+
+    async def run_dispatcher(self, publish, stop_when_empty=False):
+        """スロット時刻になった投稿を順に投稿する（バックグラウンドタスクとして実行）
+
+        Args:
+            publish: async関数(content, media_paths=..., reply_to=...) -> 投稿したツイートID
+            stop_when_empty: 予約中の投稿が無くなったら終了するか
+        """
+        self._wakeup = asyncio.Event()
+        self._stop_when_empty = stop_when_empty
+        self._stopped = False
+        while not self._stopped:
+            post = self._claim_due()
+            if post is not None:
+                await self._dispatch(post, publish)
+                continue
+            wait = self._seconds_until_next()
+            if wait is None and self._stop_when_empty:
+                return
+            self._wakeup.clear()
+            try:
+                # 次のスロットまで、または新しい予約が入るまで待つ
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait if wait is not None else 60)
+            except asyncio.TimeoutError:
+                pass
+
+    def finish(self):
+        """予約中の投稿がすべて終わったらディスパッチャーを終了させる"""
+        self._stop_when_empty = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def stop(self):
+        """投稿中の1件が終わった時点でディスパッチャーを終了させる（残りの予約は保存したまま）"""
+        self._stopped = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def close(self):
+        self.conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="投稿スケジューラー")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('list', help="予約中・中断・失敗した投稿を表示")
+    p.add_argument('--all', action='store_true', help="投稿済みも表示")
+    p = subparsers.add_parser('run', help="予約中の投稿をスロット時刻に投稿（すべて終わったら終了）")
+    p.add_argument('--cookie', default=None, help="投稿に使うCookieファイル（省略時は既定のCookieセット）")
+    p = subparsers.add_parser('requeue', help="中断・失敗した投稿を再予約")
+    p.add_argument('post_id', type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        # 投稿処理（メディアのアップロード・送信ツイートの登録）はパイプラインと共通
+        from twitter_semi_auto import dispatch_scheduled_posts
+        asyncio.run(dispatch_scheduled_posts(args.cookie))
+        return
+
+    scheduler = PostScheduler()
+    if args.command == 'list':
+        statuses = None if args.all else ('pending', 'interrupted', 'failed')
+        for post in scheduler.list_posts(statuses):
+            slot = datetime.fromtimestamp(post['slot_at']).strftime('%Y-%m-%d %H:%M')
+            print(f"[{post['id']}] {slot} {post['status']}: {post['content'][:40]}"
+                  + (f" ({post['last_error']})" if post['last_error'] else ""))
+    elif args.command == 'requeue':
+        print("再予約しました" if scheduler.requeue(args.post_id) else "再予約できる投稿がありません")
+
+
+if __name__ == "__main__":
+    main()
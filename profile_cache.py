@@ -0,0 +1,87 @@
+"""
+ユーザープロフィールキャッシュ
+目的: 各ツールで取得したユーザー情報をユーザーIDごとに1件へまとめて保存する
+機能:
+- SQLiteによるプロフィールの追加・更新（同じユーザーは上書き）
+- ユーザーID・スクリーンネームからの参照
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_CACHE_PATH = "profile_cache/profiles.db"
+
+
+def user_to_profile(user):
+    """twikitのUserをプロフィール情報の辞書に整理する"""
+    return {
+        'user_id': user.id,                      # ユーザーID
+        'name': user.name,                       # 表示名
+        'screen_name': user.screen_name,         # @ユーザー名
+        'description': user.description,         # プロフィール文
+        'location': user.location,               # 場所
+        'followers_count': user.followers_count, # フォロワー数
+        'following_count': user.following_count, # フォロー数
+        'tweets_count': user.statuses_count,     # ツイート数
+        'created_at': user.created_at,           # アカウント作成日
+        'profile_image_url': user.profile_image_url  # プロフィール画像URL
+    }
+
+
+class ProfileCache:
+    """ユーザーIDをキーにプロフィールを保存するキャッシュ"""
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS profiles (
+                user_id INTEGER PRIMARY KEY,
+                screen_name TEXT,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_profiles_screen_name ON profiles (screen_name)")
+
+    def upsert_many(self, users):
+        """複数ユーザーをまとめて保存する（twikitのUserまたはプロフィール辞書）"""
+        now = time.time()
+        rows = []
+        for user in users:
+            profile = user if isinstance(user, dict) else user_to_profile(user)
+            rows.append((int(profile['user_id']), profile['screen_name'],
+                         json.dumps(profile, ensure_ascii=False), now))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO profiles (user_id, screen_name, data, updated_at) VALUES (?, ?, ?, ?)",
+                rows
+            )
+        return len(rows)
+
+    def upsert(self, user):
+        """1ユーザーを保存する"""
+        return self.upsert_many([user])
+
+    def get(self, user_id):
+        """ユーザーIDからプロフィールを取得する"""
+        row = self.conn.execute(
+            "SELECT data FROM profiles WHERE user_id = ?", (int(user_id),)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_by_screen_name(self, screen_name):
+        """スクリーンネームからプロフィールを取得する"""
+        row = self.conn.execute(
+            "SELECT data FROM profiles WHERE screen_name = ? ORDER BY updated_at DESC LIMIT 1",
+            (screen_name,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
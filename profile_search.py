@@ -1,15 +1,16 @@
-from twikit import Client
+from client_factory import get_client_factory
 import json
 import os
 from datetime import datetime
 import asyncio
 
 class TwitterProfileFetcher:
-    def __init__(self):
-        # Twitterクライアントを英語（米国）設定で初期化
-        self.client = Client(language='en-US')
+    def __init__(self, client_factory=None):
+        # 共有ファクトリから英語（米国）設定のクライアントを取得（接続プールを共有）
+        self.client_factory = client_factory or get_client_factory()
+        self.client = self.client_factory.get_client(language='en-US')
         # 認証クッキーのパス
-        self.cookie_path = "twitter_json/cookie_edit.json"
+        self.cookie_path = self.client_factory.cookie_path
         # 結果を保存するディレクトリ
         self.results_dir = "profile_results"
         # 結果保存用ディレクトリが存在しない場合は作成
@@ -18,11 +19,8 @@ class TwitterProfileFetcher:
     async def setup(self):
         """クッキーを使用して認証を設定する"""
         try:
-            # クッキーファイルを開き、JSONデータを読み込む
-            with open(self.cookie_path, 'r', encoding='utf-8') as file:
-                cookies = json.load(file)
-            # クライアントにクッキーを設定
-            self.client.set_cookies(cookies)
+            # 共有ファクトリ経由でクッキーを設定（読み込みはプールごとに1回）
+            await self.client_factory.authenticate()
             print("認証に成功しました！")
             return True
         except Exception as e:
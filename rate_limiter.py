@@ -0,0 +1,68 @@
+"""
+APIリクエストのレート制限
+目的: 同一プロセス内の全ジョブ・全アナライザーで1つのリクエスト予算を共有する
+機能:
+- トークンバケット方式の非同期レートリミッター
+- 共有HTTPクライアントに差し込むトランスポートラッパー
+"""
+
+import asyncio
+import time
+
+import httpx
+
+
+class RateLimiter:
+    """トークンバケット方式で全リクエストの送信ペースを制御するクラス"""
+
+    def __init__(self, requests=50, per_seconds=60.0, burst=None):
+        # per_seconds秒あたりrequests回まで（burstは瞬間的に許可する最大数）
+        self.rate = requests / per_seconds
+        self.capacity = burst if burst is not None else requests
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        # 統計情報
+        self.acquired = 0
+        self.waited_seconds = 0.0
+
+    def _refill(self):
+        """経過時間に応じてトークンを補充する"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        """トークンを1つ取得する（不足している場合は補充まで待機）"""
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                wait = (1 - self.tokens) / self.rate
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self.tokens -= 1
+            self.acquired += 1
+
+    def stats(self):
+        """実行サマリー用の統計情報を返す"""
+        return {
+            'requests': self.acquired,
+            'waited_seconds': round(self.waited_seconds, 2),
+            'rate_per_minute': round(self.rate * 60, 2)
+        }
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """送信前にレートリミッターのトークンを取得するトランスポート"""
+
+    def __init__(self, transport, limiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    async def handle_async_request(self, request):
+        await self.limiter.acquire()
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,109 @@
+"""
+ツイートレコード処理の共通関数
+目的: オンラインの各アナライザーとオフラインの一括後処理で同じ処理を共有する
+機能:
+- リプライ本文からのメンション抽出
+- キーワードの出現場所の判定
+- Excel出力用の行データ作成
+- 保存済みJSONレコードの形式の正規化
+"""
+
+from datetime import datetime
+
+from time_utils import CREATED_AT_FORMAT
+
+
+def extract_mentions(text, exclude=None):
+    """リプライ（@で始まるツイート）の本文から@ユーザー名を抽出する"""
+    if not text or not text.startswith('@'):
+        return []
+    return [
+        word[1:] for word in text.split()
+        if word.startswith('@') and word[1:] and word[1:] != exclude
+    ]
+
+
+def find_keyword_locations(keyword, text, description, name, screen_name):
+    """キーワードがツイート本文・プロフィール・名前のどこに出現するかを返す"""
+    keyword = keyword.lower()
+    keyword_locations = []
+    if keyword in (text or '').lower():
+        keyword_locations.append('tweet_text')
+    if keyword in (description or '').lower():
+        keyword_locations.append('profile_description')
+    if keyword in (name or '').lower():
+        keyword_locations.append('user_name')
+    if keyword in (screen_name or '').lower():
+        keyword_locations.append('screen_name')
+    return keyword_locations
+
+
+def parse_created_at(created_at):
+    """Twitter形式の投稿日時文字列をdatetimeに変換する（失敗時はNone）"""
+    try:
+        return datetime.strptime(created_at, CREATED_AT_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def build_keyword_row(result, keyword, sort_by, searched_at):
+    """キーワード検索結果1件をExcel出力用の行に変換する"""
+    user = result['user']
+    tweet = result['tweet']
+    return {
+        '検索日時': searched_at,
+        '検索キーワード': keyword,
+        '並び順': sort_by,
+        '投稿日時': tweet['created_at'],
+        'アカウント名': user['name'],
+        'ユーザーID': f"@{user['screen_name']}",
+        'プロフィール文': user['profile_description'],
+        'フォロワー数': user['followers_count'],
+        'フォロー数': user['following_count'],
+        'ツイート本文': tweet['text'],
+        'いいね数': tweet['like_count'],
+        'リツイート数': tweet['retweet_count'],
+        'リプライ数': tweet.get('reply_count', 0),
+        'クラスタID': tweet.get('cluster_id', ''),
+        'ツイートURL': tweet['tweet_url'],
+        'アカウントURL': user['profile_url'],
+        'キーワード出現場所': ', '.join(result.get('keyword_locations', [])),
+        '場所': user.get('location') or '',
+        '言語': tweet.get('language', '')
+    }
+
+
+def normalize_record(record):
+    """保存済みレコードをキーワード検索結果の形式（user / tweet）に揃える
+
+    search_results/ のフラットな形式と keyword_search_results/ の入れ子形式の両方に対応する
+    """
+    if 'user' in record and 'tweet' in record:
+        return record
+
+    screen_name = record.get('screen_name', '')
+    tweet_id = record.get('tweet_id', '')
+    return {
+        'user': {
+            'user_id': record.get('user_id', ''),
+            'name': record.get('user_name', ''),
+            'screen_name': screen_name,
+            'profile_description': record.get('profile_description', ''),
+            'profile_url': f"https://twitter.com/{screen_name}",
+            'followers_count': record.get('followers_count', 0),
+            'following_count': record.get('following_count', 0),
+            'profile_image_url': record.get('profile_image_url', ''),
+            'location': record.get('location', '')
+        },
+        'tweet': {
+            'tweet_id': tweet_id,
+            'tweet_url': f"https://twitter.com/{screen_name}/status/{tweet_id}",
+            'text': record.get('text', ''),
+            'created_at': record.get('created_at', ''),
+            'retweet_count': record.get('retweet_count', 0),
+            'like_count': record.get('like_count', 0),
+            'reply_count': record.get('reply_count', 0),
+            'language': record.get('lang', '')
+        },
+        'keyword_locations': record.get('keyword_locations', [])
+    }
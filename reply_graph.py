@@ -0,0 +1,206 @@
+"""
+リプライグラフ分析
+目的: 保存済みのリプライ分析結果をまとめ、複数ターゲットにまたがる分析をAPIを使わずに行う
+機能:
+- profile_results/ と reply_analysis_results/ の分析結果から疎行列のリプライグラフを構築
+  （行: 分析対象ユーザー、列: リプライ先ユーザー、値: リプライ数）
+- 相互リプライ率、ターゲットごとの上位リプライ先
+- ターゲット間のオーディエンス重複（共通ユーザー数・Jaccard係数・コサイン類似度）
+- 被リプライ数とPageRankによる中心性
+
+使い方:
+    python reply_graph.py --top 10
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+from datetime import datetime
+
+DEFAULT_SOURCES = (
+    ("profile_results", r"analysis_(?P<target>.+)_(?P<ts>\d{8}_\d{6})\.json$"),
+    ("reply_analysis_results", r"reply_analysis_(?P<target>.+)_(?P<ts>\d{8}_\d{6})\.json$"),
+)
+
+
+def _reply_entries(data):
+    """分析結果ファイルから (スクリーンネーム, リプライ数) を取り出す（両形式に対応）"""
+    for entry in data:
+        if 'profile' in entry:
+            yield entry['profile']['screen_name'], entry['reply_count']
+        elif 'screen_name' in entry:
+            yield entry['screen_name'], entry['reply_count']
+
+
+def load_latest_runs(sources=DEFAULT_SOURCES):
+    """ターゲットごとに最新の分析結果を読み込む
+
+    Returns:
+        {ターゲット: {リプライ先: リプライ数}}
+    """
+    latest = {}
+    for results_dir, pattern in sources:
+        for path in glob.glob(os.path.join(results_dir, '*.json')):
+            match = re.search(pattern, os.path.basename(path))
+            if not match:
+                continue
+            target, ts = match.group('target'), match.group('ts')
+            if target not in latest or ts > latest[target][0]:
+                latest[target] = (ts, path)
+
+    runs = {}
+    for target, (_, path) in sorted(latest.items()):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                runs[target] = dict(_reply_entries(json.load(f)))
+        except Exception as e:
+            print(f"読み込みエラー: {path}: {e}")
+    return runs
+
+
+class ReplyGraph:
+    """ユーザーをノード、リプライ数を重みとする疎行列グラフ"""
+
+    def __init__(self, runs):
+        from scipy.sparse import csr_matrix
+
+        # ターゲットを先頭に並べ、リプライ先のみのユーザーを後ろに追加
+        self.users = list(runs)
+        self.index = {name: i for i, name in enumerate(self.users)}
+        rows, cols, weights = [], [], []
+        for target, replies in runs.items():
+            for reply_to, reply_count in replies.items():
+                if reply_to not in self.index:
+                    self.index[reply_to] = len(self.users)
+                    self.users.append(reply_to)
+                rows.append(self.index[target])
+                cols.append(self.index[reply_to])
+                weights.append(reply_count)
+        self.targets = list(runs)
+        n = len(self.users)
+        self.matrix = csr_matrix((weights, (rows, cols)), shape=(n, n), dtype='float64')
+        self.matrix.sum_duplicates()
+
+    def reciprocity(self):
+        """相互にリプライしているエッジの割合と、相互ペアの一覧を返す"""
+        a = self.matrix
+        mutual = a.multiply(a.T).tocoo()
+        pairs = sorted(
+            (self.users[i], self.users[j]) for i, j in zip(mutual.row, mutual.col) if i < j
+        )
+        return (mutual.nnz / a.nnz if a.nnz else 0.0), pairs
+
+    def top_replies(self, target, top_n=10):
+        """ターゲットのリプライ先を多い順に返す"""
+        row = self.matrix.getrow(self.index[target])
+        order = row.data.argsort()[::-1][:top_n]
+        return [(self.users[row.indices[i]], int(row.data[i])) for i in order]
+
+    def audience_overlap(self):
+        """ターゲット間の共通ユーザー数・Jaccard係数・コサイン類似度を返す"""
+        import numpy as np
+        from scipy.sparse import diags
+
+        t = self.matrix[:len(self.targets)]
+        binary = (t > 0).astype('float64')
+        common = (binary @ binary.T).toarray()
+        degree = np.diag(common)
+        union = degree[:, None] + degree[None, :] - common
+        jaccard = np.divide(common, union, out=np.zeros_like(common), where=union > 0)
+
+        norms = np.sqrt(t.multiply(t).sum(axis=1)).A1
+        inv = diags(np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0))
+        normalized = inv @ t
+        cosine = (normalized @ normalized.T).toarray()
+
+        overlaps = []
+        for i in range(len(self.targets)):
+            for j in range(i + 1, len(self.targets)):
+                if common[i, j]:
+                    overlaps.append({
+                        'targets': [self.targets[i], self.targets[j]],
+                        'common_users': int(common[i, j]),
+                        'jaccard': round(float(jaccard[i, j]), 4),
+                        'cosine': round(float(cosine[i, j]), 4),
+                    })
+        return sorted(overlaps, key=lambda x: x['jaccard'], reverse=True)
+
+    def centrality(self, top_n=20, damping=0.85, iterations=100, tol=1e-9):
+        """被リプライ数と重み付きPageRankの上位ユーザーを返す"""
+        import numpy as np
+        from scipy.sparse import diags
+
+        a = self.matrix
+        n = a.shape[0]
+        in_weight = a.sum(axis=0).A1
+        out_weight = a.sum(axis=1).A1
+
+        # 行を出次数で正規化した遷移行列（出辺の無いノードは一様に分配）
+        inv_out = diags(np.divide(1.0, out_weight, out=np.zeros_like(out_weight), where=out_weight > 0))
+        transition = (inv_out @ a).T.tocsr()
+        dangling = out_weight == 0
+        rank = np.full(n, 1.0 / n)
+        for _ in range(iterations):
+            new_rank = damping * (transition @ rank + rank[dangling].sum() / n) + (1 - damping) / n
+            if np.abs(new_rank - rank).sum() < tol:
+                rank = new_rank
+                break
+            rank = new_rank
+
+        order = np.argsort(-rank)[:top_n]
+        return [{
+            'screen_name': self.users[i],
+            'pagerank': round(float(rank[i]), 6),
+            'in_replies': int(in_weight[i]),
+            'targets_replying': int((a[:, i] > 0).sum()),
+        } for i in order]
+
+
+def save_report(report, results_dir="profile_results"):
+    """グラフ分析結果をJSONファイルとして保存する"""
+    try:
+        current_time = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = os.path.join(results_dir, f"reply_graph_{current_time}.json")
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"グラフ分析結果を保存しました: {filename}")
+        return filename
+    except Exception as e:
+        print(f"保存エラー: {e}")
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="リプライグラフ分析")
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    runs = load_latest_runs()
+    if not runs:
+        print("分析結果が見つかりませんでした。")
+        return
+
+    graph = ReplyGraph(runs)
+    rate, pairs = graph.reciprocity()
+    report = {
+        'targets': graph.targets,
+        'users': len(graph.users),
+        'edges': int(graph.matrix.nnz),
+        'reciprocity': round(rate, 4),
+        'mutual_pairs': pairs,
+        'top_replies': {target: graph.top_replies(target, args.top) for target in graph.targets},
+        'audience_overlap': graph.audience_overlap(),
+        'centrality': graph.centrality(args.top),
+    }
+
+    print(f"ターゲット {len(graph.targets)}人 / ユーザー {report['users']}人 / エッジ {report['edges']}本")
+    print(f"相互リプライ率: {report['reciprocity']:.2%}")
+    for overlap in report['audience_overlap'][:args.top]:
+        print(f"{' × '.join(overlap['targets'])}: 共通 {overlap['common_users']}人 (Jaccard {overlap['jaccard']})")
+    save_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+リプライ走査
+目的: reply_search_excel.py と reply_search_v2.py で共通の、タイムラインを走査してリプライ先を数える処理
+機能:
+- リプライを含むタイムラインのページ取得とリプライ先の集計（正確な集計・近似集計・差分分析）
+- 上位の順位の収束、予算の予約分・使い切りによる走査の打ち切りと終了理由の記録
+- 前回打ち切った走査の範囲の読み飛ばしと、続きのカーソルからの再開
+"""
+from collections import Counter, defaultdict
+from heavy_hitters import BoundedReplyCounter
+from record_utils import extract_mentions
+from reply_state import day_of
+from request_budget import BudgetExhaustedError, current_budget
+
+# analyze_user_replies の走査の終了理由
+STOP_REASONS = {
+    'budget': '分析対象ツイート数に到達',
+    'end_of_timeline': 'タイムラインの末尾に到達',
+    'reached_previous_scan': '前回走査したツイートに到達',
+    'converged': '上位の順位が安定',
+    'page_error': 'ページ取得エラー',
+    'budget_reserved': '詳細取得のための予算を確保',
+    'budget_exhausted': '予算を使い切った',
+    'error': '分析エラー',
+}
+# リプライを含むタイムラインのエンドポイント（予算の判定に使用）
+SCAN_ENDPOINT = 'UserTweetsAndReplies'
+
+class ReplyScanner:
+    """指定したユーザーのタイムラインを走査してリプライ先を数えるクラス"""
+
+    def __init__(self, client, dead_letters, reply_state):
+        self.client = client
+        # 再試行しても取得できなかったレコードの記録先
+        self.dead_letters = dead_letters
+        # 分析対象ごとの日別リプライ件数（差分分析で前回までの集計に加算する）
+        self.reply_state = reply_state
+        # 直近の analyze_user_replies の走査状況（終了理由など）
+        self.last_scan_info = {}
+
+    @property
+    def budget(self):
+        """現在のタスクで使用中のリクエスト予算（未設定ならNone）"""
+        return current_budget()
+
+    async def _resolve_reply_users(self, screen_names, target_screen_name):
+        """リプライ先のスクリーンネームからユーザー情報を取得する（失敗したユーザーは記録して除外）"""
+        reply_users = {}
+        for index, reply_to in enumerate(screen_names):
+            try:
+                reply_users[reply_to] = await self.client.get_user_by_screen_name(reply_to)
+                print(f"ユーザー {reply_to} の情報を取得しました")
+            except BudgetExhaustedError as e:
+                print(f"予算を使い切ったため残り{len(screen_names) - index}人の情報取得を中止します: {e}")
+                self.budget.note_truncation(
+                    'resolve_users', str(e), target=target_screen_name,
+                    skipped_users=len(screen_names) - index
+                )
+                break
+            except Exception as e:
+                print(f"ユーザー {reply_to} の情報取得をスキップ: {e}")
+                self.dead_letters.record(
+                    'resolve_user',
+                    {'screen_name': reply_to, 'target': target_screen_name},
+                    e, source='analyze_user_replies'
+                )
+        return reply_users
+
+    async def _resume_scan(self, target_user, tweets_to_analyze, resume, results):
+        """前回打ち切った走査の続きのカーソルからページを取得する（失敗した場合は次のページを読む）"""
+        try:
+            page = await self.client.get_user_tweets(
+                target_user.id,
+                tweet_type='Replies',
+                count=min(tweets_to_analyze, 100),
+                cursor=resume[2]
+            )
+            # 期限切れのカーソルで空のページが返った場合も、終端とはみなさず読み直す
+            if page:
+                return page
+            print("前回の続きが空のため、集計済みのページも読み直します")
+        except BudgetExhaustedError:
+            raise
+        except Exception as e:
+            print(f"前回の続きを取得できませんでした（集計済みのページも読み直します）: {e}")
+        return await results.next()
+
+    @staticmethod
+    def _top_repliers(counts, k, min_replies):
+        """リプライ数がmin_replies以上の上位k人の順位（同数はスクリーンネーム順）"""
+        ranked = sorted(
+            ((name, count) for name, count in counts if count >= min_replies),
+            key=lambda x: (-x[1], x[0])
+        )
+        return [name for name, _ in ranked[:k]]
+
+    async def analyze_user_replies(self, screen_name, tweets_to_analyze=200, sketch_capacity=None, min_replies=1,
+                                   incremental=False, window_days=None, stable_pages=None, stable_top_k=10):
+        """指定したユーザーのツイートから、リプライを分析する
+
+        sketch_capacityを指定すると、リプライ先を近似集計（Space-Saving）で数えてメモリ使用量を抑え、
+        最終候補のみを正確に数え直してユーザー情報を取得する（min_replies未満のユーザーは返さない）
+
+        incrementalを指定すると、前回走査した最新のツイートより新しいツイートのみを走査して
+        日別の件数を保存済みの集計に加算し、直近window_days日の合計を返す（sketch_capacityは使わない）
+
+        stable_pagesを指定すると、min_replies以上の上位stable_top_k人の順位が
+        stable_pagesページ続けて変わらなかった時点で、tweets_to_analyzeに達していなくても走査を終了する
+        （差分分析では無効、終了理由は self.last_scan_info に記録される）
+        """
+        self.last_scan_info = {'target': screen_name}
+        bounded = BoundedReplyCounter(sketch_capacity) if sketch_capacity and not incremental else None
+        try:
+            # ユーザー情報を取得
+            target_user = await self.client.get_user_by_screen_name(screen_name)
+            print(f"{screen_name}のツイートを分析中...")
+
+            # リプライしているユーザーをスクリーンネームベースで追跡
+            reply_counter = Counter()
+            reply_users = {}
+            # 情報取得に失敗したユーザー（同じユーザーを何度も再取得しない）
+            unresolved = set()
+
+            # 差分分析: 前回走査した最新のツイートまで遡ったら終了する
+            since_id = None
+            daily_counts = defaultdict(Counter)
+            newest_id = oldest_id = None
+            # 前回までに打ち切った走査の範囲（集計済みのため数えず、範囲に入ったら続きのカーソルから取得する）
+            scanned_ranges = []
+            # 今回タイムラインの先頭から連続して走査した範囲
+            span_low = span_top = None
+            reached_known = page_error = False
+            # 走査の終了理由と、上位の順位が変わらなかったページ数
+            stop_reason = 'end_of_timeline'
+            pages = unchanged_pages = 0
+            previous_top = None
+            # 予算がある場合はユーザー情報の取得を走査後の候補のみに絞る
+            budget = self.budget
+            if incremental:
+                state = self.reply_state.get_target(screen_name)
+                if state and state['newest_tweet_id']:
+                    since_id = int(state['newest_tweet_id'])
+                    print(f"前回の分析（{day_of(since_id)}のツイートまで走査済み）以降のツイートのみ取得します")
+                    scanned_ranges = self.reply_state.scanned_ranges(screen_name)
+                    if scanned_ranges:
+                        print(f"前回までに打ち切った走査の続き（未走査の範囲 {len(scanned_ranges)}件）も取得します")
+            
+            # ツイートを取得（リプライを含む）
+            print("ツイートを取得中...")
+            results = await self.client.get_user_tweets(
+                target_user.id,
+                tweet_type='Replies',  # Repliesタイプに変更
+                count=min(tweets_to_analyze, 100)
+            )
+
+            analyzed_count = 0
+            while results and analyzed_count < tweets_to_analyze:
+                last_id = None
+                for tweet in results:
+                    if incremental:
+                        last_id = int(tweet.id)
+                        span_top = max(span_top or last_id, last_id)
+                        # 固定ツイートなど走査済みのツイートは数えない
+                        if since_id is not None and last_id <= since_id:
+                            continue
+                        if any(low <= last_id <= high for low, high, _ in scanned_ranges):
+                            continue
+                        newest_id = max(newest_id or last_id, last_id)
+                        oldest_id = min(oldest_id or last_id, last_id)
+                    try:
+                        # リプライ先のツイートテキストを解析
+                        if hasattr(tweet, 'text') and tweet.text.startswith('@'):
+                            # @ユーザー名を抽出（分析対象自身は除外）
+                            mentioned_users = extract_mentions(tweet.text, exclude=screen_name)
+                            
+                            for reply_to in mentioned_users:
+                                if reply_to and incremental:
+                                    # 投稿日ごとに数える（ユーザー情報は期間の集計後にまとめて取得する）
+                                    daily_counts[day_of(tweet.id)][reply_to] += 1
+                                elif reply_to and bounded is not None:
+                                    # ユーザー情報は最終候補のみ後でまとめて取得する
+                                    bounded.add(reply_to)
+                                elif reply_to:
+                                    # ユーザー情報の取得に失敗してもリプライ数は数える
+                                    reply_counter[reply_to] += 1
+                                    if budget is None and reply_to not in reply_users and reply_to not in unresolved:
+                                        # スクリーンネームからユーザー情報を取得
+                                        try:
+                                            reply_user = await self.client.get_user_by_screen_name(reply_to)
+                                            reply_users[reply_to] = reply_user
+                                            print(f"ユーザー {reply_to} の情報を取得しました")
+                                        except Exception as e:
+                                            print(f"ユーザー {reply_to} の情報取得をスキップ: {e}")
+                                            unresolved.add(reply_to)
+                                            self.dead_letters.record(
+                                                'resolve_user',
+                                                {'screen_name': reply_to, 'target': screen_name},
+                                                e, source='analyze_user_replies'
+                                            )
+                    except Exception as e:
+                        continue
+                    
+                    analyzed_count += 1
+                    if analyzed_count % 20 == 0:
+                        print(f"{analyzed_count}件のツイートを分析済み")
+
+                # ページの末尾が走査済みのツイートなら、それより古いページは取得しない
+                pages += 1
+                if last_id is not None:
+                    span_low = min(span_low or last_id, last_id)
+                if since_id is not None and last_id is not None and last_id <= since_id:
+                    reached_known = True
+                    stop_reason = 'reached_previous_scan'
+                    break
+
+                # 上位の順位が一定ページ数変わらなければ、残りのページを取得せずに終了する
+                # （差分分析では途中で止めると前回との間に未走査のツイートが残るため行わない）
+                if stable_pages and not incremental:
+                    if bounded is not None:
+                        counts = bounded.sketch.most_common()
+                    else:
+                        counts = reply_counter.items()
+                    top = self._top_repliers(counts, stable_top_k, min_replies)
+                    unchanged_pages = unchanged_pages + 1 if top and top == previous_top else 0
+                    previous_top = top
+                    if unchanged_pages >= stable_pages:
+                        stop_reason = 'converged'
+                        print(f"上位{len(top)}人の順位が{stable_pages}ページ続けて変わらないため走査を終了します")
+                        break
+                    
+                # 残りの予算が詳細取得のための予約分を下回ったら、次のページは取得しない
+                if (budget is not None and analyzed_count < tweets_to_analyze and results.next_cursor
+                        and budget.reserve_reached(SCAN_ENDPOINT)):
+                    stop_reason = 'budget_reserved'
+                    budget.note_truncation(
+                        'scan', '詳細取得のための予算を残すため走査を終了',
+                        target=screen_name, analyzed_tweets=analyzed_count
+                    )
+                    print("詳細取得のための予算を残すため走査を終了します")
+                    break
+
+                if analyzed_count < tweets_to_analyze and results.next_cursor:
+                    try:
+                        # 前回打ち切った走査の範囲に入ったら、集計済みのページを読み飛ばして続きから取得する
+                        resume = next((r for r in scanned_ranges if r[2] and last_id is not None
+                                       and r[0] <= last_id <= r[1]), None)
+                        if resume is not None:
+                            results = await self._resume_scan(target_user, tweets_to_analyze, resume, results)
+                            span_low = min(span_low, resume[0])
+                            scanned_ranges = [r for r in scanned_ranges if r is not resume]
+                            scanned_ranges.append((resume[0], resume[1], None))
+                        else:
+                            results = await results.next()
+                    except BudgetExhaustedError as e:
+                        stop_reason = 'budget_exhausted'
+                        budget.note_truncation('scan', str(e), target=screen_name, analyzed_tweets=analyzed_count)
+                        print(f"予算を使い切ったため走査を終了します: {e}")
+                        break
+                    except Exception as e:
+                        print(f"追加ツイート取得エラー: {e}")
+                        # 続きのページは後から補完できるようカーソルを記録
+                        self.dead_letters.record(
+                            'timeline_page',
+                            {'user_id': target_user.id, 'screen_name': screen_name,
+                             'cursor': results.next_cursor, 'tweet_type': 'Replies'},
+                            e, source='analyze_user_replies'
+                        )
+                        page_error = True
+                        stop_reason = 'page_error'
+                        break
+                else:
+                    if analyzed_count >= tweets_to_analyze:
+                        stop_reason = 'budget'
+                    break
+
+            self.last_scan_info.update({
+                'analyzed_tweets': analyzed_count,
+                'pages': pages,
+                'stop_reason': stop_reason,
+            })
+
+            if incremental:
+                # 前回走査したツイートまで遡る前に終了した場合は最新IDを進めず、次回に続きから走査する
+                complete = since_id is None or reached_known or stop_reason == 'end_of_timeline'
+                if not complete:
+                    print("警告: 前回走査したツイートまで遡る前に終了しました（その間のツイートは次回の差分分析で集計します）")
+                self.reply_state.merge(
+                    screen_name, target_user.id, daily_counts, newest_id, oldest_id, analyzed_count,
+                    complete=complete, span=(span_low, span_top) if span_top else None,
+                    resume_cursor=results.next_cursor if results else None
+                )
+                for start, end in self.reply_state.gaps(screen_name):
+                    print(f"警告: {start}〜{end}のツイートは未走査です")
+                reply_counter = self.reply_state.window_counts(screen_name, window_days)
+                period = f"直近{window_days}日" if window_days else "全期間"
+                print(f"差分分析: 新しいツイート {analyzed_count}件を加算しました"
+                      f"（{period}を集計、{self.reply_state.coverage_start(screen_name)}以降を走査済み）")
+                reply_users = await self._resolve_reply_users(
+                    [name for name, count in reply_counter.most_common() if count >= min_replies], screen_name
+                )
+
+            if bounded is not None:
+                stats = bounded.stats(min_replies)
+                print(f"近似集計: リプライ {stats['total']}件 / 誤差の上限 {stats['error_bound']}件 / "
+                      f"候補 {stats['candidates']}人")
+                if bounded.may_miss(min_replies):
+                    print(f"警告: 誤差の上限が最小リプライ数（{min_replies}）以上のため、"
+                          "該当するユーザーを取りこぼす可能性があります（sketch_capacityを増やしてください）")
+                # 候補のみ正確に数え直し、条件を満たすユーザーの情報だけを取得する
+                reply_counter = bounded.exact_counts(min_replies)
+                reply_users = await self._resolve_reply_users(
+                    [name for name, _ in reply_counter.most_common()], screen_name
+                )
+            elif budget is not None and not incremental:
+                # 走査中に取得しなかったユーザー情報を、条件を満たす候補のみ取得する
+                reply_users = await self._resolve_reply_users(
+                    [name for name, count in reply_counter.most_common() if count >= min_replies], screen_name
+                )
+
+            print(f"\n分析完了: {analyzed_count}件のツイートを処理")
+            print(f"リプライ先ユーザー数: {len(reply_users)}人")
+            
+            return reply_counter, reply_users
+
+        except BudgetExhaustedError as e:
+            # 走査を始める前に予算を使い切った場合（ジョブ全体の制限時間を過ぎてから開始した場合など）
+            print(f"予算を使い切ったため分析できませんでした: {e}")
+            self.last_scan_info['stop_reason'] = 'budget_exhausted'
+            self.budget.note_truncation(
+                'scan', str(e), target=screen_name,
+                analyzed_tweets=self.last_scan_info.get('analyzed_tweets', 0)
+            )
+            return Counter(), {}
+        except Exception as e:
+            print(f"分析エラー: {e}")
+            self.last_scan_info['stop_reason'] = 'error'
+            return Counter(), {}
+        finally:
+            if bounded is not None:
+                bounded.close()
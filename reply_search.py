@@ -1,35 +1,46 @@
-from twikit import Client
+from client_factory import get_client_factory
 import json
 import os
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import asyncio
 from collections import Counter
+from dead_letter import DeadLetterQueue
+from heavy_hitters import BoundedReplyCounter
+from list_monitor import TwitterListMonitor
+from time_utils import datetime_to_snowflake
 
 class TwitterReplyAnalyzer:
-    def __init__(self):
-        # Twitterクライアントを英語（米国）設定で初期化
-        self.client = Client(language='en-US')
+    def __init__(self, client_factory=None):
+        # 共有ファクトリから英語（米国）設定のクライアントを取得（接続プールを共有）
+        self.client_factory = client_factory or get_client_factory()
+        self.client = self.client_factory.get_client(language='en-US')
         # 認証クッキーのパス
-        self.cookie_path = "twitter_json/cookie_edit.json"
+        self.cookie_path = self.client_factory.cookie_path
         # 結果を保存するディレクトリ
         self.results_dir = "reply_analysis_results"
         # 結果保存用ディレクトリが存在しない場合は作成
         os.makedirs(self.results_dir, exist_ok=True)
+        # 再試行しても取得できなかったレコードの記録先
+        self.dead_letters = DeadLetterQueue()
 
     async def setup(self):
         """クッキーを使用して認証を設定する"""
         try:
-            with open(self.cookie_path, 'r', encoding='utf-8') as file:
-                cookies = json.load(file)
-            self.client.set_cookies(cookies)
+            # 共有ファクトリ経由でクッキーを設定（読み込みはプールごとに1回）
+            await self.client_factory.authenticate()
             print("認証に成功しました！")
             return True
         except Exception as e:
             print(f"認証エラー: {e}")
             return False
 
-    async def get_user_tweets_with_replies(self, screen_name, tweets_to_analyze=200):
-        """指定したユーザーのツイートを取得し、リプライを分析する"""
+    async def get_user_tweets_with_replies(self, screen_name, tweets_to_analyze=200, sketch_capacity=None, min_replies=1):
+        """指定したユーザーのツイートを取得し、リプライを分析する
+
+        sketch_capacityを指定すると、リプライ先を近似集計（Space-Saving）で数えてメモリ使用量を抑え、
+        最終候補のみを正確に数え直す（min_replies未満のユーザーは返さない）
+        """
+        bounded = BoundedReplyCounter(sketch_capacity) if sketch_capacity else None
         try:
             # ユーザー情報を取得
             target_user = await self.client.get_user_by_screen_name(screen_name)
@@ -49,7 +60,10 @@ class TwitterReplyAnalyzer:
             while results and analyzed_count < tweets_to_analyze:
                 for tweet in results:
                     if tweet.in_reply_to and tweet.in_reply_to != target_user.id:
-                        reply_counter[tweet.in_reply_to] += 1
+                        if bounded is not None:
+                            bounded.add(tweet.in_reply_to)
+                        else:
+                            reply_counter[tweet.in_reply_to] += 1
                     analyzed_count += 1
                     
                 if analyzed_count < tweets_to_analyze and results.next_cursor:
@@ -57,15 +71,47 @@ class TwitterReplyAnalyzer:
                 else:
                     break
 
+            if bounded is not None:
+                stats = bounded.stats(min_replies)
+                print(f"近似集計: リプライ {stats['total']}件 / 誤差の上限 {stats['error_bound']}件 / "
+                      f"候補 {stats['candidates']}人")
+                if bounded.may_miss(min_replies):
+                    print(f"警告: 誤差の上限が最小リプライ数（{min_replies}）以上のため、"
+                          "該当するユーザーを取りこぼす可能性があります（sketch_capacityを増やしてください）")
+                # 候補のみ正確に数え直す
+                reply_counter = bounded.exact_counts(min_replies)
+
             return reply_counter
 
         except Exception as e:
             print(f"ツイート取得エラー: {e}")
             return Counter()
+        finally:
+            if bounded is not None:
+                bounded.close()
+
+    async def _get_watchlist_tweets(self, user_ids, list_name, days=7):
+        """監視リストのタイムラインから対象ユーザーの直近days日のツイートを投稿者ごとに取得"""
+        monitor = TwitterListMonitor(self.client, list_name)
+        try:
+            await monitor.sync_members(user_ids)
+            since_id = datetime_to_snowflake(datetime.now(timezone.utc) - timedelta(days=days))
+            return monitor.demultiplex(await monitor.read_timeline(since_id=since_id))
+        except Exception as e:
+            print(f"リストタイムライン取得エラー: {e}")
+            return None
+
+    async def get_frequent_repliers_info(self, reply_counter, min_replies=3, watchlist_name=None):
+        """頻繁にリプライしているユーザーの詳細情報を取得
 
-    async def get_frequent_repliers_info(self, reply_counter, min_replies=3):
-        """頻繁にリプライしているユーザーの詳細情報を取得"""
+        watchlist_nameを指定すると、最近のツイートをユーザーごとではなく
+        監視リストのタイムライン1本からまとめて取得する
+        """
         frequent_repliers = []
+        list_tweets = None
+        if watchlist_name:
+            user_ids = [user_id for user_id, reply_count in reply_counter.items() if reply_count >= min_replies]
+            list_tweets = await self._get_watchlist_tweets(user_ids, watchlist_name)
         
         for user_id, reply_count in reply_counter.most_common():
             if reply_count >= min_replies:
@@ -73,9 +119,12 @@ class TwitterReplyAnalyzer:
                     # ユーザー情報を取得
                     user = await self.client.get_user_by_id(user_id)
                     
-                    # ユーザーの最近のツイートを取得
+                    # ユーザーの最近のツイートを取得（監視リストがあればそこから振り分け）
                     tweets = []
-                    results = await user.get_tweets(tweet_type='Tweets', count=10)
+                    if list_tweets is not None:
+                        results = list_tweets.get(str(user.id), [])[:10]
+                    else:
+                        results = await user.get_tweets(tweet_type='Tweets', count=10)
                     for tweet in results:
                         tweets.append({
                             'tweet_id': tweet.id,
@@ -98,6 +147,10 @@ class TwitterReplyAnalyzer:
                     
                 except Exception as e:
                     print(f"ユーザー情報取得エラー: {e}")
+                    self.dead_letters.record(
+                        'enrich_user', {'user_id': user_id, 'reply_count': reply_count},
+                        e, source='get_frequent_repliers_info'
+                    )
                     continue
 
         return frequent_repliers
@@ -128,9 +181,12 @@ async def main():
     # 分析対象のユーザー名を指定（@を除いた名前）
     target_user = "tatsuhara1029"
     min_replies = 3  # 最小リプライ数の閾値
+    sketch_capacity = None  # 近似集計で保持するユーザー数（大量のリプライを分析する場合に指定）
 
     # リプライを分析
-    reply_counter = await analyzer.get_user_tweets_with_replies(target_user)
+    reply_counter = await analyzer.get_user_tweets_with_replies(
+        target_user, sketch_capacity=sketch_capacity, min_replies=min_replies
+    )
     
     # 頻繁にリプライしているユーザーの情報を取得
     frequent_repliers = await analyzer.get_frequent_repliers_info(reply_counter, min_replies)
@@ -1,106 +1,61 @@
-from twikit import Client
+from client_factory import get_client_factory
 import json
 import os
 from datetime import datetime
 import asyncio
-from collections import Counter
-import pandas as pd
+from dead_letter import DeadLetterQueue
+from reply_scan import STOP_REASONS, ReplyScanner
+from reply_state import ReplyStateStore
+from request_budget import RequestBudget, current_budget, use_budget
+from time_utils import parse_created_at_series, to_excel_datetime
 
 class TwitterProfileAnalyzer:
-    def __init__(self):
-        # Twitterクライアントを英語（米国）設定で初期化
-        self.client = Client(language='en-US')
+    def __init__(self, client_factory=None):
+        # 共有ファクトリから英語（米国）設定のクライアントを取得（接続プールを共有）
+        self.client_factory = client_factory or get_client_factory()
+        self.client = self.client_factory.get_client(language='en-US')
         # 認証クッキーのパス
-        self.cookie_path = "twitter_json/cookie_edit.json"
+        self.cookie_path = self.client_factory.cookie_path
         # 結果を保存するディレクトリ
         self.results_dir = "profile_results"
         # 結果保存用ディレクトリが存在しない場合は作成
         os.makedirs(self.results_dir, exist_ok=True)
+        # 再試行しても取得できなかったレコードの記録先
+        self.dead_letters = DeadLetterQueue()
+        # 分析対象ごとの日別リプライ件数（差分分析で前回までの集計に加算する）
+        self.reply_state = ReplyStateStore()
+        # タイムラインの走査（reply_search_excel.py と共通）
+        self.scanner = ReplyScanner(self.client, self.dead_letters, self.reply_state)
+        # 直近の analyze_user_replies の走査状況（終了理由など）
+        self.last_scan_info = {}
+
+    @property
+    def budget(self):
+        """現在のタスクで使用中のリクエスト予算（未設定ならNone）"""
+        return current_budget()
 
     async def setup(self):
         """クッキーを使用して認証を設定する"""
         try:
-            # クッキーファイルを開き、JSONデータを読み込む
-            with open(self.cookie_path, 'r', encoding='utf-8') as file:
-                cookies = json.load(file)
-            # クライアントにクッキーを設定
-            self.client.set_cookies(cookies)
+            # 共有ファクトリ経由でクッキーを設定（読み込みはプールごとに1回）
+            await self.client_factory.authenticate()
             print("認証に成功しました！")
             return True
         except Exception as e:
             print(f"認証エラー: {e}")
             return False
 
-    async def analyze_user_replies(self, screen_name, tweets_to_analyze=200):
-        """指定したユーザーのツイートから、リプライを分析する"""
+    async def analyze_user_replies(self, screen_name, tweets_to_analyze=200, sketch_capacity=None, min_replies=1,
+                                   incremental=False, window_days=None, stable_pages=None, stable_top_k=10):
+        """指定したユーザーのツイートから、リプライを分析する（オプションは ReplyScanner.analyze_user_replies を参照）"""
         try:
-            # ユーザー情報を取得
-            target_user = await self.client.get_user_by_screen_name(screen_name)
-            print(f"{screen_name}のツイートを分析中...")
-
-            # リプライしているユーザーをスクリーンネームベースで追跡
-            reply_counter = Counter()
-            reply_users = {}
-            
-            # ツイートを取得（リプライを含む）
-            print("ツイートを取得中...")
-            results = await self.client.get_user_tweets(
-                target_user.id,
-                tweet_type='Replies',  # Repliesタイプに変更
-                count=min(tweets_to_analyze, 100)
+            return await self.scanner.analyze_user_replies(
+                screen_name, tweets_to_analyze, sketch_capacity=sketch_capacity, min_replies=min_replies,
+                incremental=incremental, window_days=window_days,
+                stable_pages=stable_pages, stable_top_k=stable_top_k
             )
-
-            analyzed_count = 0
-            while results and analyzed_count < tweets_to_analyze:
-                for tweet in results:
-                    try:
-                        # リプライ先のツイートテキストを解析
-                        if hasattr(tweet, 'text') and tweet.text.startswith('@'):
-                            # @ユーザー名を抽出
-                            mentioned_users = [
-                                word[1:] for word in tweet.text.split()
-                                if word.startswith('@')
-                            ]
-                            
-                            for reply_to in mentioned_users:
-                                if reply_to and reply_to != screen_name:
-                                    try:
-                                        if reply_to not in reply_users:
-                                            # スクリーンネームからユーザー情報を取得
-                                            try:
-                                                reply_user = await self.client.get_user_by_screen_name(reply_to)
-                                                reply_users[reply_to] = reply_user
-                                                print(f"ユーザー {reply_to} の情報を取得しました")
-                                            except Exception as e:
-                                                continue
-                                        reply_counter[reply_to] += 1
-                                    except Exception as e:
-                                        print(f"ユーザー {reply_to} の情報取得をスキップ: {e}")
-                                        continue
-                    except Exception as e:
-                        continue
-                    
-                    analyzed_count += 1
-                    if analyzed_count % 20 == 0:
-                        print(f"{analyzed_count}件のツイートを分析済み")
-                    
-                if analyzed_count < tweets_to_analyze and results.next_cursor:
-                    try:
-                        results = await results.next()
-                    except Exception as e:
-                        print(f"追加ツイート取得エラー: {e}")
-                        break
-                else:
-                    break
-
-            print(f"\n分析完了: {analyzed_count}件のツイートを処理")
-            print(f"リプライ先ユーザー数: {len(reply_users)}人")
-            
-            return reply_counter, reply_users
-
-        except Exception as e:
-            print(f"分析エラー: {e}")
-            return Counter(), {}
+        finally:
+            self.last_scan_info = self.scanner.last_scan_info
 
     async def get_user_profile(self, user):
         """ユーザーのプロフィール情報を取得する"""
@@ -163,6 +118,42 @@ class TwitterProfileAnalyzer:
         except Exception as e:
             print(f"保存エラー: {e}")
             return None
+
+    def truncations(self, target_screen_name):
+        """予算のために打ち切った処理のうち、指定した分析対象のものを返す"""
+        budget = self.budget
+        if budget is None:
+            return []
+        return [entry for entry in budget.truncated if entry.get('target') == target_screen_name]
+
+    def save_run_metadata(self, results_path, target_screen_name):
+        """分析結果に対応するメタデータ（走査の終了理由・予算・打ち切った処理）を保存する
+
+        分析結果と同じディレクトリの *.json を読み込む処理と混ざらないよう run_meta/ に保存する
+        """
+        try:
+            meta_dir = os.path.join(self.results_dir, "run_meta")
+            os.makedirs(meta_dir, exist_ok=True)
+            name = os.path.basename(results_path) if results_path else \
+                f"analysis_{target_screen_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+            truncated = self.truncations(target_screen_name)
+            metadata = {
+                'target': target_screen_name,
+                'results_file': results_path,
+                'partial': bool(truncated),
+                'truncated': truncated,
+                'scan': self.last_scan_info,
+                'budget': {key: value for key, value in self.budget.summary().items() if key != 'truncated'},
+            }
+            filename = os.path.join(meta_dir, name)
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(metadata, f, ensure_ascii=False, indent=2)
+            if truncated:
+                print(f"予算のため途中で打ち切った結果です（詳細: {filename}）")
+            return filename
+        except Exception as e:
+            print(f"メタデータの保存エラー: {e}")
+            return None
         
     def save_to_excel(self, frequent_repliers_data, target_screen_name):
         """分析結果をExcelファイルとして保存"""
@@ -197,8 +188,12 @@ class TwitterProfileAnalyzer:
                 }
                 rows.append(row)
             
-            # DataFrameを作成
+            # pandasはExcel出力時のみ読み込む（JSONのみの実行では不要）
+            import pandas as pd
+
+            # DataFrameを作成（アカウント作成日は文字列ではなく日時型で出力）
             df = pd.DataFrame(rows)
+            df['アカウント作成日'] = to_excel_datetime(parse_created_at_series(df['アカウント作成日']))
             
             # Excelファイル名を生成
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -230,30 +225,41 @@ class TwitterProfileAnalyzer:
             print(f"Excelファイルの保存中にエラーが発生しました: {e}")
             return None
 
-async def main():
+async def main(target_user="sora19ai", min_replies=3, tweets_to_analyze=200, excel=True, sketch_capacity=None,
+               incremental=False, window_days=None, stable_pages=None, stable_top_k=10,
+               deadline_seconds=None, max_requests=None, endpoint_caps=None):
+    # 制限時間・リクエスト数の指定があればこの実行用の予算を設定する（無ければジョブ全体の予算を使う）
+    if deadline_seconds or max_requests or endpoint_caps:
+        use_budget(RequestBudget(deadline_seconds, max_requests, endpoint_caps))
+    budget = current_budget()
     analyzer = TwitterProfileAnalyzer()
     
     if not await analyzer.setup():
         return
 
-    # 分析対象のユーザー名を指定（@を除いた名前）
-    target_user = "sora19ai"
-    min_replies = 3  # 最小リプライ数の閾値
-    tweets_to_analyze = 200  # 分析するツイート数
-
     print(f"\n{target_user}のリプライを分析します...")
     print(f"- 分析対象ツイート数: {tweets_to_analyze}")
     print(f"- 最小リプライ数: {min_replies}")
 
     # リプライを分析
-    reply_counter, reply_users = await analyzer.analyze_user_replies(target_user, tweets_to_analyze)
+    reply_counter, reply_users = await analyzer.analyze_user_replies(
+        target_user, tweets_to_analyze, sketch_capacity=sketch_capacity, min_replies=min_replies,
+        incremental=incremental, window_days=window_days,
+        stable_pages=stable_pages, stable_top_k=stable_top_k
+    )
+    scan = analyzer.last_scan_info
+    print(f"走査の終了理由: {STOP_REASONS.get(scan.get('stop_reason'), scan.get('stop_reason'))}"
+          f"（{scan.get('pages', 0)}ページ / {scan.get('analyzed_tweets', 0)}件）")
     
+    # 予算を設定した実行では、該当者がいなくても途中結果とメタデータを必ず保存する
     if not reply_counter:
         print("\nリプライが見つかりませんでした。")
-        return
+        if budget is None:
+            return
 
     # 頻繁にリプライしているユーザーの情報を収集
     frequent_repliers_data = []
+    skipped_tweets = []
     print("\nリプライの多いユーザーの情報を収集中...")
     
     for screen_name, reply_count in reply_counter.most_common():
@@ -261,7 +267,12 @@ async def main():
             try:
                 user = reply_users[screen_name]
                 profile_data = await analyzer.get_user_profile(user)
-                tweets = await analyzer.get_user_tweets(user, count=3)
+                # 予算を使い切った後はプロフィール（取得済み）のみ記録し、最近のツイートは取得しない
+                if budget is not None and budget.exhausted('UserTweets'):
+                    skipped_tweets.append(screen_name)
+                    tweets = []
+                else:
+                    tweets = await analyzer.get_user_tweets(user, count=3)
                 
                 if profile_data:
                     user_data = {
@@ -273,12 +284,24 @@ async def main():
                     print(f"@{screen_name}の情報を取得しました（リプライ数: {reply_count}）")
             except Exception as e:
                 print(f"@{screen_name}の情報取得に失敗: {e}")
+                analyzer.dead_letters.record(
+                    'enrich_user',
+                    {'screen_name': screen_name, 'reply_count': reply_count, 'target': target_user},
+                    e, source='reply_analysis'
+                )
                 continue
+    if skipped_tweets:
+        budget.note_truncation(
+            'enrichment', '予算を使い切ったため最近のツイートを取得せず',
+            target=target_user, users=skipped_tweets
+        )
+        print(f"予算を使い切ったため{len(skipped_tweets)}人の最近のツイートは取得していません")
     
     # 結果を表示
     if not frequent_repliers_data:
         print(f"\n{min_replies}回以上リプライしているユーザーは見つかりませんでした。")
-        return
+        if budget is None:
+            return
 
     print(f"\n{min_replies}回以上リプライしているユーザー ({len(frequent_repliers_data)}人):")
     for user_data in frequent_repliers_data:
@@ -294,10 +317,14 @@ async def main():
             for tweet in user_data['recent_tweets']:
                 print(f"- {tweet['text']}")
 
-    # 結果を保存
-    if frequent_repliers_data:
-        analyzer.save_results(frequent_repliers_data, target_user)  # JSON形式で保存
-        analyzer.save_to_excel(frequent_repliers_data, target_user)  # Excel形式で保存
+    # 結果を保存（予算で打ち切った場合は途中結果であることをメタデータに記録）
+    outputs = [analyzer.save_results(frequent_repliers_data, target_user)]  # JSON形式で保存
+    if excel and frequent_repliers_data:
+        outputs.append(analyzer.save_to_excel(frequent_repliers_data, target_user))  # Excel形式で保存
+    if budget is not None:
+        outputs.append(analyzer.save_run_metadata(outputs[0], target_user))
+    # 保存したファイルのパスを返す（ジョブ実行サマリー用）
+    return [path for path in outputs if path]
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
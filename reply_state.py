@@ -0,0 +1,226 @@
+"""
+分析対象ごとのリプライ集計の状態
+目的: 同じユーザーのリプライ分析を繰り返すとき、前回までに走査したツイートを再取得せず、
+      新しいツイートの集計だけを追加して期間全体のレポートを作れるようにする
+機能:
+- 分析対象ごとの日別（ツイートIDから求めたUTCの日付）のリプライ先別件数の保存（SQLite）
+- 走査済みの最新・最古のツイートIDの記録（次回は最新IDより新しいツイートのみ走査）
+- 前回の最新IDまで遡る前に終了した走査の範囲と続きのカーソルの記録（次回に続きから走査して未走査の範囲を埋める）
+- 新しい集計の加算（1トランザクションで件数と最新IDを更新）
+- 指定した日数の期間での件数の合計
+
+使い方:
+    python reply_state.py list
+    python reply_state.py show sora19ai --window 30
+    python reply_state.py prune sora19ai --keep-days 90
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from time_utils import snowflake_to_datetime
+
+DEFAULT_DB_PATH = "reply_state/reply_state.db"
+
+
+def day_of(tweet_id):
+    """ツイートIDから投稿日（UTC、YYYY-MM-DD）を求める"""
+    return snowflake_to_datetime(tweet_id).strftime('%Y-%m-%d')
+
+
+class ReplyStateStore:
+    """分析対象ごとの日別リプライ件数と走査済みの範囲を保存するクラス"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS targets (
+                target TEXT PRIMARY KEY,
+                user_id TEXT,
+                newest_tweet_id TEXT,
+                oldest_tweet_id TEXT,
+                scanned_tweets INTEGER NOT NULL DEFAULT 0,
+                scans INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS daily_counts (
+                target TEXT NOT NULL,
+                day TEXT NOT NULL,
+                reply_to TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (target, day, reply_to)
+            )
+        """)
+        # 最新IDより新しい範囲のうち、集計済みの範囲（low_id 〜 high_id）と、その続き（古い側）のカーソル
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS scanned_ranges (
+                target TEXT NOT NULL,
+                low_id INTEGER NOT NULL,
+                high_id INTEGER NOT NULL,
+                cursor TEXT,
+                PRIMARY KEY (target, low_id)
+            )
+        """)
+
+    def get_target(self, target):
+        """分析対象の状態を返す（未分析ならNone）"""
+        row = self.conn.execute("SELECT * FROM targets WHERE target = ?", (target.lower(),)).fetchone()
+        return dict(row) if row else None
+
+    def list_targets(self):
+        return [dict(row) for row in self.conn.execute("SELECT * FROM targets ORDER BY target")]
+
+    def scanned_ranges(self, target):
+        """最新IDより新しい集計済みの範囲を (最古のID, 最新のID, 続きのカーソル) のリストで返す（新しい順）"""
+        return [tuple(row) for row in self.conn.execute(
+            "SELECT low_id, high_id, cursor FROM scanned_ranges WHERE target = ? ORDER BY high_id DESC",
+            (target.lower(),)
+        )]
+
+    def merge(self, target, user_id, daily_counts, newest_tweet_id, oldest_tweet_id, scanned_tweets,
+              complete=True, span=None, resume_cursor=None):
+        """新しく走査した分の日別件数を加算し、走査済みの範囲を更新する
+
+        Args:
+            daily_counts: {日付: Counter(リプライ先 → 件数)}
+            newest_tweet_id: 今回走査した最新のツイートID（無ければNone）
+            oldest_tweet_id: 今回走査した最古のツイートID（無ければNone）
+            complete: 前回の最新IDまで（または終端まで）遡ったか
+                （Falseなら最新IDは進めず、今回走査した範囲を記録して次回に続きから走査する）
+            span: 今回タイムラインの先頭から連続して走査した範囲（最古のID, 最新のID）
+            resume_cursor: 走査を終えた位置の続きのカーソル
+        """
+        target = target.lower()
+        state = self.get_target(target) or {}
+        previous = state.get('newest_tweet_id')
+        low, high = span if span else (None, None)
+        oldest = min((int(i) for i in (state.get('oldest_tweet_id'), oldest_tweet_id) if i), default=None)
+        with self.conn:
+            if complete or not previous:
+                # 前回の最新IDまで遡った場合は、途中の範囲もすべて集計済みになる
+                newest = max((int(i) for i in (previous, newest_tweet_id, high) if i), default=None)
+                self.conn.execute("DELETE FROM scanned_ranges WHERE target = ?", (target,))
+            else:
+                newest = int(previous)
+                if high is not None:
+                    # 今回の範囲に含まれる・重なる以前の範囲は1つにまとめ、最も古い側の続きのカーソルを残す
+                    rows = self.conn.execute(
+                        "SELECT low_id, cursor FROM scanned_ranges WHERE target = ? AND high_id >= ?",
+                        (target, span[0])
+                    ).fetchall()
+                    for row_low, row_cursor in rows:
+                        if row_low < low:
+                            low, resume_cursor = row_low, row_cursor
+                    self.conn.execute(
+                        "DELETE FROM scanned_ranges WHERE target = ? AND high_id >= ?", (target, span[0])
+                    )
+                    self.conn.execute(
+                        "INSERT INTO scanned_ranges (target, low_id, high_id, cursor) VALUES (?, ?, ?, ?)",
+                        (target, low, high, resume_cursor)
+                    )
+            self.conn.executemany(
+                """INSERT INTO daily_counts (target, day, reply_to, count) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(target, day, reply_to) DO UPDATE SET count = count + excluded.count""",
+                [(target, day, reply_to, count)
+                 for day, counter in daily_counts.items() for reply_to, count in counter.items()]
+            )
+            self.conn.execute(
+                """INSERT INTO targets (target, user_id, newest_tweet_id, oldest_tweet_id,
+                                        scanned_tweets, scans, updated_at)
+                   VALUES (?, ?, ?, ?, ?, 1, ?)
+                   ON CONFLICT(target) DO UPDATE SET
+                       user_id = excluded.user_id,
+                       newest_tweet_id = excluded.newest_tweet_id,
+                       oldest_tweet_id = excluded.oldest_tweet_id,
+                       scanned_tweets = targets.scanned_tweets + excluded.scanned_tweets,
+                       scans = targets.scans + 1,
+                       updated_at = excluded.updated_at""",
+                (target, str(user_id) if user_id else None,
+                 str(newest) if newest else None, str(oldest) if oldest else None,
+                 scanned_tweets, time.time())
+            )
+
+    def window_counts(self, target, window_days=None):
+        """直近window_days日（省略時は全期間）のリプライ先別件数の合計を返す"""
+        query = "SELECT reply_to, SUM(count) FROM daily_counts WHERE target = ?"
+        params = [target.lower()]
+        if window_days:
+            since = (datetime.now(timezone.utc) - timedelta(days=window_days - 1)).strftime('%Y-%m-%d')
+            query += " AND day >= ?"
+            params.append(since)
+        return Counter(dict(self.conn.execute(query + " GROUP BY reply_to", params).fetchall()))
+
+    def coverage_start(self, target):
+        """途切れずに走査済みの期間の開始日（期間がこれより前に及ぶ場合、その分は集計されていないか欠けている）"""
+        state = self.get_target(target)
+        if not state or not state['oldest_tweet_id']:
+            return None
+        ranges = self.scanned_ranges(target)
+        if ranges:
+            # 未走査の範囲がある場合は、最も新しい未走査の範囲の終わりまで
+            return day_of(ranges[0][0])
+        return day_of(state['oldest_tweet_id'])
+
+    def gaps(self, target):
+        """未走査の範囲を (開始日, 終了日) のリストで返す（新しい順）"""
+        state = self.get_target(target)
+        if not state or not state['newest_tweet_id']:
+            return []
+        bounds = [low for low, _, _ in self.scanned_ranges(target)]
+        uppers = [high for _, high, _ in self.scanned_ranges(target)][1:] + [int(state['newest_tweet_id'])]
+        return [(day_of(upper), day_of(low)) for low, upper in zip(bounds, uppers)]
+
+    def prune(self, target, keep_days):
+        """keep_days日より前の日別件数を削除する（削除した行数を返す）"""
+        before = (datetime.now(timezone.utc) - timedelta(days=keep_days - 1)).strftime('%Y-%m-%d')
+        with self.conn:
+            cursor = self.conn.execute(
+                "DELETE FROM daily_counts WHERE target = ? AND day < ?", (target.lower(), before)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        self.conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分析対象ごとのリプライ集計の状態")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help="状態を保存している分析対象を表示")
+    p = subparsers.add_parser('show', help="期間内のリプライ先別件数を表示")
+    p.add_argument('target')
+    p.add_argument('--window', type=int, default=None, help="集計する日数（省略時は全期間）")
+    p.add_argument('--top', type=int, default=20)
+    p = subparsers.add_parser('prune', help="古い日別件数を削除")
+    p.add_argument('target')
+    p.add_argument('--keep-days', type=int, required=True)
+    args = parser.parse_args(argv)
+
+    store = ReplyStateStore()
+    if args.command == 'list':
+        for state in store.list_targets():
+            updated = datetime.fromtimestamp(state['updated_at']).strftime('%Y-%m-%d %H:%M')
+            gaps = store.gaps(state['target'])
+            note = f"、未走査の範囲 {len(gaps)}件" if gaps else ""
+            print(f"@{state['target']}: {state['scans']}回 / {state['scanned_tweets']}件走査 "
+                  f"（{store.coverage_start(state['target'])}以降{note}、最終更新 {updated}）")
+    elif args.command == 'show':
+        for start, end in store.gaps(args.target):
+            print(f"警告: {start}〜{end}のツイートは未走査です（次回の差分分析で続きから集計します）")
+        for reply_to, count in store.window_counts(args.target, args.window).most_common(args.top):
+            print(f"@{reply_to}: {count}")
+    elif args.command == 'prune':
+        print(f"{store.prune(args.target, args.keep_days)}行を削除しました")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+リクエスト予算（制限時間・リクエスト数の上限）
+目的: 「10分以内」「300リクエスト以内」で得られる最良の結果を返し、途中で打ち切っても結果を失わないようにする
+機能:
+- 実行全体の制限時間と、全体・エンドポイント（GraphQLのオペレーション）ごとのリクエスト数の上限
+- 走査フェーズを早めに終えて、残りの予算を上位候補の詳細取得に回すための予約分の判定
+- 共有HTTPクライアントに差し込み、予算を使い切った後のリクエストを送信前に拒否するトランスポート
+- 打ち切った処理の記録（出力ファイルのメタデータ・実行サマリー用）
+
+予算は contextvars で非同期タスクごとに設定されるため、並列に実行するジョブごとに別の予算を使える
+"""
+
+import contextvars
+import time
+from collections import Counter
+
+import httpx
+
+from retry_policy import endpoint_name
+
+_current_budget = contextvars.ContextVar('request_budget', default=None)
+
+
+class BudgetExhaustedError(Exception):
+    """予算を使い切ったためリクエストを送信しなかったことを表す例外"""
+
+
+def current_budget():
+    """現在のタスクで使用中の予算を返す（未設定ならNone）"""
+    return _current_budget.get()
+
+
+def use_budget(budget):
+    """現在のタスク（とそこから作られるタスク）で使用する予算を設定する"""
+    return _current_budget.set(budget)
+
+
+class RequestBudget:
+    """制限時間とリクエスト数の上限を管理するクラス"""
+
+    def __init__(self, deadline_seconds=None, max_requests=None, endpoint_caps=None, enrichment_share=0.3):
+        """
+        Args:
+            deadline_seconds: 制限時間（秒、作成時点から）
+            max_requests: 全エンドポイント合計のリクエスト数の上限
+            endpoint_caps: エンドポイントごとのリクエスト数の上限（例: {'UserTweetsAndReplies': 50}）
+            enrichment_share: 詳細取得のために残す予算の割合（走査はこれを下回る前に終える）
+        """
+        self.started = time.monotonic()
+        self.deadline_seconds = deadline_seconds
+        self.max_requests = max_requests
+        self.endpoint_caps = dict(endpoint_caps or {})
+        self.enrichment_share = enrichment_share
+        self.counts = Counter()
+        self.rejected = Counter()
+        # 予算のために打ち切った処理の記録
+        self.truncated = []
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining_seconds(self):
+        if self.deadline_seconds is None:
+            return None
+        return self.deadline_seconds - self.elapsed
+
+    def remaining_requests(self, endpoint=None):
+        """残りのリクエスト数（全体とエンドポイントの上限の小さい方、上限が無ければNone）"""
+        remaining = []
+        if self.max_requests is not None:
+            remaining.append(self.max_requests - sum(self.counts.values()))
+        if endpoint in self.endpoint_caps:
+            remaining.append(self.endpoint_caps[endpoint] - self.counts[endpoint])
+        return max(min(remaining), 0) if remaining else None
+
+    def exhausted(self, endpoint=None):
+        """制限時間を過ぎたか、リクエスト数の上限に達したか"""
+        seconds = self.remaining_seconds()
+        if seconds is not None and seconds <= 0:
+            return True
+        return self.remaining_requests(endpoint) == 0
+
+    def reserve_reached(self, endpoint=None):
+        """残りの予算が詳細取得のための予約分を下回ったか（走査フェーズを終えるべきか）"""
+        seconds = self.remaining_seconds()
+        if seconds is not None and seconds <= self.deadline_seconds * self.enrichment_share:
+            return True
+        if self.max_requests is not None:
+            if self.max_requests - sum(self.counts.values()) <= self.max_requests * self.enrichment_share:
+                return True
+        return self.exhausted(endpoint)
+
+    def acquire(self, endpoint):
+        """リクエスト1件分の予算を使う
+
+        Raises:
+            BudgetExhaustedError: 予算を使い切っている場合
+        """
+        if self.exhausted(endpoint):
+            self.rejected[endpoint] += 1
+            seconds = self.remaining_seconds()
+            if seconds is not None and seconds <= 0:
+                raise BudgetExhaustedError("制限時間を過ぎました")
+            if self.max_requests is not None and sum(self.counts.values()) >= self.max_requests:
+                raise BudgetExhaustedError("リクエスト数の上限に達しました")
+            raise BudgetExhaustedError(f"{endpoint} のリクエスト数の上限に達しました")
+        self.counts[endpoint] += 1
+
+    def note_truncation(self, phase, reason, **details):
+        """予算のために打ち切った処理を記録する"""
+        self.truncated.append({'phase': phase, 'reason': reason, **details})
+
+    def summary(self):
+        """出力ファイルのメタデータ・実行サマリー用の情報を返す"""
+        return {
+            'deadline_seconds': self.deadline_seconds,
+            'max_requests': self.max_requests,
+            'endpoint_caps': self.endpoint_caps,
+            'elapsed_seconds': round(self.elapsed, 2),
+            'requests': dict(self.counts),
+            'rejected': dict(self.rejected),
+            'truncated': self.truncated,
+        }
+
+
+class BudgetTransport(httpx.AsyncBaseTransport):
+    """送信前に現在のタスクの予算を1件分使うトランスポート（予算が無ければそのまま送信）"""
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        budget = current_budget()
+        if budget is not None:
+            budget.acquire(endpoint_name(request))
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,214 @@
+"""
+APIレスポンスキャッシュ
+目的: 同じ実行内や近い時間の実行で繰り返される同一のGraphQLリクエストをAPIに送らずに済ませる
+機能:
+- オペレーション名・正規化した変数・アカウントをキーにしたキャッシュ
+- オペレーションごとの有効期限（TTL）
+- メモリ上のLRUキャッシュと、任意のディスクキャッシュ（SQLite）
+- 同時に発行された同一リクエストの集約
+- 実行サマリー用のヒット率の集計
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import Counter, OrderedDict
+from urllib.parse import parse_qsl
+
+import httpx
+
+from retry_policy import endpoint_name
+
+# オペレーションごとの有効期限（秒）。ここに無いオペレーションはキャッシュしない
+DEFAULT_TTLS = {
+    'UserByScreenName': 3600,
+    'UserByRestId': 3600,
+    'UserTweets': 300,
+    'UserTweetsAndReplies': 300,
+    'UserMedia': 300,
+    'SearchTimeline': 120,
+    'TweetDetail': 60,
+    'Followers': 900,
+    'Following': 900,
+    'ListLatestTweetsTimeline': 60,
+}
+
+# 保存しないレスポンスヘッダー（本文をまとめて保存するため）
+_DROP_HEADERS = ('transfer-encoding', 'set-cookie')
+
+
+def _account_key(request):
+    """リクエストのCookieから送信アカウントを識別する値を返す"""
+    match = re.search(r'(?:^|;\s*)twid=([^;]+)', request.headers.get('cookie', ''))
+    if match:
+        return match.group(1)
+    return hashlib.sha256(request.headers.get('authorization', '').encode()).hexdigest()[:16]
+
+
+def _normalize_params(request):
+    """クエリパラメータを正規化する（JSONの値はキー順を揃える）"""
+    params = []
+    for key, value in sorted(parse_qsl(request.url.query.decode(), keep_blank_values=True)):
+        try:
+            value = json.dumps(json.loads(value), sort_keys=True, separators=(',', ':'))
+        except ValueError:
+            pass
+        params.append((key, value))
+    return params
+
+
+def cache_key(request):
+    """オペレーション名・正規化した変数・アカウントからキャッシュキーを作る"""
+    payload = json.dumps([endpoint_name(request), _normalize_params(request), _account_key(request)],
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """メモリ上のLRUと任意のSQLiteディスクキャッシュによるレスポンスキャッシュ"""
+
+    def __init__(self, max_entries=1000, ttls=None, disk_path=None):
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self._memory = OrderedDict()
+        self.conn = None
+        if disk_path:
+            os.makedirs(os.path.dirname(disk_path) or '.', exist_ok=True)
+            self.conn = sqlite3.connect(disk_path)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    cache_key TEXT PRIMARY KEY,
+                    operation TEXT NOT NULL,
+                    status INTEGER NOT NULL,
+                    headers TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+        # 統計情報
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def ttl_for(self, operation):
+        return self.ttls.get(operation, 0)
+
+    def get(self, key):
+        """有効期限内のエントリ (status, headers, body) を返す（無ければNone）"""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._memory.move_to_end(key)
+                return entry[1]
+            del self._memory[key]
+
+        if self.conn is not None:
+            row = self.conn.execute(
+                "SELECT status, headers, body, expires_at FROM responses WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row and row[3] > now:
+                value = (row[0], json.loads(row[1]), row[2])
+                self._remember(key, row[3], value)
+                return value
+        return None
+
+    def _remember(self, key, expires_at, value):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def set(self, key, operation, status, headers, body):
+        """エントリを保存する"""
+        expires_at = time.time() + self.ttl_for(operation)
+        value = (status, headers, body)
+        self._remember(key, expires_at, value)
+        if self.conn is not None:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, operation, status, json.dumps(headers), body, expires_at)
+                )
+
+    def purge_expired(self):
+        """ディスク上の期限切れエントリを削除する"""
+        if self.conn is not None:
+            with self.conn:
+                self.conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+
+    def stats(self):
+        """実行サマリー用のヒット率を返す"""
+        operations = sorted(set(self.hits) | set(self.misses))
+        total_hits = sum(self.hits.values())
+        total = total_hits + sum(self.misses.values())
+        return {
+            'hits': total_hits,
+            'misses': total - total_hits,
+            'hit_rate': round(total_hits / total, 4) if total else 0.0,
+            'operations': {
+                operation: {
+                    'hits': self.hits[operation],
+                    'misses': self.misses[operation],
+                    'hit_rate': round(self.hits[operation] / (self.hits[operation] + self.misses[operation]), 4),
+                }
+                for operation in operations
+            },
+        }
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+class CachingTransport(httpx.AsyncBaseTransport):
+    """TTLの設定されたGETリクエストのレスポンスをキャッシュから返すトランスポート"""
+
+    def __init__(self, transport, cache):
+        self.transport = transport
+        self.cache = cache
+        self._inflight = {}
+
+    def _response(self, request, value):
+        status, headers, body = value
+        return httpx.Response(status, headers=headers, content=body, request=request)
+
+    async def handle_async_request(self, request):
+        operation = endpoint_name(request)
+        if request.method != 'GET' or self.cache.ttl_for(operation) <= 0:
+            return await self.transport.handle_async_request(request)
+
+        key = cache_key(request)
+        # 同じリクエストが送信中なら、その結果を待って共有する
+        while key in self._inflight:
+            await asyncio.shield(self._inflight[key])
+        value = self.cache.get(key)
+        if value is not None:
+            self.cache.hits[operation] += 1
+            return self._response(request, value)
+
+        self.cache.misses[operation] += 1
+        done = asyncio.get_running_loop().create_future()
+        self._inflight[key] = done
+        try:
+            response = await self.transport.handle_async_request(request)
+            if response.status_code != 200:
+                return response
+            # 圧縮されたままの本文を保存する（ヘッダーのContent-Encodingと対応させるため）
+            body = b''.join([chunk async for chunk in response.aiter_raw()])
+            await response.aclose()
+            headers = [(name, value) for name, value in response.headers.multi_items()
+                       if name.lower() not in _DROP_HEADERS]
+            self.cache.set(key, operation, response.status_code, headers, body)
+            # 今回のレスポンスは更新されたCookieを含む元のヘッダーのまま返す
+            return httpx.Response(response.status_code, headers=response.headers, content=body,
+                                  request=request, extensions=response.extensions)
+        finally:
+            del self._inflight[key]
+            done.set_result(None)
+
+    async def aclose(self):
+        await self.transport.aclose()
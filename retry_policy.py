@@ -0,0 +1,213 @@
+"""
+APIリクエストの再試行とサーキットブレーカー
+目的: 一時的な5xx・429・接続エラーでページやユーザーを取りこぼさないようにする
+機能:
+- ジッター付き指数バックオフによる再試行（Retry-After・x-rate-limit-resetヘッダーを優先）
+- 冪等性を考慮した再試行（GET以外は送信前の失敗と429のみ再試行）
+- エンドポイント（GraphQLのオペレーション）ごとのサーキットブレーカー
+- リクエスト予算の制限時間を過ぎる待機はせず、予算切れとして打ち切る
+- 共有HTTPクライアントに差し込むトランスポートラッパー
+"""
+
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+# 再試行の対象とするステータスコード
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# 冪等なHTTPメソッド
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def endpoint_name(request):
+    """リクエストのエンドポイント名を返す（GraphQLはオペレーション名）"""
+    path = request.url.path
+    if '/graphql/' in path:
+        return path.rsplit('/', 1)[-1]
+    return path
+
+
+class CircuitOpenError(Exception):
+    """サーキットが開いているエンドポイントへのリクエストを拒否したことを表す例外"""
+
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"エンドポイント {endpoint} は一時停止中です（あと{retry_after:.0f}秒）")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class RetryPolicy:
+    """再試行回数と待機時間を決めるクラス"""
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0,
+                 max_reset_wait=900.0, retry_statuses=RETRY_STATUSES):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # レート制限のリセットを待つ最大秒数（これを超える場合は再試行しない）
+        self.max_reset_wait = max_reset_wait
+        self.retry_statuses = retry_statuses
+
+    def is_idempotent(self, request):
+        """同じリクエストを再送しても安全か（投稿などの更新系はFalse）"""
+        return request.method in IDEMPOTENT_METHODS
+
+    def backoff(self, attempt):
+        """ジッター付き指数バックオフの待機秒数（Full Jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _header_wait(self, response):
+        """Retry-After・x-rate-limit-resetヘッダーから待機秒数を求める（無ければNone）"""
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+        reset = response.headers.get('x-rate-limit-reset')
+        if reset and (response.status_code == 429 or response.headers.get('x-rate-limit-remaining') == '0'):
+            try:
+                return max(0.0, float(reset) - time.time()) + random.uniform(0, 1)
+            except ValueError:
+                pass
+        return None
+
+    def delay_for(self, attempt, response):
+        """レスポンスに対する待機秒数（リセットまでが長すぎる場合はNone）"""
+        wait = self._header_wait(response)
+        if wait is None:
+            return self.backoff(attempt)
+        return wait if wait <= self.max_reset_wait else None
+
+
+class CircuitBreaker:
+    """連続して失敗しているエンドポイントへのリクエストを一時停止するクラス"""
+
+    def __init__(self, endpoint, failure_threshold=5, reset_timeout=30.0):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+
+    def before_request(self):
+        """リクエスト前の確認（開いている間はCircuitOpenErrorを送出）"""
+        if self.state == 'open':
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(self.endpoint, remaining)
+            # 停止時間を過ぎたら試験的にリクエストを通す
+            self.state = 'half_open'
+
+    def record_success(self):
+        self.failures = 0
+        self.state = 'closed'
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                print(f"エンドポイント {self.endpoint} で失敗が続いたため{self.reset_timeout:.0f}秒停止します")
+                self.opened_count += 1
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+
+
+class RetryTransport(httpx.AsyncBaseTransport):
+    """再試行ポリシーとエンドポイントごとのサーキットブレーカーを適用するトランスポート"""
+
+    def __init__(self, transport, policy=None, failure_threshold=5, reset_timeout=30.0):
+        self.transport = transport
+        self.policy = policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        # 統計情報
+        self.retries = 0
+        self.gave_up = 0
+        self.rejected = 0
+
+    @staticmethod
+    def _check_budget(endpoint, delay):
+        """待機すると現在のタスクの予算の制限時間を過ぎる場合は BudgetExhaustedError を送出する"""
+        # request_budget は endpoint_name を使うため、循環しないようここで読み込む
+        from request_budget import BudgetExhaustedError, current_budget
+
+        budget = current_budget()
+        seconds = budget.remaining_seconds() if budget is not None else None
+        if seconds is not None and delay >= seconds:
+            budget.rejected[endpoint] += 1
+            raise BudgetExhaustedError(
+                f"{endpoint} の再試行まで{delay:.0f}秒待つと制限時間を過ぎます（残り{max(seconds, 0):.0f}秒）"
+            )
+
+    def _breaker(self, endpoint):
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = CircuitBreaker(endpoint, self.failure_threshold, self.reset_timeout)
+        return self.breakers[endpoint]
+
+    async def handle_async_request(self, request):
+        endpoint = endpoint_name(request)
+        breaker = self._breaker(endpoint)
+        idempotent = self.policy.is_idempotent(request)
+        attempt = 0
+        while True:
+            try:
+                breaker.before_request()
+            except CircuitOpenError:
+                self.rejected += 1
+                raise
+            attempt += 1
+
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                breaker.record_failure()
+                # 接続前の失敗はサーバーに届いていないため、更新系でも再送できる
+                sent = not isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if attempt >= self.policy.max_attempts or (sent and not idempotent):
+                    self.gave_up += 1
+                    raise
+                delay = self.policy.backoff(attempt)
+            else:
+                status = response.status_code
+                if status >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if status not in self.policy.retry_statuses:
+                    return response
+                # 429は処理されずに拒否されたため、更新系でも再送できる
+                delay = self.policy.delay_for(attempt, response)
+                if attempt >= self.policy.max_attempts or delay is None or not (idempotent or status == 429):
+                    self.gave_up += 1
+                    return response
+                await response.aclose()
+
+            # レート制限のリセット待ちなどで制限時間を過ぎる場合は、待たずに打ち切って途中結果を保存させる
+            self._check_budget(endpoint, delay)
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        """実行サマリー用の統計情報を返す"""
+        return {
+            'retries': self.retries,
+            'gave_up': self.gave_up,
+            'rejected_by_circuit': self.rejected,
+            'circuits_opened': {
+                endpoint: breaker.opened_count
+                for endpoint, breaker in self.breakers.items() if breaker.opened_count
+            },
+        }
+
+    async def aclose(self):
+        await self.transport.aclose()
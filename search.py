@@ -1,28 +1,29 @@
-from twikit import Client
+from client_factory import get_client_factory
 import json
 import os
 from datetime import datetime
 import asyncio
+from request_budget import BudgetExhaustedError, current_budget
 
 class TwitterKeywordSearch:
-    def __init__(self):
-        # Twitterクライアントを英語（米国）設定で初期化
-        self.client = Client(language='en-US')
+    def __init__(self, client_factory=None):
+        # 共有ファクトリから英語（米国）設定のクライアントを取得（接続プールを共有）
+        self.client_factory = client_factory or get_client_factory()
+        self.client = self.client_factory.get_client(language='en-US')
         # 認証クッキーのパス
-        self.cookie_path = "twitter_json/cookie_edit.json"
+        self.cookie_path = self.client_factory.cookie_path
         # ツイート検索結果を保存するディレクトリ
         self.results_dir = "search_results"
         # 結果保存用ディレクトリが存在しない場合は作成
         os.makedirs(self.results_dir, exist_ok=True)
+        # 予算を使い切って検索を打ち切ったか（打ち切りは予算に記録し、失敗扱いにしない）
+        self.budget_truncated = False
 
     async def setup(self):
         """クッキーを使用して認証を設定する"""
         try:
-            # クッキーファイルを開き、JSONデータを読み込む
-            with open(self.cookie_path, 'r', encoding='utf-8') as file:
-                cookies = json.load(file)
-            # クライアントにクッキーを設定
-            self.client.set_cookies(cookies)
+            # 共有ファクトリ経由でクッキーを設定（読み込みはプールごとに1回）
+            await self.client_factory.authenticate()
             print("認証に成功しました！")
             return True
         except Exception as e:
@@ -76,6 +77,12 @@ class TwitterKeywordSearch:
                     }
                     tweets.append(tweet_data)
             
+            return tweets
+        except BudgetExhaustedError as e:
+            # 予算を使い切った場合は取得済みのツイートを返す
+            print(f"予算を使い切ったため検索を終了します: {e}")
+            self.budget_truncated = True
+            current_budget().note_truncation('search', str(e), keyword=keyword, fetched_tweets=len(tweets))
             return tweets
         except Exception as e:
             # 検索中にエラーが発生した場合のエラーメッセージを表示
@@ -104,7 +111,7 @@ class TwitterKeywordSearch:
             print(f"保存エラー: {e}")
             return None
 
-async def main():
+async def main(keyword="@railman_misaka", count=10):
     # TwitterKeywordSearchクラスのインスタンスを作成
     searcher = TwitterKeywordSearch()
     
@@ -112,10 +119,6 @@ async def main():
     if not await searcher.setup():
         return
 
-    # 検索キーワードと取得するツイートの数を設定
-    keyword = "@railman_misaka"
-    count = 10
-
     # 指定したキーワードで
     # ツイートを検索
     tweets = await searcher.search_tweets(keyword, count)
@@ -131,7 +134,12 @@ async def main():
 
     # ツイートが存在する場合、JSONファイルとして保存
     if tweets:
-        searcher.save_tweets(tweets, keyword)
+        outputs = [searcher.save_tweets(tweets, keyword)]
+        # 保存したファイルのパスを返す（ジョブ実行サマリー用、保存に失敗した場合は返さない）
+        return [path for path in outputs if path] or None
+    # 予算で打ち切った場合は結果が無くても失敗扱いにしない（打ち切りは予算のサマリーに記録済み）
+    if searcher.budget_truncated:
+        return []
 
 if __name__ == "__main__":
     # メイン関数を非同期で実行
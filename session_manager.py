@@ -0,0 +1,184 @@
+"""
+認証セッション管理
+目的: 起動時のネットワーク通信なしで認証済みセッションを再開し、長時間の実行でもトークン更新で止まらないようにする
+機能:
+- Cookie-Editor形式のcookie.jsonの変換（変換元が更新された場合のみ）と必須Cookieの確認
+- 認証ユーザー（twid Cookieから求めたユーザーID・スクリーンネーム）のキャッシュ
+- 更新されたct0（CSRFトークン）などのCookieを一時ファイル経由で安全に書き戻す
+- 認証エラーの応答からのセッション切れ検出（最初に失敗した時点で記録）
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+from urllib.parse import unquote
+
+import httpx
+
+# 認証に必須のCookie
+REQUIRED_COOKIES = ('auth_token', 'ct0')
+# Cookie-Editorから出力された変換元のファイル
+DEFAULT_SOURCE_PATH = "twitter_json/cookie.json"
+# 変換元のファイルを変換した既定の出力先
+DEFAULT_CONVERTED_PATH = "twitter_json/cookie_edit.json"
+
+
+class SessionExpiredError(Exception):
+    """Cookieが無効または期限切れであることを表す例外"""
+
+
+def user_id_from_twid(twid):
+    """twid Cookie（u%3D<ユーザーID>）からユーザーIDを取り出す"""
+    if not twid:
+        return None
+    value = unquote(twid).strip('"')
+    return value.split('=', 1)[1] if value.startswith('u=') else None
+
+
+class SessionManager:
+    """Cookieファイルと認証ユーザーの情報を管理するクラス"""
+
+    def __init__(self, cookie_path, source_path=None):
+        """
+        Args:
+            cookie_path: 認証に使うCookieファイル
+            source_path: cookie_path に変換するCookie-Editor形式のファイル
+                （省略時は既定の出力先の場合のみ DEFAULT_SOURCE_PATH から変換し、
+                 他のCookieセットは別アカウントのため変換しない）
+        """
+        self.cookie_path = cookie_path
+        if source_path is None and os.path.normpath(cookie_path) == os.path.normpath(DEFAULT_CONVERTED_PATH):
+            source_path = DEFAULT_SOURCE_PATH
+        self.source_path = source_path
+        # 認証ユーザーとセッションの状態を保存するファイル（Cookieセットごと）
+        stem = os.path.splitext(os.path.basename(cookie_path))[0]
+        self.state_path = os.path.join(os.path.dirname(cookie_path) or '.', f"{stem}.session.json")
+        self.state = self._load_state()
+        self.cookies = {}
+        self.expired = False
+        # 応答でCookieが更新され、書き戻しが必要かどうか
+        self.dirty = False
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_state(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _convert_if_needed(self):
+        """変換元のcookie.jsonが変換済みファイルより新しい場合のみ変換する"""
+        if not self.source_path or not os.path.exists(self.source_path):
+            return
+        from auth import TwitterCookieHandler
+
+        handler = TwitterCookieHandler(self.source_path, self.cookie_path)
+        if handler.needs_conversion() and handler.convert_json():
+            print(f"Cookieを変換しました: {self.cookie_path}")
+            # 新しいCookieのため、以前の認証ユーザーとセッション切れの記録は使わない
+            self.state = {}
+
+    def load_cookies(self):
+        """Cookieを読み込んで確認する（ネットワーク通信なし）
+
+        Raises:
+            SessionExpiredError: 必須のCookieが無い場合
+        """
+        self._convert_if_needed()
+        with open(self.cookie_path, 'r', encoding='utf-8') as file:
+            cookies = json.load(file)
+
+        missing = [name for name in REQUIRED_COOKIES if not cookies.get(name)]
+        if missing:
+            raise SessionExpiredError(f"必須のCookieがありません: {', '.join(missing)}")
+
+        user_id = user_id_from_twid(cookies.get('twid'))
+        if self.state.get('user_id') != user_id:
+            self.state = {'user_id': user_id}
+        # Cookieファイルが外部で更新された場合はセッション切れの記録を消す
+        mtime = os.path.getmtime(self.cookie_path)
+        if self.state.get('cookie_mtime') != mtime:
+            self.state.pop('expired_at', None)
+            self.state['cookie_mtime'] = mtime
+        if self.state.get('expired_at'):
+            print(f"警告: 前回の実行でセッション切れを検出しています（{self.state['expired_at']}）。"
+                  "cookie.jsonを更新してください")
+        self.state['loaded_at'] = datetime.now().isoformat(timespec='seconds')
+        self._save_state()
+        self.cookies = cookies
+        return cookies
+
+    @property
+    def user_id(self):
+        return self.state.get('user_id')
+
+    async def identity(self, client=None):
+        """認証ユーザーの情報を返す（スクリーンネームは初回のみ取得してキャッシュ）"""
+        if not self.state.get('screen_name') and client is not None and self.user_id:
+            user = await client.get_user_by_id(self.user_id)
+            self.state['screen_name'] = user.screen_name
+            self._save_state()
+        return {'user_id': self.user_id, 'screen_name': self.state.get('screen_name')}
+
+    def mark_expired(self, status_code):
+        """認証エラーの応答を記録する（最初の1回のみ通知）"""
+        if self.expired:
+            return
+        self.expired = True
+        self.state['expired_at'] = datetime.now().isoformat(timespec='seconds')
+        self._save_state()
+        print(f"認証エラー（HTTP {status_code}）: セッションの有効期限が切れている可能性があります。"
+              "cookie.jsonを更新してください")
+
+    def save_cookies(self, jar):
+        """HTTPクライアントのCookieが変わっていれば一時ファイル経由で書き戻す"""
+        self.dirty = False
+        cookies = dict(self.cookies)
+        for cookie in jar.jar:
+            cookies[cookie.name] = cookie.value
+        if cookies == self.cookies:
+            return False
+
+        tmp_path = self.cookie_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(cookies, file, sort_keys=True, indent=4)
+        os.replace(tmp_path, self.cookie_path)
+        self.cookies = cookies
+        self.state['cookie_mtime'] = os.path.getmtime(self.cookie_path)
+        self.state['cookies_saved_at'] = time.time()
+        self._save_state()
+        return True
+
+
+class SessionTransport(httpx.AsyncBaseTransport):
+    """応答を監視してCookieの更新とセッション切れを検出するトランスポート"""
+
+    def __init__(self, transport, session, save_cookies):
+        self.transport = transport
+        self.session = session
+        # Cookieを書き戻す関数（HTTPクライアントのCookieを渡す）
+        self.save_cookies = save_cookies
+
+    async def handle_async_request(self, request):
+        # 前回の応答で更新されたCookieは、クライアントに反映された後のこの時点で書き戻す
+        if self.session.dirty:
+            try:
+                self.save_cookies()
+            except OSError as e:
+                print(f"Cookieの保存エラー: {e}")
+        response = await self.transport.handle_async_request(request)
+        if response.status_code == 401:
+            self.session.mark_expired(response.status_code)
+        if 'set-cookie' in response.headers:
+            self.session.dirty = True
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,190 @@
+"""
+Google Sheetsへの書き込みシンク
+目的: パイプラインのイベントループを止めずに、新しい行だけをまとめてスプレッドシートへ追記する
+機能:
+- Sheets APIの同期呼び出しを別スレッドで実行（asyncio.to_thread）
+- 件数・経過時間で区切ったバッチ書き込み
+- 書き込み済みURLのローカルインデックス（SQLite）による重複除去
+- テスト用のローカルSheets APIスタンドイン（書き込みをJSONLファイルに保存）
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_INDEX_PATH = "sheets_sink/written_urls.db"
+
+
+class LocalSheetsService:
+    """Sheets APIの spreadsheets().values().append(...).execute() を模したローカル実装
+
+    追記された行を <output_dir>/<スプレッドシートID>.jsonl に保存する
+    """
+
+    def __init__(self, output_dir="sheets_sink/local"):
+        self.output_dir = output_dir
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.calls = 0
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def append(self, spreadsheetId, range, valueInputOption, body):
+        service = self
+
+        class _Request:
+            def execute(self):
+                service.calls += 1
+                path = os.path.join(service.output_dir, f"{spreadsheetId}.jsonl")
+                with open(path, 'a', encoding='utf-8') as f:
+                    for row in body['values']:
+                        f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+                return {'updates': {'updatedRange': range, 'updatedRows': len(body['values'])}}
+
+        return _Request()
+
+
+class WrittenUrlIndex:
+    """スプレッドシートごとに書き込み済みのURLを保存するインデックス"""
+
+    def __init__(self, db_path=DEFAULT_INDEX_PATH):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS written_urls (
+                spreadsheet_id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                written_at REAL NOT NULL,
+                PRIMARY KEY (spreadsheet_id, url)
+            )
+        """)
+
+    def known(self, spreadsheet_id, urls):
+        """書き込み済みのURLの集合を返す"""
+        urls = list(urls)
+        found = set()
+        # SQLiteのパラメータ数の上限を超えないよう分割して問い合わせる
+        for start in range(0, len(urls), 500):
+            chunk = urls[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT url FROM written_urls WHERE spreadsheet_id = ? AND url IN ({','.join('?' * len(chunk))})",
+                [spreadsheet_id, *chunk]
+            )
+            found.update(row[0] for row in rows)
+        return found
+
+    def add(self, spreadsheet_id, urls):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO written_urls (spreadsheet_id, url, written_at) VALUES (?, ?, ?)",
+                [(spreadsheet_id, url, now) for url in urls]
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+class SheetsSink:
+    """行をバッファして、件数または経過時間ごとにまとめてスプレッドシートへ追記するクラス"""
+
+    def __init__(self, service, spreadsheet_id, range_name='Sheet1!A:E', url_column=3,
+                 batch_size=100, flush_interval=5.0, index=None):
+        """
+        Args:
+            service: Sheets APIサービス（またはLocalSheetsService）
+            spreadsheet_id: 書き込み先のスプレッドシートID
+            range_name: 追記する範囲
+            url_column: 重複判定に使うURLの列番号（0始まり）
+            batch_size: 1回の追記にまとめる最大行数
+            flush_interval: バッファした行を書き込むまでの最大秒数
+        """
+        self.service = service
+        self.spreadsheet_id = spreadsheet_id
+        self.range_name = range_name
+        self.url_column = url_column
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.index = index or WrittenUrlIndex()
+        self._buffer = []
+        self._pending_urls = set()
+        self._lock = asyncio.Lock()
+        self._timer = None
+        # 統計情報
+        self.written = 0
+        self.skipped = 0
+        self.batches = 0
+
+    async def add_rows(self, rows):
+        """行を追加する（書き込み済み・バッファ済みのURLの行は除外）"""
+        urls = [row[self.url_column] for row in rows]
+        known = await asyncio.to_thread(self.index.known, self.spreadsheet_id, urls)
+        added = 0
+        for row, url in zip(rows, urls):
+            if url in known or url in self._pending_urls:
+                self.skipped += 1
+                continue
+            self._buffer.append(row)
+            self._pending_urls.add(url)
+            added += 1
+
+        while len(self._buffer) >= self.batch_size:
+            if not await self.flush(self.batch_size):
+                break
+        if self._buffer and self._timer is None:
+            # 件数が揃わなくても一定時間後には書き込む
+            self._timer = asyncio.create_task(self._flush_later())
+        return added
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flush_interval)
+            self._timer = None
+            await self.flush()
+        except asyncio.CancelledError:
+            pass
+
+    def _append(self, rows):
+        """Sheets APIへの同期呼び出し（別スレッドで実行される）"""
+        return self.service.spreadsheets().values().append(
+            spreadsheetId=self.spreadsheet_id,
+            range=self.range_name,
+            valueInputOption='RAW',
+            body={'values': rows}
+        ).execute()
+
+    async def flush(self, limit=None):
+        """バッファした行を書き込む（limit指定時はその件数まで）"""
+        async with self._lock:
+            if not self._buffer:
+                return 0
+            rows = self._buffer[:limit] if limit else list(self._buffer)
+            del self._buffer[:len(rows)]
+            urls = [row[self.url_column] for row in rows]
+            try:
+                await asyncio.to_thread(self._append, rows)
+            except Exception as e:
+                # 失敗した行は次回の書き込みで再送する
+                self._buffer[:0] = rows
+                print(f"スプレッドシートへの書き込みエラー: {e}")
+                return 0
+            await asyncio.to_thread(self.index.add, self.spreadsheet_id, urls)
+            self._pending_urls.difference_update(urls)
+            self.written += len(rows)
+            self.batches += 1
+            return len(rows)
+
+    async def aclose(self):
+        """残りの行を書き込んで終了する"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    def stats(self):
+        return {'written': self.written, 'skipped_duplicates': self.skipped, 'batches': self.batches}
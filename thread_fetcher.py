@@ -0,0 +1,201 @@
+"""
+会話スレッド取得エンジン
+目的: 送信したリプライへの返信を検索ではなくツイート詳細から取得し、結果をキャッシュする
+機能:
+- ツイート詳細エンドポイントによる会話ツリーの取得（返信のカーソルページング）
+- 取得済みのサブツリーをSQLiteにキャッシュ
+- 再確認時は返信数が増えたノードのみ再取得（新しい枝だけを取得）
+
+使い方:
+    python thread_fetcher.py 1857775411016643010 --max-depth 3
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_CACHE_PATH = "thread_cache/threads.db"
+
+
+class ThreadCache:
+    """会話ツリーのノード（ツイート）と子ノードの取得状態を保存するキャッシュ"""
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tweets (
+                tweet_id TEXT PRIMARY KEY,
+                parent_id TEXT,
+                reply_count INTEGER NOT NULL DEFAULT 0,
+                children_complete INTEGER NOT NULL DEFAULT 0,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tweets_parent ON tweets (parent_id)")
+
+    def upsert(self, tweet, parent_id=None):
+        """ツイートを保存する（子ノードの取得状態は維持する）"""
+        data = {
+            'tweet_id': tweet.id,
+            'screen_name': tweet.user.screen_name,
+            'user_name': tweet.user.name,
+            'text': tweet.text,
+            'created_at': tweet.created_at,
+            'reply_count': tweet.reply_count,
+            'like_count': tweet.favorite_count,
+            'in_reply_to': parent_id,
+        }
+        with self.conn:
+            self.conn.execute(
+                """INSERT INTO tweets (tweet_id, parent_id, reply_count, data, fetched_at)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(tweet_id) DO UPDATE SET
+                       parent_id = COALESCE(excluded.parent_id, tweets.parent_id),
+                       reply_count = excluded.reply_count,
+                       data = excluded.data,
+                       fetched_at = excluded.fetched_at""",
+                (str(tweet.id), parent_id, tweet.reply_count or 0,
+                 json.dumps(data, ensure_ascii=False), time.time())
+            )
+
+    def get(self, tweet_id):
+        row = self.conn.execute("SELECT * FROM tweets WHERE tweet_id = ?", (str(tweet_id),)).fetchone()
+        return dict(row) if row else None
+
+    def children(self, tweet_id):
+        """キャッシュ済みの直接の返信IDを返す"""
+        rows = self.conn.execute(
+            "SELECT tweet_id FROM tweets WHERE parent_id = ? ORDER BY tweet_id", (str(tweet_id),)
+        )
+        return [row['tweet_id'] for row in rows]
+
+    def mark_children_complete(self, tweet_id, complete):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE tweets SET children_complete = ? WHERE tweet_id = ?",
+                (int(complete), str(tweet_id))
+            )
+
+    def tree(self, tweet_id, max_depth=None, depth=0):
+        """キャッシュから会話ツリーを入れ子の辞書として組み立てる"""
+        node = self.get(tweet_id)
+        if node is None:
+            return None
+        data = json.loads(node['data'])
+        data['replies'] = []
+        if max_depth is None or depth < max_depth:
+            for child_id in self.children(tweet_id):
+                child = self.tree(child_id, max_depth, depth + 1)
+                if child:
+                    data['replies'].append(child)
+        return data
+
+    def close(self):
+        self.conn.close()
+
+
+class ThreadFetcher:
+    """ツイート詳細から会話ツリーを取得し、新しい枝のみを再取得するクラス"""
+
+    def __init__(self, client, cache=None, max_pages_per_node=10):
+        self.client = client
+        self.cache = cache or ThreadCache()
+        # 1ノードあたりの返信ページ取得上限
+        self.max_pages_per_node = max_pages_per_node
+        self.requests = 0
+
+    def _needs_fetch(self, tweet_id):
+        """返信が増えている（またはまだ取得していない）ノードかどうか"""
+        node = self.cache.get(tweet_id)
+        if node is None:
+            return True
+        if not node['reply_count']:
+            return False
+        return not node['children_complete'] or node['reply_count'] > len(self.cache.children(tweet_id))
+
+    async def _fetch_node(self, tweet_id, parent_id=None):
+        """ツイート詳細を取得し、返信をページングしながらキャッシュに保存する"""
+        tweet = await self.client.get_tweet_by_id(str(tweet_id))
+        self.requests += 1
+        self.cache.upsert(tweet, parent_id)
+
+        known = set(self.cache.children(tweet_id))
+        replies = tweet.replies
+        complete = True
+        for page in range(self.max_pages_per_node):
+            if not replies:
+                break
+            for reply in replies:
+                self.cache.upsert(reply, str(tweet_id))
+                known.add(str(reply.id))
+            # 既知の返信数が返信数に達したら残りのページは不要
+            if len(known) >= (tweet.reply_count or 0) or not replies.next_cursor:
+                break
+            if page == self.max_pages_per_node - 1:
+                complete = False
+                break
+            replies = await replies.next()
+            self.requests += 1
+        self.cache.mark_children_complete(tweet_id, complete)
+
+    async def fetch_thread(self, root_id, max_depth=None, refresh_root=True):
+        """会話ツリーを取得する（キャッシュ済みで返信数の変わらない枝は再取得しない）
+
+        Args:
+            root_id: 起点のツイートID
+            max_depth: 取得する返信の深さの上限（Noneは無制限）
+            refresh_root: 起点ツイートを常に取得し直して返信数の変化を確認するか
+        Returns:
+            入れ子の辞書形式の会話ツリー
+        """
+        self.requests = 0
+        stack = [(str(root_id), None, 0)]
+        while stack:
+            tweet_id, parent_id, depth = stack.pop()
+            if (depth == 0 and refresh_root) or self._needs_fetch(tweet_id):
+                try:
+                    await self._fetch_node(tweet_id, parent_id)
+                except Exception as e:
+                    print(f"ツイート {tweet_id} の取得エラー: {e}")
+                    continue
+            if max_depth is None or depth < max_depth:
+                stack.extend((child_id, tweet_id, depth + 1) for child_id in self.cache.children(tweet_id))
+
+        print(f"スレッド {root_id} を取得しました（リクエスト {self.requests}回）")
+        return self.cache.tree(str(root_id), max_depth)
+
+    async def get_replies_to_sent_reply(self, sent_reply_id):
+        """送信したリプライへの直接の返信を取得する"""
+        tree = await self.fetch_thread(sent_reply_id, max_depth=1)
+        return tree['replies'] if tree else []
+
+
+async def main(tweet_id, max_depth=None):
+    from client_factory import get_client_factory
+
+    client_factory = get_client_factory()
+    try:
+        await client_factory.authenticate()
+    except Exception as e:
+        print(f"認証エラー: {e}")
+        return None
+
+    fetcher = ThreadFetcher(client_factory.get_client(language='en-US'))
+    tree = await fetcher.fetch_thread(tweet_id, max_depth)
+    if tree:
+        print(json.dumps(tree, ensure_ascii=False, indent=2))
+    return tree
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="会話スレッドの取得")
+    parser.add_argument('tweet_id')
+    parser.add_argument('--max-depth', type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(main(args.tweet_id, args.max_depth))
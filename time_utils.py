@@ -0,0 +1,64 @@
+"""
+ツイート日時ユーティリティ
+目的: 日時の絞り込みを文字列解析ではなく整数比較で行う
+機能:
+- ツイートID（Snowflake ID）からの投稿日時の算出
+- 日時の範囲をツイートIDの範囲に変換
+- DataFrameの created_at 列の一括変換（Excel出力用の日時型）
+"""
+
+from datetime import datetime, time, timedelta, timezone
+
+# TwitterのSnowflake IDの基準時刻（2010-11-04 01:42:54.657 UTC、ミリ秒）
+TWITTER_EPOCH_MS = 1288834974657
+# タイムスタンプより下位のビット数（データセンター・ワーカー・シーケンス）
+TIMESTAMP_SHIFT = 22
+
+CREATED_AT_FORMAT = '%a %b %d %H:%M:%S %z %Y'
+
+
+def snowflake_to_ms(tweet_id):
+    """ツイートIDから投稿時刻（UNIXミリ秒）を算出する"""
+    return (int(tweet_id) >> TIMESTAMP_SHIFT) + TWITTER_EPOCH_MS
+
+
+def snowflake_to_datetime(tweet_id):
+    """ツイートIDから投稿日時（UTC）を算出する"""
+    return datetime.fromtimestamp(snowflake_to_ms(tweet_id) / 1000, tz=timezone.utc)
+
+
+def datetime_to_snowflake(dt):
+    """指定日時以降に投稿されたツイートが持つ最小のIDを返す"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    ms = int(dt.timestamp() * 1000) - TWITTER_EPOCH_MS
+    return max(ms, 0) << TIMESTAMP_SHIFT
+
+
+def id_bounds(since, until):
+    """日時の範囲 [since, until) をツイートIDの範囲 [min_id, max_id) に変換する"""
+    return datetime_to_snowflake(since), datetime_to_snowflake(until)
+
+
+def day_id_bounds(day, tz=timezone.utc):
+    """指定日（タイムゾーン基準）のツイートIDの範囲 [min_id, max_id) を返す"""
+    start = datetime.combine(day, time.min, tzinfo=tz)
+    return id_bounds(start, start + timedelta(days=1))
+
+
+def in_id_bounds(tweet_id, bounds):
+    """ツイートIDが範囲内かどうかを整数比較で判定する"""
+    min_id, max_id = bounds
+    return min_id <= int(tweet_id) < max_id
+
+
+def parse_created_at_series(series):
+    """created_at 文字列の列をまとめてUTCの日時型に変換する（解析できない値はNaT）"""
+    import pandas as pd
+
+    return pd.to_datetime(series, format=CREATED_AT_FORMAT, utc=True, errors='coerce')
+
+
+def to_excel_datetime(series, tz='Asia/Tokyo'):
+    """タイムゾーン付き日時の列をExcelで扱える日時型（指定タイムゾーンのnaive）に変換する"""
+    return series.dt.tz_convert(tz).dt.tz_localize(None)
@@ -0,0 +1,106 @@
+"""
+新しい順のタイムラインの差分取得
+目的: ページ数の上限で途中までしか読めなかった場合も、読み残した範囲を次回に続きから読み、取りこぼしを無くす
+機能:
+- 前回の最新ID（ウォーターマーク）に達するか終端までのページ取得
+- 上限で打ち切った場合の、続きのカーソルと打ち切るまでに読んだ最新IDの記録
+- 次回の取得での、新着分と読み残した範囲（続きのカーソルから前回のウォーターマークまで）の取得
+"""
+
+
+async def read_until(fetch_first, floor_id, max_pages, id_of):
+    """新しい順のページを floor_id 以下のIDに達するか終端まで（最大 max_pages ページ）読む
+
+    Args:
+        fetch_first: 最初のページを返すコルーチン関数（2ページ目以降は結果の next() で取得）
+        floor_id: これ以下のIDは読み済みとして扱う
+        id_of: 要素からIDを返す関数（Noneの要素は読み飛ばす）
+
+    Returns:
+        (floor_id より新しい要素のリスト, 最後まで読んだか, 続きのカーソル, 読んだページ数)
+    """
+    items = []
+    pages = 0
+    results = await fetch_first()
+    while results:
+        pages += 1
+        reached = False
+        for item in results:
+            item_id = id_of(item)
+            if item_id is None:
+                continue
+            if item_id <= floor_id:
+                reached = True
+                continue
+            items.append(item)
+        if reached or not results.next_cursor:
+            break
+        if pages >= max_pages:
+            return items, False, results.next_cursor, pages
+        results = await results.next()
+    return items, True, None, pages
+
+
+class TimelineWatermark:
+    """新しい順のタイムラインをどこまで読んだかを管理するクラス
+
+    状態の辞書（保存は呼び出し側）:
+        newest_key: これ以下のIDはすべて読み済み
+        'pending_newest_id': 読み残しがある場合に、それまでに読んだ最新のID
+        'resume_cursor': 読み残した範囲の続きのカーソル
+    """
+
+    def __init__(self, state, newest_key='newest_id'):
+        self.state = state
+        self.newest_key = newest_key
+
+    def _set_pending(self, newest, cursor):
+        self.state['pending_newest_id'] = str(newest) if newest else None
+        self.state['resume_cursor'] = cursor
+
+    async def read(self, fetch_page, id_of, max_pages):
+        """前回以降の新しい要素を返す（上限で打ち切った場合は読み残しを次回に続きから読む）
+
+        Args:
+            fetch_page: カーソル（Noneなら最新）を受け取ってページを返すコルーチン関数
+            id_of: 要素から整数のIDを返す関数（Noneの要素は読み飛ばす）
+        """
+        watermark = int(self.state.get(self.newest_key) or 0)
+        pending = int(self.state.get('pending_newest_id') or 0)
+        cursor = self.state.get('resume_cursor')
+
+        # 新着分: 続きのカーソルがあれば前回読んだ最新IDまで、無ければウォーターマークまで
+        head_floor = max(watermark, pending) if cursor else watermark
+        items, complete, next_cursor, pages = await read_until(
+            lambda: fetch_page(None), head_floor, max_pages, id_of
+        )
+        newest = max([watermark, pending] + [id_of(item) for item in items])
+        if not complete:
+            # 新着分も読み切れない場合は、その続きから前回のウォーターマークまでを次回に読む
+            self._set_pending(newest, next_cursor)
+            return items
+
+        if cursor:
+            if pages >= max_pages:
+                self._set_pending(newest, cursor)
+                return items
+            try:
+                backfill, complete, next_cursor, _ = await read_until(
+                    lambda: fetch_page(cursor), watermark, max_pages - pages, id_of
+                )
+            except Exception as e:
+                # カーソルが無効になった場合は、次回に最新からウォーターマークまで読み直す
+                print(f"警告: 前回の続きを取得できませんでした（次回は最新から読み直します）: {e}")
+                self._set_pending(newest, None)
+                return items
+            seen = {id_of(item) for item in items}
+            items.extend(item for item in backfill if id_of(item) not in seen)
+            if not complete:
+                self._set_pending(newest, next_cursor)
+                return items
+
+        # 読み残しが無くなった場合のみウォーターマークを進める
+        self.state[self.newest_key] = str(newest) if newest else None
+        self.state.pop('pending_newest_id', None)
+        self.state.pop('resume_cursor', None)
+        return items
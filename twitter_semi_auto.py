@@ -3,48 +3,72 @@ Twitter半自動投稿パイプライン
 目的: ツイートの収集、AI投稿文生成、手動確認を経た投稿の自動化
 機能:
 - Twitter APIによるツイート収集
-- Google Sheetsへのデータ保存
-- OpenAI APIによる投稿文生成
-- 手動確認プロセス
+- Google Sheetsへのデータ保存（新しい行のみをまとめて非同期に追記）
+- 近似重複（コピペ・テンプレート）ツイートのクラスタ化と、クラスタごとの代表のみの投稿文生成
+- OpenAI APIによる投稿文生成（並列生成・ディスクキャッシュ）
+- 手動確認プロセス（生成できた投稿文から順に承認キューで確認）
+- 承認済み投稿の予約と、バックグラウンドでの時刻指定投稿（再起動後も継続）
+- 添付メディアの事前変換・並列チャンクアップロード
+- 送信ツイートへの返信追跡（メンション通知のポーリング）
 """
 
 import asyncio
 import os
 from datetime import datetime
 from typing import List, Dict
-import json
-import openai
-from twikit.client import Client
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from client_factory import get_client_factory
+from draft_generator import DraftGenerator
+from media_pipeline import MediaUploader
+from near_duplicate import NearDuplicateIndex, representatives
+from mentions_poller import MentionsPoller, SentTweetIndex
+from post_scheduler import PostScheduler
+from sheets_sink import SheetsSink
 
 class TwitterAutomationPipeline:
-    def __init__(self, twitter_cookies_path: str, openai_key: str, sheets_creds_path: str):
+    def __init__(self, twitter_cookies_path: str, openai_key: str, sheets_creds_path: str,
+                 sheets_service=None, llm_base_url: str = None, llm_model: str = "gpt-3.5-turbo",
+                 draft_concurrency: int = 3):
         """
         パイプラインの初期化
         Args:
-            twitter_cookies_path: Twitterクッキーファイルのパス
+            twitter_cookies_path: Twitterクッキーファイルのパス（Noneなら共有の既定のファクトリ）
             openai_key: OpenAI APIキー
             sheets_creds_path: Google Sheets認証情報のパス
+            sheets_service: 使用するSheets APIサービス（テスト用のLocalSheetsServiceなど、省略時は認証情報から作成）
+            llm_base_url: OpenAI互換APIのベースURL（スタブLLMサーバーなど、省略時はOpenAI）
+            llm_model: 投稿文生成に使うモデル
+            draft_concurrency: 投稿文を同時に生成する最大数
         """
-        # Twitter APIクライアントを日本語で初期化
-        self.twitter_client = Client(language='ja-JP')
-        self.cookies_path = twitter_cookies_path
+        # 共有ファクトリから日本語設定のTwitter APIクライアントを取得
+        self.client_factory = get_client_factory(twitter_cookies_path)
+        self.twitter_client = self.client_factory.get_client(language='ja-JP')
+        self.cookies_path = self.client_factory.cookie_path
         self.openai_key = openai_key
+        self.llm_base_url = llm_base_url
+        self.llm_model = llm_model
         self.sheets_creds_path = sheets_creds_path
+        # Google Sheets APIクライアントは初回書き込み時に作成
+        self.sheets_service = sheets_service
+        self.sheets_sink = None
+        # 送信したツイートのインデックス（返信の突き合わせに使用）
+        self.sent_index = SentTweetIndex()
+        # 近似重複のインデックス（収集時にクラスタIDを割り当てる）
+        self.dedupe_index = NearDuplicateIndex()
+        # 添付メディアのアップロード（認証ユーザーが分かる setup() で作成）
+        self.media_uploader = None
+        # 投稿文の並列生成（同じプロンプトと元ツイートはキャッシュから返す）
+        self.draft_generator = DraftGenerator(
+            self._build_prompt, self._complete, llm_model, concurrency=draft_concurrency
+        )
         
     async def setup(self):
         """各APIクライアントの初期化とセットアップ"""
-        # Twitterクッキーの読み込みと設定
-        with open(self.cookies_path, 'r') as f:
-            cookies = json.load(f)
-        self.twitter_client.set_cookies(cookies)
-        
-        # OpenAI APIキーの設定
-        openai.api_key = self.openai_key
-        
-        # Google Sheets APIクライアントのセットアップ
-        self.sheets_service = self._setup_sheets_service()
+        # Twitterクッキーの読み込みと設定（共有ファクトリ経由）
+        await self.client_factory.authenticate()
+        # 添付メディアのアップロード（同じアカウントで同じ内容のメディアIDは再利用）
+        account = self.client_factory.session.user_id or self.cookies_path
+        self.media_uploader = MediaUploader(self.twitter_client, account)
+        # OpenAI・Google Sheetsは実際に使うステップで読み込む（起動時間短縮のため）
         
     def _setup_sheets_service(self):
         """
@@ -52,6 +76,9 @@ class TwitterAutomationPipeline:
         Returns:
             設定済みのGoogle Sheets APIサービスオブジェクト
         """
+        from google.oauth2.credentials import Credentials
+        from googleapiclient.discovery import build
+
         creds = Credentials.from_authorized_user_file(
             self.sheets_creds_path, 
             ['https://www.googleapis.com/auth/spreadsheets']
@@ -83,18 +110,22 @@ class TwitterAutomationPipeline:
                 'url': f'https://twitter.com/i/web/status/{tweet.id}',  # ツイートURL
                 # エンゲージメントスコアの計算（リプライ数+いいね数+リツイート数）
                 'engagement_score': tweet.reply_count + tweet.favorite_count + tweet.retweet_count,
-                'created_at': tweet.created_at  # 投稿日時
+                'created_at': tweet.created_at,  # 投稿日時
+                # 近似重複のクラスタID（似たツイートが無ければ自身のID）
+                'cluster_id': self.dedupe_index.add(tweet.id, tweet.text)
             }
             tweets.append(tweet_data)
             
         return tweets
     
-    def save_to_sheets(self, spreadsheet_id: str, tweets: List[Dict]):
+    async def save_to_sheets(self, spreadsheet_id: str, tweets: List[Dict]) -> int:
         """
-        収集したツイートをGoogle Sheetsに保存
+        収集したツイートをGoogle Sheetsに保存（書き込み済みのURLの行は送らない）
         Args:
             spreadsheet_id: 保存先のスプレッドシートID
             tweets: 保存するツイートデータのリスト
+        Returns:
+            新たに追記した行数
         """
         # スプレッドシートに書き込むデータの整形
         values = [[
@@ -105,25 +136,26 @@ class TwitterAutomationPipeline:
             tweet['engagement_score'] # E列: エンゲージメントスコア
         ] for tweet in tweets]
         
-        # Google Sheetsへの書き込み実行
-        body = {'values': values}
-        self.sheets_service.spreadsheets().values().append(
-            spreadsheetId=spreadsheet_id,
-            range='Sheet1!A:E',  # A列からE列に書き込み
-            valueInputOption='RAW',
-            body=body
-        ).execute()
+        # Google Sheetsへの書き込み実行（API呼び出しはイベントループを止めないよう別スレッドで実行）
+        if self.sheets_service is None:
+            self.sheets_service = await asyncio.to_thread(self._setup_sheets_service)
+        if self.sheets_sink is None or self.sheets_sink.spreadsheet_id != spreadsheet_id:
+            self.sheets_sink = SheetsSink(
+                self.sheets_service,
+                spreadsheet_id,
+                range_name='Sheet1!A:E',  # A列からE列に書き込み
+                url_column=3              # D列のURLで重複を判定
+            )
+        added = await self.sheets_sink.add_rows(values)
+        # 投稿確認の入力待ちでタイマーが動かないため、ここで残りを書き込む
+        await self.sheets_sink.flush()
+        print(f"スプレッドシートに{added}件追記しました（重複 {len(values) - added}件は除外）")
+        return added
         
-    async def generate_post(self, tweet_data: Dict) -> str:
-        """
-        ステップ2: AIを使用して投稿文を生成
-        Args:
-            tweet_data: 参考にするツイートデータ
-        Returns:
-            生成された投稿文
-        """
+    def _build_prompt(self, tweet_data: Dict) -> str:
+        """投稿文生成のプロンプトを作成"""
         # AIへの指示プロンプト
-        prompt = f"""
+        return f"""
 以下のツイートを参考に、新しい投稿文を作成してください。
 オリジナルツイート: {tweet_data['text']}
 要件:
@@ -132,23 +164,39 @@ class TwitterAutomationPipeline:
 - ハッシュタグを1-2個付ける
 - 全体で140文字以内に収める
 """
-        
-        # OpenAI APIを使用して投稿文を生成
+
+    async def _complete(self, prompt: str) -> str:
+        """OpenAI API（または互換API）でプロンプトから投稿文を生成"""
+        import openai
+        openai.api_key = self.openai_key
+        if self.llm_base_url:
+            openai.api_base = self.llm_base_url
         response = await openai.ChatCompletion.acreate(
-            model="gpt-3.5-turbo",
+            model=self.llm_model,
             messages=[{"role": "user", "content": prompt}]
         )
         
         return response.choices[0].message.content
+
+    async def generate_post(self, tweet_data: Dict) -> str:
+        """
+        ステップ2: AIを使用して投稿文を生成
+        Args:
+            tweet_data: 参考にするツイートデータ
+        Returns:
+            生成された投稿文（同じプロンプトと元ツイートは生成済みのものを返す）
+        """
+        draft = await self.draft_generator.generate(tweet_data)
+        return draft['content']
         
-    async def post_tweet(self, content: str, image_path: str = None) -> bool:
+    async def approve(self, content: str, image_path: str = None) -> bool:
         """
-        ステップ3: 手動確認後にツイートを投稿
+        ステップ3: 投稿内容の手動確認
         Args:
             content: 投稿する文章
             image_path: 添付画像のパス（オプション）
         Returns:
-            投稿成功時True、キャンセルまたは失敗時False
+            承認された場合True
         """
         # 投稿内容の確認表示
         print("\n=== 投稿前確認 ===")
@@ -156,56 +204,148 @@ class TwitterAutomationPipeline:
         if image_path:
             print(f"添付画像: {image_path}")
             
-        # 手動承認の要求
-        confirm = input("\n投稿を承認しますか？ (y/n): ")
+        # 手動承認の要求（入力待ちの間も投稿文の生成が進むよう別スレッドで待つ）
+        confirm = await asyncio.to_thread(input, "\n投稿を承認しますか？ (y/n): ")
         if confirm.lower() != 'y':
             print("投稿がキャンセルされました")
             return False
+        return True
+
+    async def publish(self, content: str, media_paths: List[str] = None, reply_to: str = None) -> str:
+        """
+        ツイートを投稿（予約投稿のディスパッチャーからも呼ばれる）
+        Args:
+            content: 投稿する文章
+            media_paths: 添付画像のパスのリスト（オプション）
+            reply_to: リプライ先のツイートID（オプション）
+        Returns:
+            投稿したツイートID
+        """
+        # 画像・動画がある場合はアップロード（予約時に事前アップロード済みならキャッシュから取得）
+        media_ids = await self.media_uploader.upload_all(media_paths)
             
+        # ツイートの投稿
+        tweet = await self.twitter_client.create_tweet(
+            text=content,
+            media_ids=media_ids or None,
+            reply_to=reply_to
+        )
+        # 返信を追跡するため送信したツイートを登録
+        self.sent_index.record_sent(tweet.id, content, reply_to)
+        print("投稿が完了しました")
+        return tweet.id
+
+    def schedule_post(self, scheduler: PostScheduler, content: str, media_paths: List[str] = None,
+                      reply_to: str = None, source_url: str = None) -> float:
+        """
+        承認済みの投稿を予約し、添付メディアのアップロードを投稿時刻より前に始める
+        Returns:
+            投稿予定時刻（UNIX時間）
+        """
+        if media_paths:
+            self.media_uploader.prefetch(media_paths)
+        return scheduler.schedule(content, reply_to=reply_to, media_paths=media_paths, source_url=source_url)
+
+    async def post_tweet(self, content: str, image_path: str = None, reply_to: str = None) -> bool:
+        """
+        手動確認後にツイートをすぐに投稿
+        Args:
+            content: 投稿する文章
+            image_path: 添付画像のパス（オプション）
+            reply_to: リプライ先のツイートID（オプション）
+        Returns:
+            投稿成功時True、キャンセルまたは失敗時False
+        """
+        if not await self.approve(content, image_path):
+            return False
         try:
-            # 画像がある場合はアップロード
-            media_id = None
-            if image_path:
-                media_id = await self.twitter_client.upload_media(image_path)
-                
-            # ツイートの投稿
-            await self.twitter_client.create_tweet(
-                text=content,
-                media_ids=[media_id] if media_id else None
-            )
-            print("投稿が完了しました")
+            await self.publish(content, [image_path] if image_path else None, reply_to)
             return True
         except Exception as e:
             print(f"投稿エラー: {e}")
             return False
 
-async def main():
+    async def check_replies(self, max_pages: int = 5):
+        """
+        送信したツイートへの新しい返信をメンション通知から取得
+        Returns:
+            (送信ツイートID, 返信ツイート) のリスト
+        """
+        poller = MentionsPoller(self.twitter_client, self.sent_index)
+        return await poller.poll(max_pages=max_pages)
+
+async def main(search_query: str = "Python programming",
+               twitter_cookies_path: str = None,
+               openai_key: str = "your-openai-key",
+               sheets_creds_path: str = "sheets_credentials.json",
+               spreadsheet_id: str = "your-spreadsheet-id",
+               top_n: int = 3,
+               sheets_service=None,
+               llm_base_url: str = None,
+               draft_concurrency: int = 3,
+               post_interval: int = 300):
     """メイン実行関数"""
     # パイプラインの初期化
     pipeline = TwitterAutomationPipeline(
-        twitter_cookies_path="cookies.json",
-        openai_key="your-openai-key",
-        sheets_creds_path="sheets_credentials.json"
+        twitter_cookies_path=twitter_cookies_path,
+        openai_key=openai_key,
+        sheets_creds_path=sheets_creds_path,
+        sheets_service=sheets_service,
+        llm_base_url=llm_base_url,
+        draft_concurrency=draft_concurrency
     )
     await pipeline.setup()
+
+    # 予約投稿のディスパッチャーを起動（前回の実行で未投稿の予約も投稿する）
+    scheduler = PostScheduler(min_interval=post_interval)
+    dispatcher = asyncio.create_task(scheduler.run_dispatcher(pipeline.publish))
     
-    # ステップ1: ツイートの収集と保存
-    tweets = await pipeline.collect_tweets("Python programming")
-    pipeline.save_to_sheets("your-spreadsheet-id", tweets)
+    # ステップ1: ツイートの収集と保存（スプレッドシート未指定時は保存しない）
+    tweets = await pipeline.collect_tweets(search_query)
+    if spreadsheet_id:
+        await pipeline.save_to_sheets(spreadsheet_id, tweets)
     
-    # エンゲージメントの高い順にソート
+    # エンゲージメントの高い順にソートし、近似重複はクラスタ内で最上位の1件だけを候補にする
     sorted_tweets = sorted(tweets, key=lambda x: x['engagement_score'], reverse=True)
+    candidates = representatives(sorted_tweets, lambda x: x['cluster_id'])
+    if len(candidates) < len(sorted_tweets):
+        print(f"近似重複のツイート {len(sorted_tweets) - len(candidates)}件を候補から除外しました")
     
-    # 上位3つのツイートを処理
-    for tweet in sorted_tweets[:3]:
-        # ステップ2: AI投稿文の生成
-        generated_content = await pipeline.generate_post(tweet)
-        
-        # ステップ3: 手動確認と投稿
-        await pipeline.post_tweet(generated_content)
-        
-        # 投稿間隔を設定（5分）
-        await asyncio.sleep(300)
+    # ステップ2: 上位top_n件の投稿文を並列に生成し、できたものから承認キューへ
+    drafts = asyncio.Queue()
+    producer = asyncio.create_task(pipeline.draft_generator.produce(candidates[:top_n], drafts))
+
+    while (draft := await drafts.get()) is not None:
+        # ステップ3: 手動確認と予約（投稿間隔はスケジューラーが空ける）
+        if await pipeline.approve(draft['content']):
+            pipeline.schedule_post(scheduler, draft['content'], source_url=draft['source']['url'])
+
+    await producer
+
+    # 承認が終わったら終了する（投稿中の1件のみ待ち、残りの予約は run コマンドか次回の起動時に投稿）
+    scheduler.stop()
+    await dispatcher
+    remaining = scheduler.pending_count()
+    if remaining:
+        print(f"予約中の投稿が{remaining}件あります（python post_scheduler.py run で投稿します）")
+    scheduler.close()
+    # 出力ファイルは無いが、最後まで実行できたことをジョブ実行サマリーに伝える
+    return []
+
+
+async def dispatch_scheduled_posts(twitter_cookies_path: str = None, post_interval: int = 300):
+    """予約中の投稿をスロット時刻に投稿し、すべて終わったら終了する（収集・生成は行わない）"""
+    pipeline = TwitterAutomationPipeline(
+        twitter_cookies_path=twitter_cookies_path,
+        openai_key=None,
+        sheets_creds_path=None
+    )
+    await pipeline.setup()
+    scheduler = PostScheduler(min_interval=post_interval)
+    print(f"予約中の投稿: {scheduler.pending_count()}件")
+    await scheduler.run_dispatcher(pipeline.publish, stop_when_empty=True)
+    scheduler.close()
+    await pipeline.client_factory.aclose()
 
 if __name__ == "__main__":
     # スクリプトの実行
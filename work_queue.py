@@ -0,0 +1,534 @@
+"""
+SQLiteベースのローカル作業キュー
+目的: 大規模な分析を複数のワーカープロセス（それぞれ別のCookieセット）に分散する
+機能:
+- リース・可視性タイムアウト・リトライ付きのタスクキュー（外部ブローカー不要）
+- 処理待ち・処理中のタスクのみを対象にした重複排除（完了したタスクは再投入できる）
+- 長いタスクのリース期限の延長（ハートビート）
+- タスク種別: タイムラインのページ走査 / ユーザー解決 / 最近のツイート取得 / キーワード検索シャード
+- 全ワーカーが共有する結果ストア
+
+使い方:
+    python work_queue.py enqueue-replies sora19ai --pages 10
+    python work_queue.py worker --cookie twitter_json/cookie_a.json
+    python work_queue.py worker --cookie twitter_json/cookie_b.json
+    python work_queue.py report sora19ai --min-replies 3
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+from collections import Counter
+from datetime import datetime
+
+from record_utils import extract_mentions
+
+DEFAULT_DB_PATH = "work_queue/queue.db"
+# ユーザー情報を取得し直すまでの秒数（これより新しい結果があれば resolve_user を投入しない）
+USER_REFRESH_SECONDS = 86400
+
+
+class WorkQueue:
+    """リースと可視性タイムアウトを持つSQLiteタスクキュー"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, visibility_timeout=300):
+        self.db_path = db_path
+        # リース期限（秒）。期限内に完了しないタスクは他のワーカーに再配布される
+        self.visibility_timeout = visibility_timeout
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        # 自動コミットにして、リース取得は BEGIN IMMEDIATE で明示的にロックする
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._create_tables()
+
+    def _create_tables(self):
+        self._migrate_dedupe_key()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                dedupe_key TEXT,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 5,
+                available_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_expires REAL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_ready ON tasks (status, available_at);
+            -- 同じキーのタスクは処理待ち・処理中のものが1件だけ存在できる
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_active_dedupe ON tasks (dedupe_key)
+                WHERE status IN ('queued', 'leased');
+            CREATE TABLE IF NOT EXISTS results (
+                kind TEXT NOT NULL,
+                result_key TEXT NOT NULL,
+                task_id INTEGER,
+                worker TEXT,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (kind, result_key)
+            );
+        """)
+
+    def _migrate_dedupe_key(self):
+        """dedupe_key 列が UNIQUE だった以前の形式のテーブルを、制約なしの列に作り直す"""
+        row = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'tasks'"
+        ).fetchone()
+        if row is None or 'dedupe_key TEXT UNIQUE' not in row['sql']:
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute("ALTER TABLE tasks RENAME TO tasks_old")
+            self.conn.execute(row['sql'].replace('dedupe_key TEXT UNIQUE', 'dedupe_key TEXT'))
+            self.conn.execute("INSERT INTO tasks SELECT * FROM tasks_old")
+            self.conn.execute("DROP TABLE tasks_old")
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def enqueue(self, kind, payload, dedupe_key=None, max_attempts=5, delay=0):
+        """タスクを追加してIDを返す（同じdedupe_keyのタスクが処理待ち・処理中なら追加せずNone）"""
+        now = time.time()
+        cursor = self.conn.execute(
+            """INSERT OR IGNORE INTO tasks
+               (kind, payload, dedupe_key, max_attempts, available_at, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (kind, json.dumps(payload, ensure_ascii=False), dedupe_key,
+             max_attempts, now + delay, now, now)
+        )
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def lease(self, worker_id, kinds=None):
+        """実行可能なタスクを1件リースする（無ければNone）"""
+        now = time.time()
+        kind_filter = ""
+        params = [now, now]
+        if kinds:
+            kind_filter = f"AND kind IN ({','.join('?' for _ in kinds)})"
+            params.extend(kinds)
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                f"""SELECT * FROM tasks
+                    WHERE ((status = 'queued' AND available_at <= ?)
+                           OR (status = 'leased' AND lease_expires <= ?))
+                    {kind_filter}
+                    ORDER BY available_at, id LIMIT 1""",
+                params
+            ).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+
+            if row['attempts'] >= row['max_attempts']:
+                # リース切れのまま試行回数を使い切ったタスクは終了扱い
+                self.conn.execute(
+                    "UPDATE tasks SET status = 'dead', last_error = ?, updated_at = ? WHERE id = ?",
+                    (row['last_error'] or "リース期限切れ", now, row['id'])
+                )
+                self.conn.execute("COMMIT")
+                return self.lease(worker_id, kinds)
+
+            self.conn.execute(
+                """UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?,
+                   attempts = attempts + 1, updated_at = ? WHERE id = ?""",
+                (worker_id, now + self.visibility_timeout, now, row['id'])
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        task = dict(row)
+        task['payload'] = json.loads(task['payload'])
+        task['attempts'] += 1
+        return task
+
+    def heartbeat(self, task_id, worker_id):
+        """処理中タスクのリース期限を延長する"""
+        cursor = self.conn.execute(
+            """UPDATE tasks SET lease_expires = ?, updated_at = ?
+               WHERE id = ? AND status = 'leased' AND lease_owner = ?""",
+            (time.time() + self.visibility_timeout, time.time(), task_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, task_id, worker_id):
+        """タスクを完了にする（リースを保持しているワーカーのみ）"""
+        cursor = self.conn.execute(
+            """UPDATE tasks SET status = 'done', lease_owner = NULL, lease_expires = NULL,
+               updated_at = ? WHERE id = ? AND status = 'leased' AND lease_owner = ?""",
+            (time.time(), task_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, task_id, worker_id, error, base_delay=30):
+        """タスクを失敗として記録し、試行回数が残っていれば指数バックオフで再投入する"""
+        row = self.conn.execute(
+            "SELECT attempts, max_attempts FROM tasks WHERE id = ?", (task_id,)
+        ).fetchone()
+        if row is None:
+            return False
+        now = time.time()
+        if row['attempts'] >= row['max_attempts']:
+            status, available_at = 'dead', now
+        else:
+            status, available_at = 'queued', now + base_delay * (2 ** (row['attempts'] - 1))
+        cursor = self.conn.execute(
+            """UPDATE tasks SET status = ?, available_at = ?, last_error = ?,
+               lease_owner = NULL, lease_expires = NULL, updated_at = ?
+               WHERE id = ? AND status = 'leased' AND lease_owner = ?""",
+            (status, available_at, str(error), now, task_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def save_result(self, kind, result_key, data, task_id=None, worker_id=None):
+        """結果ストアに書き込む（同じキーは上書き）"""
+        self.conn.execute(
+            """INSERT OR REPLACE INTO results (kind, result_key, task_id, worker, data, created_at)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (kind, result_key, task_id, worker_id,
+             json.dumps(data, ensure_ascii=False, default=str), time.time())
+        )
+
+    def result_age(self, kind, result_key):
+        """結果が保存されてからの秒数（無ければNone）"""
+        row = self.conn.execute(
+            "SELECT created_at FROM results WHERE kind = ? AND result_key = ?", (kind, result_key)
+        ).fetchone()
+        return time.time() - row['created_at'] if row else None
+
+    def clear_results(self, kind, key_prefix=''):
+        """指定種別の結果を削除する（削除した件数を返す）"""
+        cursor = self.conn.execute(
+            "DELETE FROM results WHERE kind = ? AND substr(result_key, 1, ?) = ?",
+            (kind, len(key_prefix), key_prefix)
+        )
+        return cursor.rowcount
+
+    def get_result(self, kind, result_key):
+        """結果ストアから1件取得する"""
+        row = self.conn.execute(
+            "SELECT data FROM results WHERE kind = ? AND result_key = ?", (kind, result_key)
+        ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def iter_results(self, kind, key_prefix=''):
+        """指定種別の結果を順に返す"""
+        rows = self.conn.execute(
+            """SELECT result_key, data FROM results
+               WHERE kind = ? AND substr(result_key, 1, ?) = ? ORDER BY result_key""",
+            (kind, len(key_prefix), key_prefix)
+        )
+        for row in rows:
+            yield row['result_key'], json.loads(row['data'])
+
+    def stats(self):
+        """ステータスごとのタスク数を返す"""
+        rows = self.conn.execute("SELECT status, COUNT(*) AS n FROM tasks GROUP BY status")
+        return {row['status']: row['n'] for row in rows}
+
+    def close(self):
+        self.conn.close()
+
+
+class QueueWorker:
+    """キューからタスクを取り出してTwitter APIを呼び出すワーカー"""
+
+    def __init__(self, queue, cookie_path, worker_id=None, poll_interval=2.0):
+        self.queue = queue
+        self.cookie_path = cookie_path
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        # キューが空のときの待機間隔（秒）
+        self.poll_interval = poll_interval
+        self.handlers = {
+            'scan_timeline_page': self.scan_timeline_page,
+            'resolve_user': self.resolve_user,
+            'fetch_recent_tweets': self.fetch_recent_tweets,
+            'search_keyword_shard': self.search_keyword_shard,
+        }
+
+    async def setup(self):
+        """ワーカー専用のCookieセットで認証する"""
+        # twikitはワーカー起動時にのみ必要
+        from client_factory import get_client_factory
+
+        try:
+            self.client_factory = get_client_factory(self.cookie_path)
+            self.client = self.client_factory.get_client(language='en-US')
+            await self.client_factory.authenticate()
+            print(f"[{self.worker_id}] 認証に成功しました！")
+            return True
+        except Exception as e:
+            print(f"[{self.worker_id}] 認証エラー: {e}")
+            return False
+
+    async def scan_timeline_page(self, task):
+        """タイムラインを1ページ走査し、リプライ先を記録して次のページを投入する"""
+        payload = task['payload']
+        screen_name = payload['screen_name']
+        user_id = payload.get('user_id')
+        if not user_id:
+            user = await self.client.get_user_by_screen_name(screen_name)
+            user_id = user.id
+
+        page = payload.get('page', 0)
+        results = await self.client.get_user_tweets(
+            user_id,
+            tweet_type=payload.get('tweet_type', 'Replies'),
+            count=payload.get('count', 40),
+            cursor=payload.get('cursor')
+        )
+
+        tweets = []
+        for tweet in results:
+            mentioned_users = extract_mentions(tweet.text, exclude=screen_name)
+            tweets.append({'tweet_id': tweet.id, 'mentions': mentioned_users})
+            for reply_to in mentioned_users:
+                # 最近取得したユーザー情報は取得し直さない
+                age = self.queue.result_age('user', reply_to)
+                if age is not None and age < USER_REFRESH_SECONDS:
+                    continue
+                self.queue.enqueue('resolve_user', {'screen_name': reply_to},
+                                   dedupe_key=f"resolve_user:{reply_to}")
+
+        self.queue.save_result('timeline_page', f"{screen_name}:{page:06d}",
+                               {'tweets': tweets}, task['id'], self.worker_id)
+
+        if results.next_cursor and page + 1 < payload.get('max_pages', 5):
+            next_payload = dict(payload, user_id=user_id, cursor=results.next_cursor, page=page + 1)
+            self.queue.enqueue('scan_timeline_page', next_payload,
+                               dedupe_key=f"scan_timeline_page:{screen_name}:{page + 1}")
+
+    async def resolve_user(self, task):
+        """スクリーンネームからプロフィール情報を取得して保存する"""
+        screen_name = task['payload']['screen_name']
+        user = await self.client.get_user_by_screen_name(screen_name)
+        profile_data = {
+            'user_id': user.id,
+            'name': user.name,
+            'screen_name': user.screen_name,
+            'description': user.description,
+            'location': user.location,
+            'followers_count': user.followers_count,
+            'following_count': user.following_count,
+            'tweets_count': user.statuses_count,
+            'created_at': user.created_at,
+            'profile_image_url': user.profile_image_url
+        }
+        self.queue.save_result('user', screen_name, profile_data, task['id'], self.worker_id)
+
+    async def fetch_recent_tweets(self, task):
+        """ユーザーの最近のツイートを取得して保存する"""
+        payload = task['payload']
+        results = await self.client.get_user_tweets(
+            payload['user_id'], tweet_type='Tweets', count=payload.get('count', 3)
+        )
+        tweets = [{
+            'tweet_id': tweet.id,
+            'text': tweet.text,
+            'created_at': tweet.created_at,
+            'retweet_count': tweet.retweet_count,
+            'like_count': tweet.favorite_count,
+            'reply_count': tweet.reply_count,
+        } for tweet in results]
+        self.queue.save_result('recent_tweets', str(payload['user_id']), tweets,
+                               task['id'], self.worker_id)
+
+    async def search_keyword_shard(self, task):
+        """キーワード検索を1ページ取得し、次のページを投入する"""
+        payload = task['payload']
+        query = payload['query']
+        page = payload.get('page', 0)
+        results = await self.client.search_tweet(
+            query=query,
+            product=payload.get('product', 'Latest'),
+            count=payload.get('count', 20),
+            cursor=payload.get('cursor')
+        )
+        tweets = [{
+            'tweet_id': tweet.id,
+            'screen_name': tweet.user.screen_name,
+            'user_name': tweet.user.name,
+            'text': tweet.text,
+            'created_at': tweet.created_at,
+            'retweet_count': tweet.retweet_count,
+            'like_count': tweet.favorite_count,
+        } for tweet in results]
+        self.queue.save_result('search_page', f"{query}:{page:06d}", tweets,
+                               task['id'], self.worker_id)
+
+        if results.next_cursor and page + 1 < payload.get('max_pages', 5):
+            next_payload = dict(payload, cursor=results.next_cursor, page=page + 1)
+            self.queue.enqueue('search_keyword_shard', next_payload,
+                               dedupe_key=f"search_keyword_shard:{query}:{page + 1}")
+
+    async def _run_with_heartbeat(self, task):
+        """リース期限を延長しながらタスクを処理する（長いタスクが他のワーカーに再配布されないように）"""
+        job = asyncio.ensure_future(self.handlers[task['kind']](task))
+        interval = max(1.0, self.queue.visibility_timeout / 3)
+        try:
+            while True:
+                done, _ = await asyncio.wait({job}, timeout=interval)
+                if done:
+                    return job.result()
+                if not self.queue.heartbeat(task['id'], self.worker_id):
+                    print(f"[{self.worker_id}] タスク{task['id']}のリースを失いました（他のワーカーに再配布されています）")
+        finally:
+            if not job.done():
+                job.cancel()
+
+    async def run(self, max_tasks=None, exit_when_empty=False):
+        """タスクを取り出して処理し続ける"""
+        processed = 0
+        while max_tasks is None or processed < max_tasks:
+            task = self.queue.lease(self.worker_id, kinds=list(self.handlers))
+            if task is None:
+                if exit_when_empty:
+                    break
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            try:
+                await self._run_with_heartbeat(task)
+                self.queue.complete(task['id'], self.worker_id)
+            except Exception as e:
+                print(f"[{self.worker_id}] タスク{task['id']}（{task['kind']}）でエラー: {e}")
+                self.queue.fail(task['id'], self.worker_id, e)
+            processed += 1
+            if processed % 20 == 0:
+                print(f"[{self.worker_id}] {processed}件のタスクを処理済み")
+        return processed
+
+
+def collect_reply_counts(queue, screen_name):
+    """結果ストアのタイムラインページからリプライ先を集計する"""
+    reply_counter = Counter()
+    for _, page in queue.iter_results('timeline_page', f"{screen_name}:"):
+        for tweet in page['tweets']:
+            reply_counter.update(tweet['mentions'])
+    return reply_counter
+
+
+def build_report(queue, screen_name, min_replies=3):
+    """集計結果とユーザー情報を結合してレポートを作成する"""
+    report = []
+    for reply_to, reply_count in collect_reply_counts(queue, screen_name).most_common():
+        if reply_count < min_replies:
+            break
+        profile = queue.get_result('user', reply_to)
+        if profile is None:
+            continue
+        report.append({
+            'profile': profile,
+            'reply_count': reply_count,
+            'recent_tweets': queue.get_result('recent_tweets', str(profile['user_id'])) or []
+        })
+    return report
+
+
+async def run_worker(queue, cookie_path, max_tasks=None, exit_when_empty=False):
+    """ワーカーを認証してタスク処理を開始する"""
+    worker = QueueWorker(queue, cookie_path)
+    if not await worker.setup():
+        return 0
+    processed = await worker.run(max_tasks, exit_when_empty)
+    print(f"[{worker.worker_id}] 終了: {processed}件処理")
+    return processed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SQLite作業キュー")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('enqueue-replies', help="ユーザーのリプライ走査を投入")
+    p.add_argument('screen_name')
+    p.add_argument('--pages', type=int, default=5)
+
+    p = subparsers.add_parser('enqueue-search', help="キーワード検索を投入")
+    p.add_argument('query')
+    p.add_argument('--product', default='Latest')
+    p.add_argument('--pages', type=int, default=5)
+
+    p = subparsers.add_parser('enqueue-recent', help="頻出リプライ先の最近のツイート取得を投入")
+    p.add_argument('screen_name')
+    p.add_argument('--min-replies', type=int, default=3)
+
+    p = subparsers.add_parser('worker', help="ワーカーを起動")
+    p.add_argument('--cookie', default="twitter_json/cookie_edit.json")
+    p.add_argument('--max-tasks', type=int, default=None)
+    p.add_argument('--exit-when-empty', action='store_true')
+
+    p = subparsers.add_parser('report', help="集計結果を保存")
+    p.add_argument('screen_name')
+    p.add_argument('--min-replies', type=int, default=3)
+
+    subparsers.add_parser('stats', help="タスクの状態を表示")
+
+    args = parser.parse_args(argv)
+    queue = WorkQueue(args.db)
+
+    if args.command == 'enqueue-replies':
+        task_id = queue.enqueue('scan_timeline_page',
+                                {'screen_name': args.screen_name, 'page': 0, 'max_pages': args.pages},
+                                dedupe_key=f"scan_timeline_page:{args.screen_name}:0")
+        if task_id is None:
+            print(f"{args.screen_name}のリプライ走査は処理待ち・処理中のため投入しませんでした")
+        else:
+            # 前回の走査のページが集計に混ざらないよう、走査し直す前に削除する
+            queue.clear_results('timeline_page', f"{args.screen_name}:")
+            print(f"{args.screen_name}のリプライ走査を投入しました")
+    elif args.command == 'enqueue-search':
+        task_id = queue.enqueue('search_keyword_shard',
+                                {'query': args.query, 'product': args.product, 'page': 0, 'max_pages': args.pages},
+                                dedupe_key=f"search_keyword_shard:{args.query}:0")
+        if task_id is None:
+            print(f"'{args.query}' の検索は処理待ち・処理中のため投入しませんでした")
+        else:
+            queue.clear_results('search_page', f"{args.query}:")
+            print(f"'{args.query}' の検索を投入しました")
+    elif args.command == 'enqueue-recent':
+        count = skipped = 0
+        for reply_to, reply_count in collect_reply_counts(queue, args.screen_name).most_common():
+            if reply_count < args.min_replies:
+                break
+            profile = queue.get_result('user', reply_to)
+            if profile:
+                if queue.enqueue('fetch_recent_tweets', {'user_id': profile['user_id'], 'count': 3},
+                                 dedupe_key=f"fetch_recent_tweets:{profile['user_id']}") is None:
+                    skipped += 1
+                else:
+                    count += 1
+        print(f"{count}人分の最近のツイート取得を投入しました"
+              + (f"（処理待ち・処理中の{skipped}人分は投入せず）" if skipped else ""))
+    elif args.command == 'worker':
+        asyncio.run(run_worker(queue, args.cookie, args.max_tasks, args.exit_when_empty))
+    elif args.command == 'report':
+        report = build_report(queue, args.screen_name, args.min_replies)
+        os.makedirs("profile_results", exist_ok=True)
+        current_time = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = os.path.join("profile_results", f"analysis_{args.screen_name}_{current_time}.json")
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"分析結果を保存しました: {filename}（{len(report)}人）")
+    elif args.command == 'stats':
+        print(json.dumps(queue.stats(), ensure_ascii=False))
+
+    queue.close()
+
+
+if __name__ == "__main__":
+    main()